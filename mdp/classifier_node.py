@@ -113,22 +113,17 @@ def _check_train_args(self, x, labels):
             raise mdp.TrainingException(msg)
 
     def _train(self, x, labels):
-        """Cumulate all input data in a one dimensional list."""
-        self.tlen += x.shape[0]
-        self.data.extend(x.ravel().tolist())
-
+        """Cumulate all input data and labels."""
         # if labels is a number, all x's belong to the same class
         if isinstance(labels, (list, tuple, numx.ndarray)):
-            pass
+            labels = numx.asarray(labels).ravel()
         else:
-            labels = [labels] * x.shape[0]
-
-        self.labels.extend(labels.ravel().tolist())
+            labels = numx.array([labels] * x.shape[0])
+        super(ClassifierCumulator, self)._train(x, labels)
 
     def _stop_training(self, *args, **kwargs):
-        """Transform the data and labels lists to array objects and reshape them."""
-        self.data = numx.array(self.data, dtype=self.dtype)
+        """Transform the data and labels buffers to array objects."""
+        super(ClassifierCumulator, self)._stop_training(*args, **kwargs)
+        self.data = self.data.astype(self.dtype, copy=False)
         self.data.shape = (self.tlen, self.input_dim)
-        self.labels = numx.array(self.labels)
         self.labels.shape = (self.tlen)
-
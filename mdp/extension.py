@@ -43,7 +43,9 @@
 # the value stored in this attribute is the extension name
 _EXTENSION_ATTR_PREFIX = "_extension_for_"
 # list of attribute names that are not affected by extensions,
-_NON_EXTENSION_ATTRIBUTES = ["__module__", "__doc__", "extension_name"]
+# the constructor of an extension node is only used for its own instances
+_NON_EXTENSION_ATTRIBUTES = ["__module__", "__doc__", "extension_name",
+                             "__init__"]
 
 # keys under which the global activation and deactivation functions
 # for extensions can be stored in the extension registry
@@ -1,11 +1,13 @@
 from .graph import ( Graph, GraphEdge, GraphException, GraphNode,
                     GraphTopologicalException, is_sequence,
                     recursive_map, recursive_reduce)
+from .compact_graph import CompactGraph, CompactGraphAdapter
 
 __all__ = ['Graph', 'GraphEdge', 'GraphException', 'GraphNode',
            'GraphTopologicalException', 'is_sequence',
-           'recursive_map', 'recursive_reduce']
+           'recursive_map', 'recursive_reduce',
+           'CompactGraph', 'CompactGraphAdapter']
 
 from mdp.utils import fixup_namespace
 fixup_namespace(__name__, __all__,
-                ('graph','fixup_namespace',))
+                ('graph','compact_graph','fixup_namespace',))
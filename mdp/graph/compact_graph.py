@@ -0,0 +1,531 @@
+from builtins import range
+from builtins import object
+
+from collections import deque
+
+from mdp import numx
+from .graph import (GraphException, GraphTopologicalException,
+                    recursive_map, recursive_reduce)
+
+
+class CompactGraph(object):
+    """Represent a directed graph with integer indexed nodes and edges.
+
+    Nodes and edges are identified by the integer returned by `add_node`
+    and `add_edge`. Indices of removed nodes and edges are not reused.
+    Head and tail of the edges are stored in arrays, and each node keeps
+    the lists of its entering and outgoing edges together with the
+    position of each edge in those lists, so that edges (and nodes) can
+    be removed in constant time by swapping them with the last element.
+
+    The graph algorithms work on the integer indices and the compressed
+    sparse row (CSR) adjacency returned by `csr`. For code written
+    against the `Graph` interface use `CompactGraphAdapter`.
+    """
+
+    __slots__ = ('node_data', 'edge_data', '_node_alive', '_edge_alive',
+                 '_heads', '_tails', '_ein', '_eout', '_ein_pos', '_eout_pos',
+                 'n_nodes', 'n_edges')
+
+    def __init__(self):
+        # arbitrary data slots, indexed by node and edge index
+        self.node_data = []
+        self.edge_data = []
+        self._node_alive = []
+        self._edge_alive = []
+        # head and tail node of each edge
+        self._heads = numx.zeros(16, dtype='int64')
+        self._tails = numx.zeros(16, dtype='int64')
+        # entering and outgoing edges of each node
+        self._ein = []
+        self._eout = []
+        # position of each edge in the _ein list of its tail and
+        # in the _eout list of its head
+        self._ein_pos = []
+        self._eout_pos = []
+        self.n_nodes = 0
+        self.n_edges = 0
+
+    # node functions
+    def add_node(self, data=None):
+        """Add a node and return its index."""
+        self.node_data.append(data)
+        self._node_alive.append(True)
+        self._ein.append([])
+        self._eout.append([])
+        self.n_nodes += 1
+        return len(self.node_data) - 1
+
+    def _check_node(self, node):
+        if not (0 <= node < len(self.node_data) and self._node_alive[node]):
+            errstr = 'This node is not part of the graph (%s)' % node
+            raise GraphException(errstr)
+
+    def remove_node(self, node):
+        """Remove a node and all its edges."""
+        self._check_node(node)
+        for edge in self.edges_of(node):
+            self.remove_edge(edge)
+        self._node_alive[node] = False
+        self.node_data[node] = None
+        self.n_nodes -= 1
+
+    def nodes(self):
+        """Return the array of the indices of all nodes."""
+        return numx.flatnonzero(numx.array(self._node_alive, dtype='bool'))
+
+    def has_node(self, node):
+        return 0 <= node < len(self.node_data) and self._node_alive[node]
+
+    # edge functions
+    def add_edge(self, head, tail, data=None):
+        """Add an edge going from head to tail and return its index."""
+        self._check_node(head)
+        self._check_node(tail)
+        edge = len(self.edge_data)
+        if edge == len(self._heads):
+            self._heads = numx.concatenate((self._heads,
+                                            numx.zeros_like(self._heads)))
+            self._tails = numx.concatenate((self._tails,
+                                            numx.zeros_like(self._tails)))
+        self._heads[edge] = head
+        self._tails[edge] = tail
+        self.edge_data.append(data)
+        self._edge_alive.append(True)
+        self._eout_pos.append(len(self._eout[head]))
+        self._eout[head].append(edge)
+        self._ein_pos.append(len(self._ein[tail]))
+        self._ein[tail].append(edge)
+        self.n_edges += 1
+        return edge
+
+    @staticmethod
+    def _swap_remove(edges, positions, edge):
+        """Remove edge from the list edges in constant time."""
+        pos = positions[edge]
+        last = edges.pop()
+        if last != edge:
+            edges[pos] = last
+            positions[last] = pos
+
+    def remove_edge(self, edge):
+        if not (0 <= edge < len(self.edge_data) and self._edge_alive[edge]):
+            errstr = 'This edge is not part of the graph (%s)' % edge
+            raise GraphException(errstr)
+        head, tail = self.get_ends(edge)
+        self._swap_remove(self._eout[head], self._eout_pos, edge)
+        self._swap_remove(self._ein[tail], self._ein_pos, edge)
+        self._edge_alive[edge] = False
+        self.edge_data[edge] = None
+        self.n_edges -= 1
+
+    def edges(self):
+        """Return the array of the indices of all edges."""
+        return numx.flatnonzero(numx.array(self._edge_alive, dtype='bool'))
+
+    def has_edge(self, edge):
+        return 0 <= edge < len(self.edge_data) and self._edge_alive[edge]
+
+    def get_ends(self, edge):
+        """Return the tuple (head, tail) of an edge."""
+        return int(self._heads[edge]), int(self._tails[edge])
+
+    def get_head(self, edge):
+        return int(self._heads[edge])
+
+    def get_tail(self, edge):
+        return int(self._tails[edge])
+
+    def edges_in(self, node):
+        """Return a copy of the list of the edges entering node."""
+        return self._ein[node][:]
+
+    def edges_out(self, node):
+        """Return a copy of the list of the edges leaving node."""
+        return self._eout[node][:]
+
+    def edges_of(self, node):
+        return self._ein[node] + self._eout[node]
+
+    def in_degree(self, node):
+        return len(self._ein[node])
+
+    def out_degree(self, node):
+        return len(self._eout[node])
+
+    def degree(self, node):
+        return len(self._ein[node]) + len(self._eout[node])
+
+    def in_neighbors(self, node):
+        return [int(self._heads[edge]) for edge in self._ein[node]]
+
+    def out_neighbors(self, node):
+        return [int(self._tails[edge]) for edge in self._eout[node]]
+
+    def neighbors(self, node):
+        return self.in_neighbors(node) + self.out_neighbors(node)
+
+    ###### array representation
+
+    def csr(self, direction='out'):
+        """Return the adjacency in compressed sparse row format.
+
+        Return the tuple (indptr, indices, edges): the neighbours of node
+        i are ``indices[indptr[i]:indptr[i+1]]``, reached through the
+        edges with the same positions in ``edges``. direction is 'out'
+        for the sons, 'in' for the parents, or 'both' for the neighbours
+        in the equivalent undirected graph.
+        """
+        edges = self.edges()
+        heads = self._heads[edges]
+        tails = self._tails[edges]
+        if direction == 'out':
+            rows, cols = heads, tails
+        elif direction == 'in':
+            rows, cols = tails, heads
+        elif direction == 'both':
+            # parents first, as in GraphNode.neighbors
+            rows = numx.concatenate((tails, heads))
+            cols = numx.concatenate((heads, tails))
+            edges = numx.concatenate((edges, edges))
+        else:
+            raise GraphException("Unknown direction '%s'." % direction)
+        order = numx.argsort(rows, kind='mergesort')
+        counts = numx.bincount(rows, minlength=len(self.node_data))
+        indptr = numx.zeros(len(self.node_data) + 1, dtype='int64')
+        indptr[1:] = numx.cumsum(counts)
+        return indptr, cols[order], edges[order]
+
+    ###### graph algorithms
+
+    def topological_sort(self):
+        """Return the node indices in topological order. If the graph has a
+        cycle, throw a GraphTopologicalException with the list of
+        successfully ordered nodes."""
+        indptr, indices, _ = self.csr('out')
+        nodes = self.nodes()
+        edges = self.edges()
+        indegree = numx.bincount(self._tails[edges],
+                                 minlength=len(self.node_data))
+        # fifo queue of the nodes with in_degree 0
+        queue = list(nodes[indegree[nodes] == 0])
+        topological_list = []
+        pos = 0
+        while pos < len(queue):
+            node = queue[pos]
+            pos += 1
+            topological_list.append(int(node))
+            for son in indices[indptr[node]:indptr[node+1]]:
+                indegree[son] -= 1
+                if indegree[son] == 0:
+                    queue.append(son)
+        if len(topological_list) != len(nodes):
+            raise GraphTopologicalException(topological_list)
+        return topological_list
+
+    def _search(self, direction, root, depth_first, visit_fct=None):
+        indptr, indices, _ = self.csr(direction)
+        visited = numx.zeros(len(self.node_data), dtype='bool')
+        visited[root] = True
+        result = []
+        pending = deque([root])
+        while pending:
+            node = pending.pop() if depth_first else pending.popleft()
+            result.append(int(node))
+            if visit_fct is not None:
+                visit_fct(int(node))
+            sons = indices[indptr[node]:indptr[node+1]]
+            sons = sons[~visited[sons]]
+            # keep the first occurrence of each son
+            sons = sons[numx.sort(numx.unique(sons, return_index=True)[1])]
+            visited[sons] = True
+            pending.extend(sons)
+        return result
+
+    def dfs(self, root, visit_fct=None):
+        """Return a list of node indices in some Depth First order starting
+        from root. If defined, visit_fct is applied on each visited node
+        index."""
+        return self._search('out', root, True, visit_fct)
+
+    def undirected_dfs(self, root, visit_fct=None):
+        return self._search('both', root, True, visit_fct)
+
+    def bfs(self, root, visit_fct=None):
+        """Return a list of node indices in some Breadth First order
+        starting from root. If defined, visit_fct is applied on each
+        visited node index."""
+        return self._search('out', root, False, visit_fct)
+
+    def undirected_bfs(self, root, visit_fct=None):
+        return self._search('both', root, False, visit_fct)
+
+    def connected_components(self):
+        """Return an array with the index of the (weakly) connected
+        component of each node (-1 for removed nodes)."""
+        indptr, indices, _ = self.csr('both')
+        components = -numx.ones(len(self.node_data), dtype='int64')
+        n_components = 0
+        for node in self.nodes():
+            if components[node] >= 0:
+                continue
+            # label the whole component with a frontier expansion
+            frontier = numx.array([node])
+            components[node] = n_components
+            while len(frontier):
+                sons = numx.concatenate([indices[indptr[n]:indptr[n+1]]
+                                         for n in frontier])
+                sons = numx.unique(sons[components[sons] < 0])
+                components[sons] = n_components
+                frontier = sons
+            n_components += 1
+        return components
+
+
+class _CompactGraphNode(object):
+    """Node of a `CompactGraphAdapter`, with the `GraphNode` interface."""
+
+    __slots__ = ('_graph', 'index')
+
+    def __init__(self, graph, index):
+        self._graph = graph
+        self.index = index
+
+    def _get_data(self):
+        return self._graph.compact.node_data[self.index]
+
+    def _set_data(self, data):
+        self._graph.compact.node_data[self.index] = data
+
+    data = property(_get_data, _set_data)
+
+    def _edges(self, indices):
+        return [self._graph._edge_handles[edge] for edge in indices]
+
+    def get_edges_in(self, from_=None):
+        inedges = self._edges(self._graph.compact.edges_in(self.index))
+        if from_:
+            inedges = [edge for edge in inedges if edge.head == from_]
+        return inedges
+
+    def get_edges_out(self, to_=None):
+        outedges = self._edges(self._graph.compact.edges_out(self.index))
+        if to_:
+            outedges = [edge for edge in outedges if edge.tail == to_]
+        return outedges
+
+    def get_edges(self, neighbor=None):
+        return (self.get_edges_in(from_=neighbor) +
+                self.get_edges_out(to_=neighbor))
+
+    def in_degree(self):
+        return self._graph.compact.in_degree(self.index)
+
+    def out_degree(self):
+        return self._graph.compact.out_degree(self.index)
+
+    def degree(self):
+        return self._graph.compact.degree(self.index)
+
+    def in_neighbors(self):
+        return self._graph._node_list(
+            self._graph.compact.in_neighbors(self.index))
+
+    def out_neighbors(self):
+        return self._graph._node_list(
+            self._graph.compact.out_neighbors(self.index))
+
+    def neighbors(self):
+        return self.in_neighbors() + self.out_neighbors()
+
+
+class _CompactGraphEdge(object):
+    """Edge of a `CompactGraphAdapter`, with the `GraphEdge` interface."""
+
+    __slots__ = ('_graph', 'index')
+
+    def __init__(self, graph, index):
+        self._graph = graph
+        self.index = index
+
+    def _get_data(self):
+        return self._graph.compact.edge_data[self.index]
+
+    def _set_data(self, data):
+        self._graph.compact.edge_data[self.index] = data
+
+    data = property(_get_data, _set_data)
+
+    @property
+    def head(self):
+        return self._graph._node_handles[self._graph.compact.get_head(
+            self.index)]
+
+    @property
+    def tail(self):
+        return self._graph._node_handles[self._graph.compact.get_tail(
+            self.index)]
+
+    def get_ends(self):
+        return (self.head, self.tail)
+
+    def get_tail(self):
+        return self.tail
+
+    def get_head(self):
+        return self.head
+
+
+class CompactGraphAdapter(object):
+    """A `CompactGraph` with the same interface as `Graph`.
+
+    Nodes and edges are light-weight handle objects (one per node and
+    edge, so they can be compared and used as dictionary keys) that
+    redirect to the underlying `CompactGraph`, available as ``compact``.
+    Removing nodes and edges takes constant time, and the graph
+    algorithms run on the integer representation.
+    """
+
+    def __init__(self):
+        self.compact = CompactGraph()
+        # handles, indexed by node and edge index
+        self._node_handles = []
+        self._edge_handles = []
+        # cached lists of the current nodes and edges
+        self._nodes = None
+        self._edges = None
+
+    def _node_list(self, indices):
+        return [self._node_handles[index] for index in indices]
+
+    @property
+    def nodes(self):
+        """List of the nodes (do not modify it)."""
+        if self._nodes is None:
+            self._nodes = self._node_list(self.compact.nodes())
+        return self._nodes
+
+    @property
+    def edges(self):
+        """List of the edges (do not modify it)."""
+        if self._edges is None:
+            self._edges = [self._edge_handles[index]
+                           for index in self.compact.edges()]
+        return self._edges
+
+    # node functions
+    def add_node(self, data=None):
+        node = _CompactGraphNode(self, self.compact.add_node(data))
+        self._node_handles.append(node)
+        if self._nodes is not None:
+            self._nodes.append(node)
+        return node
+
+    def remove_node(self, node):
+        if node.index >= len(self._node_handles) or (
+                self._node_handles[node.index] is not node or
+                not self.compact.has_node(node.index)):
+            errstr = 'This node is not part of the graph (%s)' % node
+            raise GraphException(errstr)
+        self.compact.remove_node(node.index)
+        self._nodes = None
+        self._edges = None
+
+    # edge functions
+    def add_edge(self, head, tail, data=None):
+        edge = _CompactGraphEdge(self, self.compact.add_edge(head.index,
+                                                             tail.index,
+                                                             data))
+        self._edge_handles.append(edge)
+        if self._edges is not None:
+            self._edges.append(edge)
+        return edge
+
+    def remove_edge(self, edge):
+        self.compact.remove_edge(edge.index)
+        self._edges = None
+
+    ### populate functions
+
+    def add_nodes(self, data):
+        """Add many nodes at once.
+
+        data -- number of nodes to add or sequence of data values, one for
+                each new node"""
+        if not isinstance(data, (list, tuple)):
+            data = [None]*data
+        return [self.add_node(d) for d in data]
+
+    def add_tree(self, tree):
+        """Add a tree to the graph (see `Graph.add_tree`)."""
+        def _add_edge(root, son):
+            self.add_edge(root, son)
+            return root
+        nodes = recursive_map(self.add_node, tree)
+        recursive_reduce(_add_edge, nodes)
+        return nodes
+
+    def add_full_connectivity(self, from_nodes, to_nodes):
+        """Add full connectivity from a group of nodes to another one.
+        Return a list of lists of edges, one for each node in 'from_nodes'.
+        """
+        edges = []
+        for from_ in from_nodes:
+            edges.append([self.add_edge(from_, x) for x in to_nodes])
+        return edges
+
+    ###### graph algorithms
+
+    def topological_sort(self):
+        """Perform a topological sort of the nodes. If the graph has a cycle,
+        throw a GraphTopologicalException with the list of successfully
+        ordered nodes."""
+        try:
+            return self._node_list(self.compact.topological_sort())
+        except GraphTopologicalException as exc:
+            raise GraphTopologicalException(self._node_list(exc.args[0]))
+
+    def _search(self, search, root, visit_fct):
+        # call visit_fct with the node handles during the traversal
+        if visit_fct is None:
+            index_visit_fct = None
+        else:
+            def index_visit_fct(index):
+                visit_fct(self._node_handles[index])
+        return self._node_list(search(root.index, index_visit_fct))
+
+    def dfs(self, root, visit_fct=None):
+        """Return a list of nodes in some Depth First order starting from
+        a root node. If defined, visit_fct is applied on each visited node.
+        """
+        return self._search(self.compact.dfs, root, visit_fct)
+
+    def undirected_dfs(self, root, visit_fct=None):
+        return self._search(self.compact.undirected_dfs, root, visit_fct)
+
+    def bfs(self, root, visit_fct=None):
+        """Return a list of nodes in some Breadth First order starting from
+        a root node. If defined, visit_fct is applied on each visited node.
+        """
+        return self._search(self.compact.bfs, root, visit_fct)
+
+    def undirected_bfs(self, root, visit_fct=None):
+        return self._search(self.compact.undirected_bfs, root, visit_fct)
+
+    def connected_components(self):
+        """Return a list of lists containing the nodes of all connected
+        components of the graph."""
+        labels = self.compact.connected_components()
+        components = {}
+        order = []
+        for node in self.nodes:
+            label = labels[node.index]
+            if label not in components:
+                components[label] = []
+                order.append(label)
+            components[label].append(node)
+        return [components[label] for label in order]
+
+    def is_weakly_connected(self):
+        """Return True if the graph is weakly connected."""
+        return len(self.undirected_dfs(self.nodes[0]))==len(self.nodes)
@@ -4,6 +4,11 @@
 from past.utils import old_div
 __docformat__ = "restructuredtext en"
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 import mdp
 from mdp import ClassifierNode, utils, numx, numx_rand, numx_linalg
 
@@ -29,10 +34,27 @@ def _label(self, x):
 
 
 class PerceptronClassifier(ClassifierNode):
-    """A simple perceptron with input_dim input nodes."""
-    
-    def __init__(self, execute_method=None,
+    """A simple perceptron with input_dim input nodes.
+
+    By default the weights are updated after every single data point.
+    If ``batch_size`` is set, the data is processed in mini-batches: the
+    outputs for a whole mini-batch are computed with one matrix
+    multiplication and the summed updates are applied in one step.
+    With ``averaged=True`` the final weights are the average of the
+    weights after each update (averaged perceptron), which is usually
+    more robust for data that is not linearly separable.
+    """
+
+    def __init__(self, batch_size=None, averaged=False, execute_method=None,
                  input_dim=None, output_dim=None, dtype=None):
+        """
+        :Arguments:
+          batch_size
+            number of data points per update, ``None`` updates the
+            weights after each data point
+          averaged
+            if True, use the averaged weights after training
+        """
         super(PerceptronClassifier, self).__init__(
                                                 execute_method=execute_method,
                                                 input_dim=input_dim,
@@ -41,6 +63,12 @@ def __init__(self, execute_method=None,
         self.weights = []
         self.offset_weight = 0
         self.learning_rate = 0.1
+        self.batch_size = batch_size
+        self.averaged = averaged
+        # weighted sums of the weights after each update, used for averaging
+        self._weights_sum = 0.
+        self._offset_sum = 0.
+        self._n_averaged = 0
 
     def _check_train_args(self, x, labels):
         if (isinstance(labels, (list, tuple, numx.ndarray)) and
@@ -70,19 +98,39 @@ def _train(self, x, labels):
         if not len(self.weights):
             self.weights = numx.ones(self.input_dim)
 
-        for xi, labeli in mdp.utils.izip_stretched(x, labels):
-            new_weights = self.weights
-            new_offset = self.offset_weight
-
-            rate = self.learning_rate * (labeli - self._label(xi))
-            for j in range(self.input_dim):
-                new_weights[j] = self.weights[j] + rate * xi[j]
+        if self.batch_size is None:
+            for xi, labeli in mdp.utils.izip_stretched(x, labels):
+                rate = self.learning_rate * (labeli - self._label(xi))
+                self.weights += rate * xi
+                # the offset corresponds to a node with input 1 all the time
+                self.offset_weight += rate * 1
+                self._accumulate_average(1)
+            return
 
-            # the offset corresponds to a node with input 1 all the time
-            new_offset = self.offset_weight + rate * 1
+        if isinstance(labels, (list, tuple, numx.ndarray)):
+            labels = numx.asarray(labels)
+        else:
+            labels = numx.ones(x.shape[0]) * labels
+        for start in range(0, x.shape[0], self.batch_size):
+            x_batch = x[start:start+self.batch_size]
+            rates = self.learning_rate * (labels[start:start+self.batch_size] -
+                                          self._label(x_batch))
+            self.weights += numx.dot(rates, x_batch)
+            self.offset_weight += rates.sum()
+            self._accumulate_average(x_batch.shape[0])
+
+    def _accumulate_average(self, n):
+        """Add the current weights to the average, weighted by the number
+        of data points used in the last update."""
+        if self.averaged:
+            self._weights_sum = self._weights_sum + n * self.weights
+            self._offset_sum += n * self.offset_weight
+            self._n_averaged += n
 
-            self.weights = new_weights
-            self.offset_weight = new_offset
+    def _stop_training(self):
+        if self.averaged and self._n_averaged:
+            self.weights = self._weights_sum / self._n_averaged
+            self.offset_weight = self._offset_sum / self._n_averaged
 
     def _label(self, x):
         """Returns an array with class labels from the perceptron.
@@ -90,10 +138,49 @@ def _label(self, x):
         return numx.sign(numx.dot(x, self.weights) + self.offset_weight)
 
 
+# the connection (feature_id, label_id) is stored as the integer key
+# (feature_id << _LABEL_ID_BITS) | label_id
+_LABEL_ID_BITS = 32
+
+
+def _sum_by_key(keys, counts):
+    """Return the sorted unique keys and the sum of the counts of each."""
+    order = keys.argsort(kind='mergesort')
+    keys, counts = keys[order], counts[order]
+    starts = numx.concatenate(([True], keys[1:] != keys[:-1])).nonzero()[0]
+    return keys[starts], numx.add.reduceat(counts, starts)
+
+
+class _ReadOnlyDict(Mapping):
+    """Read-only view of a dictionary."""
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return repr(self._data)
+
+
 class SimpleMarkovClassifier(ClassifierNode):
     """A simple version of a Markov classifier.
     It can be trained on a vector of tuples the label being the next element
     in the testing data.
+
+    Features and labels are mapped to integer ids, and the counts of the
+    (feature, label) connections are stored in coordinate format (sorted
+    keys and counts), so that memory grows with the number of distinct
+    connections, and training and scoring work on whole chunks at once.
+    The ``features``, ``labels`` and ``connections`` dictionaries are
+    computed from these arrays and are therefore read-only.
     """
     def __init__(self, execute_method=None,
                  input_dim=None, output_dim=None, dtype=None):
@@ -104,10 +191,24 @@ def __init__(self, execute_method=None,
                                                 dtype=dtype)
         self.ntotal_connections = 0
 
-        self.features = {}
-        self.labels = {}
-        self.connections = {}
-        
+        # mappings from features and labels to their integer ids
+        self._feature_ids = {}
+        self._label_ids = {}
+        # features and labels in the order of their ids
+        self._feature_list = []
+        self._label_list = []
+        # number of occurrences of each feature and label id, the arrays
+        # grow geometrically as new features and labels appear
+        self._feature_counts = numx.zeros(0, dtype='int64')
+        self._label_counts = numx.zeros(0, dtype='int64')
+        # sorted connection keys and their counts
+        self._connection_keys = numx.zeros(0, dtype='int64')
+        self._connection_counts = numx.zeros(0, dtype='int64')
+        # (keys, counts) of the chunks not yet merged into the above
+        self._pending_connections = []
+        # dictionaries returned by the properties, reset by training
+        self._dict_cache = {}
+
     def _get_supported_dtypes(self):
         """Return the list of dtypes supported by this node."""
         return (mdp.utils.get_dtypes('Float') +
@@ -124,6 +225,95 @@ def _check_train_args(self, x, labels):
         if (not isinstance(labels, (list, tuple, numx.ndarray))):
             labels = [labels]
 
+    @property
+    def features(self):
+        """Read-only dictionary with the number of occurrences of each
+        feature."""
+        if 'features' not in self._dict_cache:
+            counts = self._feature_counts[:len(self._feature_list)]
+            self._dict_cache['features'] = dict(zip(self._feature_list,
+                                                    counts.tolist()))
+        return _ReadOnlyDict(self._dict_cache['features'])
+
+    @property
+    def labels(self):
+        """Read-only dictionary with the number of occurrences of each
+        label."""
+        if 'labels' not in self._dict_cache:
+            counts = self._label_counts[:len(self._label_list)]
+            self._dict_cache['labels'] = dict(zip(self._label_list,
+                                                  counts.tolist()))
+        return _ReadOnlyDict(self._dict_cache['labels'])
+
+    @property
+    def connections(self):
+        """Read-only dictionary with the number of occurrences of each
+        (feature, label) connection."""
+        if 'connections' not in self._dict_cache:
+            self._merge_connections()
+            keys = self._connection_keys
+            feature_ids = (keys >> _LABEL_ID_BITS).tolist()
+            label_ids = (keys & ((1 << _LABEL_ID_BITS) - 1)).tolist()
+            self._dict_cache['connections'] = dict(
+                ((self._feature_list[i], self._label_list[j]), count)
+                for i, j, count in zip(feature_ids, label_ids,
+                                       self._connection_counts.tolist()))
+        return _ReadOnlyDict(self._dict_cache['connections'])
+
+    def _unique_rows(self, x):
+        """Return the unique rows of x as tuples and the index of the
+        unique row for each row of x."""
+        x = numx.ascontiguousarray(x)
+        rows = x.view(numx.dtype((numx.void, x.dtype.itemsize * x.shape[1])))
+        _, first, inverse = numx.unique(rows.ravel(), return_index=True,
+                                        return_inverse=True)
+        return [tuple(x[i]) for i in first], inverse
+
+    def _get_ids(self, keys, ids, key_list, add):
+        """Return the ids of keys, unknown keys get id -1 unless add is
+        True, in which case they are added to the mapping."""
+        key_ids = numx.empty(len(keys), dtype='int64')
+        for i, key in enumerate(keys):
+            if key not in ids and add:
+                ids[key] = len(key_list)
+                key_list.append(key)
+            key_ids[i] = ids.get(key, -1)
+        return key_ids
+
+    def _get_label_ids(self, labels):
+        """Return the ids of the labels, new labels are added."""
+        if (isinstance(labels, numx.ndarray) and labels.ndim == 1 and
+            labels.dtype != object):
+            # homogeneous labels, only the distinct ones are looked up
+            label_set, label_idx = numx.unique(labels, return_inverse=True)
+            return self._get_ids(label_set.tolist(), self._label_ids,
+                                 self._label_list, True)[label_idx]
+        # labels can be any hashable objects
+        return self._get_ids(labels, self._label_ids, self._label_list, True)
+
+    def _add_counts(self, counts, ids, n):
+        """Add the occurrences of ids to counts, which is grown to at least
+        n entries if needed."""
+        if len(counts) < n:
+            new_counts = numx.zeros(max(n, 2*len(counts)), dtype='int64')
+            new_counts[:len(counts)] = counts
+            counts = new_counts
+        counts[:n] += numx.bincount(ids, minlength=n)
+        return counts
+
+    def _merge_connections(self):
+        """Merge the counts of the pending chunks into the sorted keys."""
+        if not self._pending_connections:
+            return
+        keys = [self._connection_keys]
+        counts = [self._connection_counts]
+        for chunk_keys, chunk_counts in self._pending_connections:
+            keys.append(chunk_keys)
+            counts.append(chunk_counts)
+        self._connection_keys, self._connection_counts = _sum_by_key(
+            numx.concatenate(keys), numx.concatenate(counts))
+        self._pending_connections = []
+
     def _train(self, x, labels):
         """Update the internal structures according to the input data 'x'.
 
@@ -133,72 +323,95 @@ def _train(self, x, labels):
               or a single label, in which case all input data is assigned to
               the same class.
         """
+        features, feature_idx = self._unique_rows(x)
+        feature_ids = self._get_ids(features, self._feature_ids,
+                                    self._feature_list, True)[feature_idx]
         # if labels is a number, all x's belong to the same class
-        for xi, labeli in mdp.utils.izip_stretched(x, labels):
-            self._learn(xi, labeli)
-
-    def _learn(self, feature, label):
-        feature = tuple(feature)
-        self.ntotal_connections += 1
-
-        if label in self.labels:
-            self.labels[label] += 1
-        else:
-            self.labels[label] = 1
-
-        if feature in self.features:
-            self.features[feature] += 1
-        else:
-            self.features[feature] = 1
-
-        connection = (feature, label)
-        if connection in self.connections:
-            self.connections[connection] += 1
+        if isinstance(labels, (list, tuple, numx.ndarray)):
+            label_ids = self._get_label_ids(labels)
         else:
-            self.connections[connection] = 1
+            label_ids = self._get_ids([labels], self._label_ids,
+                                      self._label_list, True)
+            label_ids = label_ids.repeat(x.shape[0])
+        self._feature_counts = self._add_counts(self._feature_counts,
+                                                feature_ids,
+                                                len(self._feature_list))
+        self._label_counts = self._add_counts(self._label_counts, label_ids,
+                                              len(self._label_list))
+        keys = (feature_ids << _LABEL_ID_BITS) | label_ids
+        self._pending_connections.append(
+            _sum_by_key(keys, numx.ones(len(keys), dtype='int64')))
+        # merge when the pending chunks are as large as the merged keys,
+        # so that the cost of a merge is proportional to the pending keys
+        n_pending = sum(len(chunk_keys)
+                        for chunk_keys, _ in self._pending_connections)
+        if n_pending >= len(self._connection_keys):
+            self._merge_connections()
+        self.ntotal_connections += x.shape[0]
+        self._dict_cache = {}
 
     def _prob(self, features):
-        return [self._prob_one(feature) for feature in features]
-
-    def _prob_one(self, feature):
-        feature = tuple(feature)
-        probabilities = {}
-
-        try:
-            n_feature_connections = self.features[feature]
-        except KeyError:
-            n_feature_connections = 0
-            # if n_feature_connections == 0, we get a division by zero
-            # we could throw here, but maybe it's best to simply return
-            # an empty dict object
-            return {}
-
-        for label in self.labels:
-            conn = (feature, label)
-            try:
-                n_conn = self.connections[conn]
-            except KeyError:
-                n_conn = 0
-
-            try:
-                n_label_connections = self.labels[label]
-            except KeyError:
-                n_label_connections = 0
-
-            p_feature_given_label = 1.0 * n_conn / n_label_connections
-            p_label = 1.0 * n_label_connections / self.ntotal_connections
-            p_feature = 1.0 * n_feature_connections / self.ntotal_connections
-            prob = 1.0 * p_feature_given_label * p_label / p_feature
-            probabilities[label] = prob
-        return probabilities
+        unique_features, feature_idx = self._unique_rows(features)
+        feature_ids = self._get_ids(unique_features, self._feature_ids,
+                                    self._feature_list, False)[feature_idx]
+        self._merge_connections()
+        keys = self._connection_keys
+        known = (feature_ids >= 0).nonzero()[0]
+        probs = numx.zeros((len(feature_ids), len(self._label_list)))
+        # the connections of a feature are contiguous in the sorted keys
+        starts = keys.searchsorted(feature_ids[known] << _LABEL_ID_BITS)
+        stops = keys.searchsorted((feature_ids[known] + 1) << _LABEL_ID_BITS)
+        lengths = stops - starts
+        idx = (starts.repeat(lengths) + numx.arange(lengths.sum()) -
+               (lengths.cumsum() - lengths).repeat(lengths))
+        rows = known.repeat(lengths)
+        # p(feature|label) * p(label) / p(feature) reduces to
+        # n(feature, label) / n(feature)
+        n_features = self._feature_counts[feature_ids[rows]]
+        probs[rows, keys[idx] & ((1 << _LABEL_ID_BITS) - 1)] = (
+            self._connection_counts[idx] / n_features.astype('d'))
+        # if the feature is unknown we would get a division by zero,
+        # we could throw here, but maybe it's best to simply return
+        # an empty dict object
+        is_known = feature_ids >= 0
+        return [dict(list(zip(self._label_list, prob))) if known_row else {}
+                for prob, known_row in zip(probs, is_known)]
+
+
+# number of neurons whose initial local fields are computed at once
+_HOPFIELD_BLOCK = 1024
 
 
 class DiscreteHopfieldClassifier(ClassifierNode):
-    """Node for simulating a simple discrete Hopfield model"""
+    """Node for simulating a simple discrete Hopfield model
+
+    The weights are stored as the integer sums of the Hebbian outer
+    products (i.e. not divided by ``input_dim``), in the smallest integer
+    type that can hold them. Patterns are retrieved for a whole batch at
+    once: at every step a block of neurons is updated for all the patterns
+    that have not converged yet. With ``block_size=1`` (the default) this
+    is the classical asynchronous update, larger blocks give a
+    block-asynchronous and ``block_size=input_dim`` a synchronous update.
+
+    The local fields of the neurons are computed once for all patterns and
+    then only updated with the weights of the neurons that flip, so a
+    sweep costs ``O(n_patterns * input_dim)`` plus ``O(input_dim)`` for
+    every flip. Each block of neurons is one Python-level step: with the
+    default ``block_size=1`` a sweep takes ``input_dim`` steps, which
+    dominates the recall time for small batches of patterns.
+    """
     # TODO: It is unclear if this belongs to classifiers or is a general node
     # because label space is a subset of feature space
-    def __init__(self, execute_method=None,
+    def __init__(self, block_size=1, max_iter=1000, execute_method=None,
                  input_dim=None, output_dim=None, dtype='b'):
+        """
+        :Arguments:
+          block_size
+            number of neurons updated simultaneously during the recall
+          max_iter
+            maximum number of sweeps over all neurons during the recall
+            (updates with ``block_size > 1`` are not guaranteed to converge)
+        """
         super(DiscreteHopfieldClassifier, self).__init__(
                                             execute_method=execute_method,
                                             input_dim=input_dim,
@@ -207,6 +420,8 @@ def __init__(self, execute_method=None,
         self._weight_matrix = 0 # assigning zero to ease addition
         self._num_patterns = 0
         self._shuffled_update = True
+        self.block_size = block_size
+        self.max_iter = max_iter
 
     def _get_supported_dtypes(self):
         return ['b']
@@ -217,14 +432,11 @@ def _train(self, x):
         x -- a matrix having different variables on different columns
             and observations on rows.
         """
-        for pattern in x:
-            self._train_one(pattern)
-
-    def _train_one(self, pattern):
-        pattern = mdp.utils.bool_to_sign(pattern)
-        weights = numx.outer(pattern, pattern)
-        self._weight_matrix += old_div(weights, float(self.input_dim))
-        self._num_patterns += 1
+        patterns = mdp.utils.bool_to_sign(x).astype('int32')
+        # Hebbian learning for all the patterns in one multiplication
+        self._weight_matrix = (self._weight_matrix +
+                               numx.dot(patterns.T, patterns))
+        self._num_patterns += x.shape[0]
 
     @property
     def memory_size(self):
@@ -241,44 +453,95 @@ def load_parameter(self):
     def _stop_training(self):
         # remove self-feedback
         # we could use numx.fill_diagonal, but thats numpy 1.4 only
-        for i in range(self.input_dim):
-            self._weight_matrix[i][i] = 0
+        weights = self._weight_matrix
+        weights[numx.arange(self.input_dim), numx.arange(self.input_dim)] = 0
+        # the weights are bounded by the number of patterns
+        for dtype in ('int8', 'int16', 'int32'):
+            if self._num_patterns <= numx.iinfo(dtype).max:
+                break
+        self._weight_matrix = weights.astype(dtype)
 
     def _label(self, x, threshold = 0):
         """Retrieves patterns from the associative memory.
         """
-        threshold = numx.zeros(self.input_dim) + threshold
-        return numx.array([self._label_one(pattern, threshold) for pattern in x])
-
-    def _label_one(self, pattern, threshold):
-        pattern = mdp.utils.bool_to_sign(pattern)
-
-        has_converged = False
-        while not has_converged:
-            has_converged = True
-            iter_order = list(range(len(self._weight_matrix)))
+        weights = self._weight_matrix
+        # the fields are sums of integer weights, which float32 represents
+        # exactly as long as they are smaller than 2**24
+        if self._num_patterns * self.input_dim < 1 << 24:
+            ftype = 'f'
+        else:
+            ftype = 'd'
+        # the weights are not normalized by the memory size
+        threshold = (numx.zeros(self.input_dim) + threshold) * self.input_dim
+        patterns = mdp.utils.bool_to_sign(x).astype('int8')
+        # local fields of all the neurons, computed once and then updated
+        # with the weights of the neurons that flip
+        fields = numx.empty((len(patterns), self.input_dim), dtype=ftype)
+        patterns_f = patterns.astype(ftype)
+        for start in range(0, self.input_dim, _HOPFIELD_BLOCK):
+            stop = start + _HOPFIELD_BLOCK
+            # the weight matrix is symmetric
+            w_rows = weights[start:stop].astype(ftype)
+            fields[:, start:stop] = numx.dot(patterns_f, w_rows.T)
+        del patterns_f
+        # indices of the patterns that are still changing
+        active = numx.arange(len(patterns))
+        for sweep in range(self.max_iter):
+            if not len(active):
+                break
+            current = patterns[active]
+            field = fields[active]
+            changed = numx.zeros(len(active), dtype='bool')
+            iter_order = numx.arange(self.input_dim)
             if self._shuffled_update:
                 numx_rand.shuffle(iter_order)
-            for row in iter_order:
-                w_row = self._weight_matrix[row]
-
-                thresh_row = threshold[row]
-                new_pattern_row = numx.sign(numx.dot(w_row, pattern) - thresh_row)
+            for start in range(0, self.input_dim, self.block_size):
+                block = iter_order[start:start+self.block_size]
+                new_values = numx.sign(field[:, block] -
+                                       threshold[block]).astype('int8')
+                old_values = current[:, block]
+                # Following McKay, Neural Networks, we do nothing
+                # when the new pattern is zero
+                unchanged = new_values == 0
+                new_values[unchanged] = old_values[unchanged]
+                flipped = (new_values != old_values).any(axis=1).nonzero()[0]
+                if not len(flipped):
+                    continue
+                changed[flipped] = True
+                delta = (new_values[flipped] -
+                         old_values[flipped]).astype(ftype)
+                field[flipped] += numx.dot(delta, weights[block].astype(ftype))
+                current[:, block] = new_values
+            patterns[active] = current
+            fields[active] = field
+            active = active[changed]
+        return mdp.utils.sign_to_bool(patterns)
+
+
+# maximum number of entries of the point-centroid distance matrices
+_KMEANS_BLOCK_SIZE = 1 << 20
 
-                if new_pattern_row == 0:
-                    # Following McKay, Neural Networks, we do nothing
-                    # when the new pattern is zero
-                    pass
-                elif pattern[row] != new_pattern_row:
-                    has_converged = False
-                    pattern[row] = new_pattern_row
-        return mdp.utils.sign_to_bool(pattern)
-
-# TODO: Make it more efficient
 
 class KMeansClassifier(ClassifierNode):
-    """Employs K-Means Clustering for a given number of centroids."""
-    def __init__(self, num_clusters, max_iter=10000, execute_method=None,
+    """Employs K-Means Clustering for a given number of centroids.
+
+    Three training algorithms are available:
+
+    - ``'lloyd'`` (default) stores all the training data and runs the
+      standard batch iterations in ``stop_training``;
+    - ``'hamerly'`` computes the same solution as ``'lloyd'`` but keeps
+      upper and lower bounds on the distances of every point to its
+      closest and second closest centroid, so that by the triangle
+      inequality most of the distance computations can be skipped. This
+      pays off for a large number of clusters;
+    - ``'minibatch'`` does not store the training data: the centroids are
+      updated with every training chunk (each centroid moves to the
+      running mean of the points assigned to it), so that memory is
+      bounded by the chunk size.
+    """
+    def __init__(self, num_clusters, max_iter=10000, algorithm='lloyd',
+                 init='random', block_size=_KMEANS_BLOCK_SIZE,
+                 execute_method=None,
                  input_dim=None, output_dim=None, dtype=None):
         """
         :Arguments:
@@ -287,65 +550,226 @@ def __init__(self, num_clusters, max_iter=10000, execute_method=None,
           max_iter
             if the algorithm does not reach convergence (for some
             numerical reason), stop after ``max_iter`` iterations
+          algorithm
+            one of ``'lloyd'``, ``'hamerly'`` or ``'minibatch'``
+          init
+            initialization of the centroids, either ``'random'`` (random
+            data points) or ``'k-means++'``. In the ``'minibatch'`` mode
+            the initial centroids are chosen from the first training
+            chunk(s)
+          block_size
+            maximum number of entries of the point-centroid distance
+            matrices computed at once
         """
         super(KMeansClassifier, self).__init__(execute_method=execute_method,
                                                input_dim=input_dim,
                                                output_dim=output_dim,
                                                dtype=dtype)
+        if algorithm not in ('lloyd', 'hamerly', 'minibatch'):
+            err = "Unknown k-means algorithm '%s'." % str(algorithm)
+            raise mdp.NodeException(err)
+        if init not in ('random', 'k-means++'):
+            err = "Unknown k-means initialization '%s'." % str(init)
+            raise mdp.NodeException(err)
         self._num_clusters = num_clusters
+        self.algorithm = algorithm
+        self.init = init
+        self.block_size = block_size
         self.data = []
         self.tlen = 0
         self._centroids = None
+        # number of points assigned to each centroid (minibatch mode only)
+        self._counts = None
         self.max_iter = max_iter
 
     def _train(self, x):
-        # append all data
-        # we could use a Cumulator class here
         self.tlen += x.shape[0]
-        self.data.extend(x.ravel().tolist())
+        if self.algorithm == 'minibatch':
+            self._train_minibatch(x)
+        else:
+            # append all data
+            # we could use a Cumulator class here
+            self.data.append(x)
+
+    def _train_minibatch(self, x):
+        if self._centroids is None:
+            # collect data until we can choose the initial centroids
+            self.data.append(x)
+            if self.tlen < self._num_clusters:
+                return
+            x = numx.concatenate(self.data)
+            self.data = []
+            self._centroids = self._initial_centroids(x)
+        if self._counts is None:
+            # the centroids may also have been set before training
+            self._centroids = numx.array(self._centroids, dtype='d')
+            self._counts = numx.zeros(self._num_clusters)
+        idx = self._nearest_centroid_idx(x, self._centroids)
+        counts = numx.bincount(idx, minlength=self._num_clusters)
+        sums = self._cluster_sums(x, idx)
+        self._counts += counts
+        assigned = counts > 0
+        # move the centroids to the running mean of their points
+        self._centroids[assigned] += ((sums[assigned] -
+                                       counts[assigned, numx.newaxis] *
+                                       self._centroids[assigned]) /
+                                      self._counts[assigned, numx.newaxis])
 
     def _stop_training(self):
-        self.data = numx.array(self.data, dtype=self.dtype)
-        self.data.shape = (self.tlen, self.input_dim)
+        if self.algorithm == 'minibatch':
+            if self._centroids is None:
+                err = ("Not enough training data for %d clusters "
+                       "(%d data points)." % (self._num_clusters, self.tlen))
+                raise mdp.TrainingException(err)
+            del self.data
+            return
+
+        self.data = numx.concatenate(self.data).astype(self.dtype)
 
         # choose initial centroids unless they are already given
-        if not self._centroids:
-            import random
-            centr_idx = random.sample(range(self.tlen), self._num_clusters)
-            #numx_rand.permutation(self.tlen)[:self._num_clusters]
-            centroids = self.data[centr_idx]
+        if self._centroids is None:
+            centroids = self._initial_centroids(self.data)
         else:
             centroids = self._centroids
 
+        if self.algorithm == 'hamerly':
+            self._centroids = self._hamerly(centroids)
+        else:
+            self._centroids = self._lloyd(centroids)
+
+    def _initial_centroids(self, x):
+        if self.init == 'k-means++':
+            return self._kmeans_plusplus(x)
+        import random
+        centr_idx = random.sample(range(len(x)), self._num_clusters)
+        return x[centr_idx].astype('d')
+
+    def _kmeans_plusplus(self, x):
+        """Choose the centroids among the points of x, each new one with
+        probability proportional to the square distance from the closest
+        centroid chosen so far.
+        """
+        centroids = numx.empty((self._num_clusters, x.shape[1]))
+        centroids[0] = x[numx_rand.randint(len(x))]
+        min_dists = ((x - centroids[0])**2).sum(axis=1)
+        for i in range(1, self._num_clusters):
+            cumdists = min_dists.cumsum()
+            if cumdists[-1] > 0.:
+                idx = cumdists.searchsorted(numx_rand.random()*cumdists[-1],
+                                            side='right')
+                idx = min(idx, len(x)-1)
+            else:
+                idx = numx_rand.randint(len(x))
+            centroids[i] = x[idx]
+            min_dists = numx.minimum(min_dists,
+                                     ((x - centroids[i])**2).sum(axis=1))
+        return centroids
+
+    def _cluster_sums(self, x, idx):
+        """Return the sum of the points of x assigned to each centroid."""
+        sums = numx.zeros((self._num_clusters, x.shape[1]))
+        for j in range(x.shape[1]):
+            sums[:, j] = numx.bincount(idx, weights=x[:, j],
+                                       minlength=self._num_clusters)
+        return sums
+
+    def _new_centroids(self, idx, centroids):
+        """Return the means of the clusters, empty clusters keep their
+        old position.
+        """
+        counts = numx.bincount(idx, minlength=self._num_clusters)
+        sums = self._cluster_sums(self.data, idx)
+        new_centroids = centroids.copy()
+        assigned = counts > 0
+        new_centroids[assigned] = (sums[assigned] /
+                                   counts[assigned, numx.newaxis])
+        return new_centroids
+
+    def _lloyd(self, centroids):
         for step in range(self.max_iter):
-            # list of (sum_position, num_clusters)
-            new_centroids = [(0., 0.)] * len(centroids)
-            # cluster
-            for x in self.data:
-                idx = self._nearest_centroid_idx(x, centroids)
-                # update position and count
-                pos_count = (new_centroids[idx][0] + x,
-                             new_centroids[idx][1] + 1.)
-                new_centroids[idx] = pos_count
-
-            # get new centroid position
-            new_centroids = numx.array([old_div(c[0], c[1]) if c[1]>0. else centroids[idx]
-                                        for idx, c in enumerate(new_centroids)])
+            idx = self._nearest_centroid_idx(self.data, centroids)
+            new_centroids = self._new_centroids(idx, centroids)
             # check if we are stable
             if numx.all(new_centroids == centroids):
-                self._centroids = centroids
-                return
+                break
             centroids = new_centroids
+        return centroids
+
+    def _hamerly(self, centroids):
+        """Lloyd iterations accelerated with Hamerly's distance bounds."""
+        x = self.data
+        idx, upper, lower = self._two_nearest_centroids(x, centroids)
+        for step in range(self.max_iter):
+            new_centroids = self._new_centroids(idx, centroids)
+            moves = numx.sqrt(((new_centroids - centroids)**2).sum(axis=1))
+            if numx.all(new_centroids == centroids):
+                break
+            centroids = new_centroids
+            upper += moves[idx]
+            lower -= moves.max()
+            # half the distance from each centroid to the closest other one
+            cdists = numx.sqrt(self._square_distances(centroids, centroids))
+            cdists[numx.diag_indices_from(cdists)] = numx.inf
+            half_min = 0.5 * cdists.min(axis=1)
+            bound = numx.maximum(half_min[idx], lower)
+            # tighten the upper bounds where needed
+            check = (upper > bound).nonzero()[0]
+            if not len(check):
+                continue
+            upper[check] = numx.sqrt(
+                ((x[check] - centroids[idx[check]])**2).sum(axis=1))
+            check = check[upper[check] > bound[check]]
+            if not len(check):
+                continue
+            # full distance computation only for the remaining points
+            idx[check], upper[check], lower[check] = \
+                self._two_nearest_centroids(x[check], centroids)
+        return centroids
+
+    def _square_distances(self, x, centroids):
+        square_distances = ((x*x).sum(1)[:, numx.newaxis]
+                            + (centroids*centroids).sum(1))
+        square_distances -= 2 * numx.dot(x, centroids.T)
+        # rounding errors can give small negative values
+        return numx.maximum(square_distances, 0.)
+
+    def _blocks(self, n_points, n_centroids):
+        """Return the slices of the blocks of points for which the
+        distances to all centroids are computed at once."""
+        block = max(1, self.block_size // max(1, n_centroids))
+        return [slice(start, start+block)
+                for start in range(0, n_points, block)]
 
     def _nearest_centroid_idx(self, data, centroids):
-        dists = numx.array([numx.linalg.norm(data - c) for c in centroids])
-        return dists.argmin()
+        idx = numx.empty(len(data), dtype='int64')
+        for block in self._blocks(len(data), len(centroids)):
+            idx[block] = self._square_distances(data[block],
+                                                centroids).argmin(axis=1)
+        return idx
+
+    def _two_nearest_centroids(self, x, centroids):
+        """Return the index of the closest centroid of each point, and the
+        distances to the closest and second closest centroid (inf if there
+        is only one centroid)."""
+        idx = numx.empty(len(x), dtype='int64')
+        first = numx.empty(len(x))
+        second = numx.empty(len(x))
+        second.fill(numx.inf)
+        for block in self._blocks(len(x), len(centroids)):
+            dists = self._square_distances(x[block], centroids)
+            rows = numx.arange(len(dists))
+            idx[block] = dists.argmin(axis=1)
+            first[block] = dists[rows, idx[block]]
+            if len(centroids) > 1:
+                dists[rows, idx[block]] = numx.inf
+                second[block] = dists.min(axis=1)
+        return idx, numx.sqrt(first), numx.sqrt(second)
 
     def _label(self, x):
         """For a set of feature vectors x, this classifier returns
         a list of centroids.
         """
-        return [self._nearest_centroid_idx(xi, self._centroids) for xi in x]
+        return self._nearest_centroid_idx(x, self._centroids).tolist()
 
 
 class GaussianClassifier(ClassifierNode):
@@ -362,12 +786,17 @@ def __init__(self, execute_method=False,
                                                  output_dim=output_dim,
                                                  dtype=dtype)
         self._cov_objs = {}  # only stored during training
-        # this list contains the square root of the determinant of the
+        # this list contains the logarithm of the determinant of the
         # corresponding covariance matrix
-        self._sqrt_def_covs = []
+        self._log_det_covs = []
         # we are going to store the inverse of the covariance matrices
         # since only those are useful to compute the probabilities
         self.inv_covs = []
+        # the inverse Cholesky factors of all classes are stacked in a
+        # (input_dim, n_classes*input_dim) matrix, so that the whitened
+        # data for all classes is obtained with a single multiplication
+        self._stacked_inv_chols = None
+        self._stacked_offsets = None
         self.means = []
         self.p = []  # number of observations
         self.labels = None
@@ -412,62 +841,92 @@ def _stop_training(self):
         self.labels = list(self._cov_objs.keys())
         self.labels.sort()
         nitems = 0
+        inv_chols = []
         for lbl in self.labels:
             cov, mean, p = self._cov_objs[lbl].fix()
             nitems += p
-            self._sqrt_def_covs.append(numx.sqrt(numx_linalg.det(cov)))
-            if self._sqrt_def_covs[-1] == 0.0:
-                err = ("The covariance matrix is singular for at least "
-                       "one class.")
-                raise mdp.NodeException(err)
+            inv_chol = self._inv_cholesky(cov)
+            self._log_det_covs.append(-2. * numx.log(inv_chol.diagonal()).sum())
             self.means.append(mean)
             self.p.append(p)
-            self.inv_covs.append(utils.inv(cov))
+            self.inv_covs.append(utils.mult(inv_chol.T, inv_chol))
+            inv_chols.append(inv_chol.T)
 
         for i in range(len(self.p)):
             self.p[i] /= float(nitems)
 
+        self._stacked_inv_chols = numx.hstack(inv_chols)
+        self._stacked_offsets = numx.hstack(
+            [utils.mult(self.means[i], inv_chols[i])
+             for i in range(len(self.labels))])
         del self._cov_objs
 
-    def _gaussian_prob(self, x, lbl_idx):
-        """Return the probability of the data points x with respect to a
-        gaussian.
-
-        Input arguments:
-        x -- Input data
-        S -- Covariance matrix
-        mn -- Mean
+    def _inv_cholesky(self, cov):
+        """Return the inverse of the lower Cholesky factor of cov."""
+        try:
+            if mdp.numx_description == 'scipy':
+                chol = numx_linalg.cholesky(cov, lower=True)
+            else:
+                chol = numx_linalg.cholesky(cov)
+            inv_chol = utils.inv(chol)
+        except numx_linalg.LinAlgError:
+            inv_chol = None
+        if (inv_chol is None or not numx.all(numx.isfinite(inv_chol)) or
+            numx.any(inv_chol.diagonal() <= 0.)):
+            err = ("The covariance matrix is singular for at least "
+                   "one class.")
+            raise mdp.NodeException(err)
+        return inv_chol
+
+    def _log_gaussian_probs(self, x, lbl_idx=None):
+        """Return the log-likelihood of the data points x with respect to
+        the gaussians of all classes, as a (len(x), n_classes) array.
+
+        If lbl_idx is given, only the gaussian of the class with that index
+        is used and a (len(x), 1) array is returned.
         """
         x = self._refcast(x)
-
         dim = self.input_dim
-        sqrt_detS = self._sqrt_def_covs[lbl_idx]
-        invS = self.inv_covs[lbl_idx]
-        # subtract the mean
-        x_mn = x - self.means[lbl_idx][numx.newaxis, :]
+        log_det_covs = numx.asarray(self._log_det_covs)
+        if lbl_idx is None:
+            n_labels = len(self.labels)
+            inv_chols = self._stacked_inv_chols
+            offsets = self._stacked_offsets
+        else:
+            n_labels = 1
+            cols = slice(lbl_idx*dim, (lbl_idx+1)*dim)
+            inv_chols = self._stacked_inv_chols[:, cols]
+            offsets = self._stacked_offsets[cols]
+            log_det_covs = log_det_covs[lbl_idx:lbl_idx+1]
+        # whitened data for all classes at once
+        white = utils.mult(x, inv_chols) - offsets
+        white = white.reshape((x.shape[0], n_labels, dim))
         # exponent
-        exponent = -0.5 * (utils.mult(x_mn, invS)*x_mn).sum(axis=1)
+        exponent = -0.5 * (white*white).sum(axis=2)
         # constant
-        constant = old_div((2.*numx.pi)**(old_div(-dim,2.)), sqrt_detS)
-        # probability
-        return constant * numx.exp(exponent)
+        log_constant = (-0.5 * dim * numx.log(2.*numx.pi) -
+                        0.5 * log_det_covs)
+        return exponent + log_constant
+
+    def _gaussian_prob(self, x, lbl_idx):
+        """Return the probability of the data points x with respect to the
+        gaussian of the class with index lbl_idx.
+        """
+        return numx.exp(self._log_gaussian_probs(x, lbl_idx)[:, 0])
 
     def class_probabilities(self, x):
         """Return the posterior probability of each class given the input."""
         self._pre_execution_checks(x)
 
-        # compute the probability for each class
-        tmp_prob = numx.zeros((x.shape[0], len(self.labels)),
-                              dtype=self.dtype)
-        for i in range(len(self.labels)):
-            tmp_prob[:, i] = self._gaussian_prob(x, i)
-            tmp_prob[:, i] *= self.p[i]
-
-        # normalize to probability 1
-        # (not necessary, but sometimes useful)
+        # compute the log probability for each class
+        log_prob = self._log_gaussian_probs(x) + numx.log(self.p)
+        # normalize to probability 1 with the log-sum-exp trick,
+        # which avoids underflows for points far from all the means
+        log_prob -= log_prob.max(axis=1)[:, numx.newaxis]
+        tmp_prob = numx.exp(log_prob)
         tmp_tot = tmp_prob.sum(axis=1)
         tmp_tot = tmp_tot[:, numx.newaxis]
-        return old_div(tmp_prob, tmp_tot)
+        return (tmp_prob / tmp_tot).astype(self.dtype)
 
     def _prob(self, x):
         """Return the posterior probability of each class given the input in a dict."""
@@ -543,35 +1002,75 @@ def _stop_training(self):
             
     def _label(self, x):
         """Classify the data based on minimal distance to mean."""
-        n_labels = len(self.ordered_labels)
-        differences = x[:,:,numx.newaxis].repeat(n_labels, 2). \
-                        swapaxes(1,2) - self.ordered_means
-        square_distances = (differences**2).sum(2)
+        # expand |x - m|^2 to avoid the (n_points, n_labels, dim) array
+        square_distances = ((x*x).sum(1)[:, numx.newaxis]
+                            + (self.ordered_means**2).sum(1))
+        square_distances -= 2 * numx.dot(x, self.ordered_means.T)
         label_indices = square_distances.argmin(1)
         labels = [self.ordered_labels[i] for i in label_indices]
         return labels
     
     
+# maximum number of entries of the distance matrix in the exact search
+_KNN_BLOCK_SIZE = 1 << 22
+# number of queries hashed at once in the LSH search
+_LSH_QUERY_BLOCK = 1000
+
+
 class KNNClassifier(ClassifierNode):
-    """K-Nearest-Neighbour Classifier."""
+    """K-Nearest-Neighbour Classifier.
+
+    By default the labels are determined by an exact search over all the
+    stored samples. For large sample sets an approximate search can be
+    enabled with ``approx='lsh'``: at the end of the training phase a
+    random-projection locality sensitive hashing (LSH) index is built, and
+    each query is only compared with the samples that fall into the same
+    bucket in at least one of the hash tables.
+    """
     
-    def __init__(self, k=1, execute_method=None,
+    def __init__(self, k=1, approx=None, n_tables=8, n_bits=12,
+                 block_size=_KNN_BLOCK_SIZE, execute_method=None,
                  input_dim=None, output_dim=None, dtype=None):
         """Initialize classifier.
         
         k -- Number of closest sample points that are taken into account.
+        approx -- Set to 'lsh' to use the approximate nearest neighbour
+            search. The default None performs an exact search.
+        n_tables -- Number of LSH hash tables. More tables increase the
+            recall of the approximate search at the cost of latency.
+        n_bits -- Number of random hyperplanes per hash table. More bits
+            mean smaller buckets, i.e. faster queries but lower recall.
+            The bucket keys are 64 bit integers, so at most 62 bits are
+            supported.
+        block_size -- Maximum number of entries of the distance matrix
+            computed at once in the exact search.
         """
         super(KNNClassifier, self).__init__(execute_method=execute_method,
                                             input_dim=input_dim,
                                             output_dim=output_dim,
                                             dtype=dtype)
+        if approx not in (None, 'lsh'):
+            err = "Unknown approximation method '%s'." % str(approx)
+            raise mdp.NodeException(err)
+        if not 0 < n_bits <= 62:
+            err = "n_bits must be between 1 and 62 (%d given)." % n_bits
+            raise mdp.NodeException(err)
         self.k = k
+        self.approx = approx
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.block_size = block_size
         self._label_samples = {}  # temporary variable during training
         self.n_samples = None
         # initialized after training:
         self.samples = None  # 2d array with all samples
         self.sample_label_indices = None  # 1d array for label indices
         self.ordered_labels = []
+        # LSH index, only initialized after training if approx='lsh'
+        self._lsh_center = None
+        self._lsh_planes = None  # 3d array (n_tables, input_dim, n_bits)
+        self._lsh_keys = None  # list of sorted bucket keys for each table
+        self._lsh_order = None  # list of sample indices sorted by key
         
     def _train(self, x, labels):
         """Add the sampel points to the classes.
@@ -615,14 +1114,136 @@ def _stop_training(self):
                                 [numx.ones(len(ordered_samples[i]),
                                            dtype="int32") * i
                                  for i in range(len(self.ordered_labels))])
+        if self.approx == 'lsh':
+            self._build_lsh_index()
+
+    def _build_lsh_index(self):
+        """Hash all samples with random hyperplanes through their mean.
+
+        For each table the samples are sorted by their bucket key, so that
+        the members of a bucket can be found with a binary search.
+        """
+        self._lsh_center = self.samples.mean(axis=0)
+        self._lsh_planes = numx_rand.normal(size=(self.n_tables,
+                                                  self.input_dim,
+                                                  self.n_bits))
+        keys = self._lsh_hash(self.samples)
+        self._lsh_keys = []
+        self._lsh_order = []
+        for table in range(self.n_tables):
+            order = keys[table].argsort(kind='mergesort')
+            self._lsh_order.append(order)
+            self._lsh_keys.append(keys[table][order])
+
+    def _lsh_hash(self, x):
+        """Return the bucket keys of x, an array of shape (n_tables, len(x)).
+        """
+        powers = 2 ** numx.arange(self.n_bits, dtype='int64')
+        x_c = x - self._lsh_center
+        keys = numx.empty((self.n_tables, len(x)), dtype='int64')
+        for table in range(self.n_tables):
+            bits = numx.dot(x_c, self._lsh_planes[table]) > 0
+            keys[table] = numx.dot(bits, powers)
+        return keys
+
+    def _square_distances(self, x, samples):
+        """Return the matrix of square distances between x and samples."""
+        square_distances = (x*x).sum(1)[:, numx.newaxis] \
+                      + (samples*samples).sum(1)
+        square_distances -= 2 * numx.dot(x, samples.T)
+        return square_distances
+
+    def _exact_neighbors(self, x):
+        """Return the indices of the k nearest samples for each point in x.
+
+        The points are processed in blocks, so that the distance matrix
+        has at most block_size entries.
+        """
+        n_samples = len(self.samples)
+        k = min(self.k, n_samples)
+        neighbors = numx.empty((len(x), k), dtype='int64')
+        block = max(1, self.block_size // n_samples)
+        for start in range(0, len(x), block):
+            stop = start + block
+            square_distances = self._square_distances(x[start:stop],
+                                                      self.samples)
+            if k < n_samples:
+                nearest = square_distances.argpartition(k-1, axis=1)[:, :k]
+            else:
+                nearest = numx.arange(n_samples)[numx.newaxis, :].repeat(
+                                                len(square_distances), 0)
+            # order the k nearest samples by their distance
+            rows = numx.arange(len(nearest))[:, numx.newaxis]
+            order = square_distances[rows, nearest].argsort(axis=1,
+                                                            kind='mergesort')
+            neighbors[start:stop] = nearest[rows, order]
+        return neighbors
+
+    def _lsh_candidates(self, keys):
+        """Return the (query, sample) index pairs that share a bucket.
+
+        The pairs are unique and sorted by query index.
+        """
+        n_queries = keys.shape[1]
+        pairs = []
+        for table in range(self.n_tables):
+            table_keys = self._lsh_keys[table]
+            starts = table_keys.searchsorted(keys[table], side='left')
+            counts = table_keys.searchsorted(keys[table], side='right') - starts
+            queries = numx.arange(n_queries).repeat(counts)
+            # position of each candidate inside the sorted samples
+            offsets = numx.arange(counts.sum()) - (counts.cumsum() -
+                                                    counts).repeat(counts)
+            samples = self._lsh_order[table][starts.repeat(counts) + offsets]
+            pairs.append(queries * self.n_samples + samples)
+        pairs = numx.unique(numx.concatenate(pairs))
+        return pairs // self.n_samples, pairs % self.n_samples
+
+    def _lsh_neighbors(self, x):
+        """Return the indices of the approximate k nearest samples.
+
+        If the buckets of a point contain less than k samples in total,
+        the exact search is used for that point.
+        """
+        k = min(self.k, self.n_samples)
+        neighbors = numx.empty((len(x), k), dtype='int64')
+        for start in range(0, len(x), _LSH_QUERY_BLOCK):
+            x_block = x[start:start+_LSH_QUERY_BLOCK]
+            queries, samples = self._lsh_candidates(self._lsh_hash(x_block))
+            n_candidates = numx.bincount(queries, minlength=len(x_block))
+            fallback = n_candidates < k
+            if fallback.any():
+                neighbors[start:start+len(x_block)][fallback] = \
+                    self._exact_neighbors(x_block[fallback])
+                keep = ~fallback[queries]
+                queries, samples = queries[keep], samples[keep]
+                n_candidates = n_candidates[~fallback]
+            if not len(queries):
+                continue
+            diff = x_block[queries] - self.samples[samples]
+            square_distances = (diff*diff).sum(1)
+            # distances of the candidates of each query, padded with inf
+            first = n_candidates.cumsum() - n_candidates
+            rank = numx.arange(len(queries)) - first.repeat(n_candidates)
+            padded = numx.empty((len(n_candidates), n_candidates.max()))
+            padded.fill(numx.inf)
+            rows = numx.arange(len(n_candidates)).repeat(n_candidates)
+            padded[rows, rank] = square_distances
+            best = padded.argpartition(k-1, axis=1)[:, :k]
+            rows = numx.arange(len(best))[:, numx.newaxis]
+            best = best[rows, padded[rows, best].argsort(axis=1,
+                                                         kind='mergesort')]
+            nearest = samples[first[:, numx.newaxis] + best]
+            neighbors[start:start+len(x_block)][~fallback] = nearest
+        return neighbors
 
     def _label(self, x):
         """Label the data by comparison with the reference points."""
-        square_distances = (x*x).sum(1)[:, numx.newaxis] \
-                      + (self.samples*self.samples).sum(1)
-        square_distances -= 2 * numx.dot(x, self.samples.T)
-        min_inds = square_distances.argsort()
-        win_inds = [numx.bincount(self.sample_label_indices[indices[0:self.k]]).
+        if self.approx == 'lsh':
+            min_inds = self._lsh_neighbors(x)
+        else:
+            min_inds = self._exact_neighbors(x)
+        win_inds = [numx.bincount(self.sample_label_indices[indices]).
                     argmax(0) for indices in min_inds]
         labels = [self.ordered_labels[i] for i in win_inds]
         return labels
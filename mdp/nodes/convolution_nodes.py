@@ -4,6 +4,29 @@
 import mdp
 import scipy.signal as signal
 
+try:
+    # scipy >= 1.4: real transforms with multithreading support
+    import scipy.fft as _fft
+    _fft_workers = True
+except ImportError:
+    import numpy.fft as _fft
+    _fft_workers = False
+
+try:
+    from scipy.fftpack import next_fast_len as _next_fast_len
+except ImportError:
+    _next_fast_len = int
+
+# maximum number of complex spectrum elements computed at once by the
+# batched FFT convolution, used to bound its memory consumption
+_FFT_BLOCK_SIZE = 1 << 22
+
+def _centered(arr, shape):
+    """Return the center part of the last two axes of `arr`, with the same
+    convention as scipy.signal.fftconvolve."""
+    start = [(arr.shape[i-2]-shape[i])//2 for i in range(2)]
+    return arr[..., start[0]:start[0]+shape[0], start[1]:start[1]+shape[1]]
+
 # TODO automatic selection of convolution
 
 # TODO provide generators for standard filters
@@ -28,7 +51,7 @@ class Convolution2DNode(mdp.Node):
     def __init__(self, filters, input_shape = None,
                  approach = 'fft',
                  mode = 'full', boundary = 'fill', fillvalue = 0,
-                 output_2d = True,
+                 output_2d = True, workers = None,
                  input_dim = None, dtype = None):
         """
         Input arguments:
@@ -66,6 +89,14 @@ def __init__(self, filters, input_shape = None,
                      filter_nr: index of convolution filter
                      idx: data point index
                      x, y: 2D coordinates
+
+        workers -- Number of threads used to compute the Fourier transforms
+                   if 'approach' is 'fft'. This requires scipy >= 1.4 and
+                   is ignored otherwise.
+                   (*Default* = None, i.e. a single thread)
+
+        With the 'fft' approach all the images and filters are transformed
+        together, and the spectra of the filters are cached on the node.
         """
         super(Convolution2DNode, self).__init__(input_dim=input_dim,
                                               dtype=dtype)
@@ -85,6 +116,7 @@ def __init__(self, filters, input_shape = None,
         self.boundary = boundary
         self.fillvalue = fillvalue
         self.output_2d = output_2d
+        self.workers = workers
         self._output_shape = None
 
     # ------- class properties
@@ -98,6 +130,8 @@ def set_filters(self, filters):
             raise NodeException('Filters must be specified in a 3-dim array, with each '+
                                 'filter on a different row')
         self._filters = filters
+        # the spectra of the filters are computed again when needed
+        self._filters_spectra = None
 
     filters = property(get_filters, set_filters)
 
@@ -199,6 +233,46 @@ def _pre_execution_checks(self, x):
             error_str = "x must have at least one observation (zero given)"
             raise NodeException(error_str)
 
+    def _fft_kwargs(self):
+        if _fft_workers and self.workers is not None:
+            return {'workers': self.workers}
+        return {}
+
+    def _get_filters_spectra(self, fshape):
+        """Return the spectra of the filters for the transform shape fshape,
+        computing them only if the cached ones do not fit."""
+        if (self._filters_spectra is None or
+            self._filters_spectra[0] != fshape):
+            spectra = _fft.rfftn(self.filters, fshape, axes=(-2,-1),
+                                 **self._fft_kwargs())
+            self._filters_spectra = (fshape, spectra)
+        return self._filters_spectra[1]
+
+    def _fft_convolve(self, x, y):
+        """Convolve the images x (3D) with all the filters and write the
+        result in y, using one batched transform for each block of images.
+        """
+        filters_shape = self.filters.shape[1:]
+        full_shape = tuple(self._input_shape[i]+filters_shape[i]-1
+                           for i in range(2))
+        fshape = tuple(_next_fast_len(int(d)) for d in full_shape)
+        spectra = self._get_filters_spectra(fshape)
+        kwargs = self._fft_kwargs()
+        if self.mode == 'full':
+            shape = full_shape
+        elif self.mode == 'same':
+            shape = self._input_shape
+        else: # mode == 'valid'
+            shape = self._output_shape
+        block = max(1, _FFT_BLOCK_SIZE // spectra.size)
+        for start in range(0, x.shape[0], block):
+            x_spectra = _fft.rfftn(x[start:start+block], fshape,
+                                   axes=(-2,-1), **kwargs)
+            conv = _fft.irfftn(x_spectra[:,numx.newaxis] * spectra, fshape,
+                               axes=(-2,-1), **kwargs)
+            conv = conv[..., :full_shape[0], :full_shape[1]]
+            y[start:start+block] = _centered(conv, shape)
+
     def _execute(self, x):
         is_2d = x.ndim==2
         output_shape, input_shape = self._output_shape, self._input_shape
@@ -208,13 +282,15 @@ def _execute(self, x):
         # XXX depends on convolution
         y = numx.empty((x.shape[0], nfilters,
                         output_shape[0], output_shape[1]), dtype=self.dtype)
-        for n_im, im in enumerate(x):
+        if self.approach == 'fft':
             if is_2d:
-                im = im.reshape(input_shape)
-            for n_flt, flt in enumerate(filters):
-                if self.approach == 'fft':
-                    y[n_im,n_flt,:,:] = signal.fftconvolve(im, flt, mode=self.mode)
-                elif self.approach == 'linear':
+                x = x.reshape((x.shape[0],) + tuple(input_shape))
+            self._fft_convolve(x, y)
+        else:
+            for n_im, im in enumerate(x):
+                if is_2d:
+                    im = im.reshape(input_shape)
+                for n_flt, flt in enumerate(filters):
                     y[n_im,n_flt,:,:] = signal.convolve2d(im, flt,
                                                           mode=self.mode,
                                                           boundary=self.boundary,
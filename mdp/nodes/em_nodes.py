@@ -84,8 +84,7 @@ def _stop_training(self):
         if not self.output_dim:
             self.output_dim = d
         k = self.output_dim
-        # indices of the diagonal elements of a dxd or kxk matrix
-        idx_diag_d = [i*(d+1) for i in range(d)]
+        # indices of the diagonal elements of a kxk matrix
         idx_diag_k = [i*(k+1) for i in range(k)]
         # constant term in front of the log-likelihood
         const = -d/2. * numx.log(2.*numx.pi)
@@ -105,7 +104,8 @@ def _stop_training(self):
         if d<=300:
             scale = det(cov_mtx)**(old_div(1.,d))
         else:
-            scale = numx.product(sigma)**(old_div(1.,d))
+            # geometric mean, computed in log space to avoid overflows
+            scale = numx.exp(numx.log(sigma).mean())
         if scale <= 0.:
             err = ("The covariance matrix of the data is singular. "
                    "Redundant dimensions need to be removed.")
@@ -114,24 +114,41 @@ def _stop_training(self):
         A = normal(0., sqrt(old_div(scale,k)), size=(d, k)).astype(typ)
 
         ##### EM-cycle
+        # The EM-cycles only use the sufficient statistics. The dxd matrix
+        # B = (A A^T + Sigma)^-1 is never computed: with the Woodbury identity
+        #   B = Sigma^-1 - Sigma^-1 A M^-1 A^T Sigma^-1,
+        # where M = I + A^T Sigma^-1 A, only kxk matrices need to be inverted
+        # and the log-likelihood is obtained from M as well.
         lhood_curve = []
         base_lhood = None
         old_lhood = -numx.inf
+        # lower bound for the noise variances, which are inverted below
+        min_sigma = numx.finfo(typ).eps * cov_diag
         for t in range(self.max_cycles):
-            ## compute B = (A A^T + Sigma)^-1
-            B = mult(A, A.T)
-            # B += diag(sigma), avoid computing diag(sigma) which is dxd
-            B.ravel().put(idx_diag_d, B.ravel().take(idx_diag_d)+sigma)
-            # this quantity is used later for the log-likelihood
-            # abs is there to avoid numerical errors when det < 0
-            log_det_B = numx.log(abs(det(B)))
-            # end the computation of B
-            B = inv(B)
+            ## compute M = I + A^T Sigma^-1 A
+            isigma_A = A / sigma[:, numx.newaxis]
+            M = mult(A.T, isigma_A)
+            # M += numx.eye(k)
+            M.ravel().put(idx_diag_k, M.ravel().take(idx_diag_k)+1.)
+            inv_M = inv(M)
 
             ## other useful quantities
-            trA_B = mult(A.T, B)
+            # A^T B = M^-1 A^T Sigma^-1
+            trA_B = mult(inv_M, isigma_A.T)
             trA_B_cov_mtx = mult(trA_B, cov_mtx)
 
+            ##### log-likelihood
+            # log(det(A A^T + Sigma)) = log(det(Sigma)) + log(det(M))
+            # abs is there to avoid numerical errors when det < 0
+            log_det_B = numx.log(sigma).sum() + numx.log(abs(det(M)))
+            # trace(B cov_mtx), without computing B
+            trace_B_cov = ((cov_diag/sigma).sum() -
+                           (trA_B_cov_mtx*isigma_A.T).sum())
+            # this is actually likelihood/tlen.
+            lhood = const - 0.5*log_det_B - 0.5*trace_B_cov
+            if verbose:
+                print('cycle', t, 'log-lhood:', lhood)
+
             ##### E-step
             ## E_yyT = E(y_n y_n^T | x_n)
             E_yyT = - mult(trA_B, A) + mult(trA_B_cov_mtx, trA_B.T)
@@ -140,14 +157,8 @@ def _stop_training(self):
 
             ##### M-step
             A = mult(trA_B_cov_mtx.T, inv(E_yyT))
-            sigma = cov_diag - (mult(A, trA_B_cov_mtx)).diagonal()
-
-            ##### log-likelihood
-            trace_B_cov = (B*cov_mtx.T).sum()
-            # this is actually likelihood/tlen.
-            lhood = const - 0.5*log_det_B - 0.5*trace_B_cov
-            if verbose:
-                print('cycle', t, 'log-lhood:', lhood)
+            sigma = cov_diag - (A*trA_B_cov_mtx.T).sum(axis=1)
+            sigma = numx.maximum(sigma, min_sigma)
 
             ##### convergence criterion
             if base_lhood is None:
@@ -170,11 +181,11 @@ def _stop_training(self):
         self.sigma = sigma
 
         ## MAP matrix
-        # compute B = (A A^T + Sigma)^-1
-        B = mult(A, A.T).copy()
-        B.ravel().put(idx_diag_d, B.ravel().take(idx_diag_d)+sigma)
-        B = inv(B)
-        self.E_y_mtx = mult(B.T, A)
+        # B A = Sigma^-1 A M^-1
+        isigma_A = A / sigma[:, numx.newaxis]
+        M = mult(A.T, isigma_A)
+        M.ravel().put(idx_diag_k, M.ravel().take(idx_diag_k)+1.)
+        self.E_y_mtx = mult(isigma_A, inv(M))
 
         self.lhood = lhood_curve
 
@@ -1,13 +1,17 @@
 from __future__ import division
 from builtins import range
-from past.utils import old_div
 __docformat__ = "restructuredtext en"
 
 import mdp
 from mdp import numx
-from mdp.utils import mult, matmult, invert_exp_funcs2
+from mdp.utils import mult, matmult, invert_exp_funcs_batch
 from mdp.nodes import GrowingNeuralGasNode
 
+try:
+    import scipy.sparse as _sparse
+except ImportError:
+    _sparse = None
+
 def nmonomials(degree, nvariables):
     """Return the number of monomials of a given degree in a given number
     of variables."""
@@ -116,9 +120,15 @@ class RBFExpansionNode(mdp.Node):
        y_j = exp(-0.5 * (x-c_j)^T S^-1 (x-c_j))
 
     for anisotropic RBFs.
+
+    The data is processed in blocks of ``chunk_size`` samples, so that no
+    intermediate array is larger than ``chunk_size`` times the number of
+    centers. The output can be written into a preallocated array with
+    ``execute(x, out=y)``.
     """
 
-    def __init__(self, centers, sizes, dtype = None):
+    def __init__(self, centers, sizes, radius = None, chunk_size = 1000,
+                 dtype = None):
         """
         :Arguments:
           centers
@@ -134,8 +144,20 @@ def __init__(self, centers, sizes, dtype = None):
             or a covariance matrix (for anisotropic RBFs).
             If ``sizes`` is not a list, the same variance/covariance
             is used for all RBFs.
+          radius
+            If not None, the activations of the samples that are further
+            than ``radius`` standard deviations away from a center
+            (i.e., ``y_j < exp(-0.5*radius**2)``) are set to zero and
+            the output is returned as a ``scipy.sparse`` CSR matrix.
+            This requires scipy.
+          chunk_size
+            Number of samples processed at once.
         """
         super(RBFExpansionNode, self).__init__(None, None, dtype)
+        if radius is not None and _sparse is None:
+            raise mdp.NodeException("radius requires scipy.sparse.")
+        self.radius = radius
+        self.chunk_size = chunk_size
         self._init_RBF(centers, sizes)
 
     @staticmethod
@@ -186,17 +208,78 @@ def _init_RBF(self, centers, sizes):
         self._centers = centers
         self._sizes = sizes
 
-    def _execute(self, x):
-        y = numx.zeros((x.shape[0], self._output_dim), dtype = self.dtype)
+    def _set_dtype(self, t):
+        super(RBFExpansionNode, self)._set_dtype(t)
+        if getattr(self, '_centers', None) is not None:
+            self._centers = self._refcast(self._centers)
+            self._sizes = self._refcast(self._sizes)
+
+    def _sq_distances(self, x, out):
+        """Write the squared (Mahalanobis) distances of the samples in `x`
+        to the centers into `out`, in units of the RBF sizes."""
         c, s = self._centers, self._sizes
-        for i in range(self._output_dim):
-            dist = x - c[i,:]
-            if self._isotropic:
-                tmp = old_div((dist**2.).sum(axis=1), s[i])
-            else:
-                tmp = (dist*matmult(dist, s[i,:,:])).sum(axis=1)
-            y[:,i] = numx.exp(-0.5*tmp)
-        return y
+        if self._isotropic:
+            # ||x-c||^2 = ||x||^2 - 2 x.c + ||c||^2, the mean of the centers
+            # is subtracted first to reduce the cancellation errors
+            shift = c.mean(axis=0)
+            c = c - shift
+            x = x - shift
+            out[:] = mult(x, c.T)
+            out *= -2.
+            out += (c**2).sum(axis=1)
+            out += (x**2).sum(axis=1)[:, numx.newaxis]
+            numx.maximum(out, 0., out)
+            out /= s
+        else:
+            for i in range(self._output_dim):
+                dist = x - c[i,:]
+                out[:,i] = (dist*matmult(dist, s[i,:,:])).sum(axis=1)
+        return out
+
+    def _execute(self, x, out = None):
+        """Return the RBF activations.
+
+        If `out` is given the result is written into this array, which must
+        have the shape ``(len(x), output_dim)`` and the node dtype.
+        """
+        n, chunk_size = x.shape[0], self.chunk_size
+        if self.radius is not None:
+            if out is not None:
+                msg = "out can not be used with a radius cutoff"
+                raise mdp.NodeException(msg)
+            return self._execute_sparse(x)
+        if out is None:
+            out = numx.empty((n, self._output_dim), dtype = self.dtype)
+        elif (out.shape != (n, self._output_dim) or
+              out.dtype != self.dtype):
+            msg = ("out must be an array of shape %s and dtype %s"
+                   % (str((n, self._output_dim)), self.dtype.name))
+            raise mdp.NodeException(msg)
+        for start in range(0, n, chunk_size):
+            y = self._sq_distances(x[start:start+chunk_size],
+                                   out[start:start+chunk_size])
+            y *= -0.5
+            numx.exp(y, y)
+        return out
+
+    def _execute_sparse(self, x):
+        n, chunk_size = x.shape[0], self.chunk_size
+        radius2 = self.radius**2
+        tmp = numx.empty((min(n, chunk_size), self._output_dim),
+                         dtype = self.dtype)
+        indptr, indices, data = [numx.zeros((1,), dtype='i')], [], []
+        for start in range(0, n, chunk_size):
+            xb = x[start:start+chunk_size]
+            dist2 = self._sq_distances(xb, tmp[:xb.shape[0]])
+            mask = dist2 <= radius2
+            indptr.append(indptr[-1][-1] + mask.sum(axis=1).cumsum())
+            indices.append(numx.nonzero(mask)[1])
+            data.append(numx.exp(-0.5*dist2[mask]))
+        return _sparse.csr_matrix((numx.concatenate(data),
+                                   numx.concatenate(indices),
+                                   numx.concatenate(indptr)),
+                                  shape = (n, self._output_dim),
+                                  dtype = self.dtype)
 
 class GrowingNeuralGasExpansionNode(GrowingNeuralGasNode):
     """
@@ -221,7 +304,7 @@ class GrowingNeuralGasExpansionNode(GrowingNeuralGasNode):
 
     def __init__(self, start_poss=None, eps_b=0.2, eps_n=0.006, max_age=50,
                  lambda_=100, alpha=0.5, d=0.995, max_nodes=100,
-                 input_dim=None, dtype=None):
+                 engine='graph', input_dim=None, dtype=None):
         """
         For a full list of input arguments please check the documentation
         of GrowingNeuralGasNode.
@@ -238,7 +321,7 @@ def __init__(self, start_poss=None, eps_b=0.2, eps_n=0.006, max_age=50,
         super(GrowingNeuralGasExpansionNode, self).__init__(
             start_poss=start_poss, eps_b=eps_b, eps_n=eps_n, max_age=max_age,
             lambda_=lambda_, alpha=alpha, d=d, max_nodes=max_nodes,
-            input_dim=input_dim, dtype=dtype)
+            engine=engine, input_dim=input_dim, dtype=dtype)
 
     def _set_input_dim(self, n):
         # Needs to be overwritten because GrowingNeuralGasNode would
@@ -279,10 +362,30 @@ def _stop_training(self):
 
         # initialize the radial basis function expansion with centers and sizes
         self.rbf_expansion = mdp.nodes.RBFExpansionNode(centers = centers,
-                                                        sizes = sizes)
+                                                        sizes = sizes,
+                                                        dtype = self.dtype)
 
-    def _execute(self,x):
-        return self.rbf_expansion(x)
+    def _execute(self, x, out = None):
+        return self.rbf_expansion.execute(x, out = out)
+
+
+class _PseudoInverseTask(object):
+    """Approximate the preimages of a chunk of expanded samples.
+
+    The data of a task is the tuple (start, exp_x, hint), the result is
+    the tuple (start, app_x).
+    """
+
+    def __init__(self, dim_x, funcs, k):
+        self.dim_x = dim_x
+        self.funcs = funcs
+        self.k = k
+
+    def __call__(self, data):
+        start, exp_x, hint = data
+        app_x, _ = invert_exp_funcs_batch(exp_x, self.dim_x, self.funcs,
+                                          use_hint=hint, k=self.k)
+        return start, app_x
 
 
 class GeneralExpansionNode(_ExpansionNode):
@@ -355,9 +458,14 @@ def is_trainable():
     def is_invertible():
         return False
 
-    def pseudo_inverse(self, x, use_hint=None):
-        """Calculate a pseudo inverse of the expansion using
-        scipy.optimize.
+    def pseudo_inverse(self, x, use_hint=None, chunk_size=500,
+                       scheduler=None):
+        """Calculate a pseudo inverse of the expansion.
+
+        The preimages of all the samples in a chunk are approximated
+        together with a batched Levenberg-Marquardt optimization (see
+        ``invert_exp_funcs_batch`` in ``mdp.utils.routines.py``), so the
+        expansion functions must operate on each row separately.
 
         ``use_hint``
                when calculating a pseudo inverse of the expansion,
@@ -365,17 +473,34 @@ def pseudo_inverse(self, x, use_hint=None):
                For details on this parameter see the function 
                ``invert_exp_funcs2`` in ``mdp.utils.routines.py``.
 
-        This method requires scipy."""
-
-        try:
-            app_x_2, app_ex_x_2 = invert_exp_funcs2(x,
-                                                    self.input_dim,
-                                                    self.funcs,
-                                                    use_hint=use_hint,
-                                                    k=0.000001)
-            return app_x_2.astype(self.dtype)
-        except NotImplementedError as exc:
-            raise mdp.MDPException(exc)
+        ``chunk_size``
+               number of samples that are inverted together.
+
+        ``scheduler``
+               if not None, the chunks are processed as tasks of this
+               `mdp.parallel.Scheduler` (the expansion functions must then
+               be picklable, unless the scheduler does not copy the task
+               callable).
+        """
+        if isinstance(use_hint, numx.ndarray):
+            start = use_hint
+        elif use_hint == True:
+            start = x[:, 0:self.input_dim]
+        else:
+            start = numx.random.normal(size=(x.shape[0], self.input_dim))
+        task = _PseudoInverseTask(self.input_dim, self.funcs, k=0.000001)
+        chunks = [(i, x[i:i+chunk_size], start[i:i+chunk_size])
+                  for i in range(0, x.shape[0], chunk_size)]
+        if scheduler is None:
+            results = [task(chunk) for chunk in chunks]
+        else:
+            for chunk in chunks:
+                scheduler.add_task(chunk, task)
+            results = scheduler.get_results()
+        app_x = numx.zeros((x.shape[0], self.input_dim), dtype=self.dtype)
+        for i, app_x_chunk in results:
+            app_x[i:i+len(app_x_chunk)] = app_x_chunk
+        return app_x
 
     def _execute(self, x):
         if self.input_dim is None:
@@ -4,19 +4,108 @@
 from past.utils import old_div
 __docformat__ = "restructuredtext en"
 
-from mdp import numx, numx_linalg, Cumulator, TrainingException, MDPWarning
-from mdp.utils import mult, nongeneral_svd, svd, sqrtm, symeig
+from mdp import (numx, numx_linalg, numx_rand, Cumulator, NodeException,
+                 TrainingException, MDPWarning)
+from mdp.utils import (mult, nongeneral_svd, svd, sqrtm, symeig,
+                       apply_stacked)
 import warnings as _warnings
 
+try:
+    import scipy.sparse as _sparse
+    import scipy.sparse.linalg as _sparse_linalg
+except ImportError:
+    _sparse = None
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
 # some useful functions
 sqrt = numx.sqrt
 
+def _sparse_bottom_eigenvectors(M, n, shift):
+    """Return the n smallest eigenvalues and corresponding eigenvectors
+    of the sparse, symmetric, positive semi-definite matrix M.
+
+    ARPACK is used in shift-invert mode. The shift is -shift, so that
+    the factorized matrix is positive definite even if M is singular.
+    """
+    v0 = numx_rand.uniform(-1., 1., M.shape[0])
+    sig, U = _sparse_linalg.eigsh(M.tocsc(), k=n, sigma=-shift,
+                                  which='LM', v0=v0)
+    order = sig.argsort()
+    return sig[order], U[:, order]
+
 # search XXX for locations where future work is needed
 
+def _run_local_fit(local_fit, chunks, result, scheduler):
+    """Apply local_fit to each (start, data) pair in chunks and store the
+    returned values in result[start:...]. If scheduler is not None, the
+    chunks are processed as tasks of the `mdp.parallel.Scheduler`."""
+    if scheduler is None:
+        results = [local_fit(chunk) for chunk in chunks]
+    else:
+        for chunk in chunks:
+            scheduler.add_task(chunk, local_fit)
+        results = scheduler.get_results()
+    for start, values in results:
+        result[start:start+len(values)] = values
+
 #########################################################
 #  Locally Linear Embedding
 #########################################################
 
+class _LLELocalFit(object):
+    """Compute the LLE weights for a chunk of neighborhoods.
+
+    The data of a task is the tuple (start, nbrhds, sig2s), where
+    nbrhds[i] are the neighbors of point start+i minus the point itself
+    and sig2s are the corresponding squared singular values (or None).
+    """
+
+    def __init__(self, r, output_dim, dtype):
+        self.r = r
+        self.output_dim = output_dim
+        self.dtype = dtype
+
+    def __call__(self, data):
+        start, nbrhds, sig2s = data
+        n, k = nbrhds.shape[:2]
+        Q_diag_idx = numx.arange(k)
+        weights = numx.zeros((n, k), dtype=self.dtype)
+        for i in range(n):
+            M_Mi = nbrhds[i]
+            # compute covariance matrix of distances
+            Q = mult(M_Mi, M_Mi.T)
+
+            #Covariance matrix may be nearly singular:
+            # add a diagonal correction to prevent numerical errors
+            if self.r is None:
+                # automatic mode: correction is equal to the sum of
+                # the (d_in-d_out) unused variances (as in deRidder &
+                # Duin)
+                if sig2s is not None:
+                    sig2 = sig2s[i]
+                else:
+                    sig2 = svd(M_Mi, compute_uv=0)**2
+                Q[Q_diag_idx, Q_diag_idx] += numx.sum(sig2[self.output_dim:])
+            else:
+                # Roweis et al instead use "a correction that
+                #   is small compared to the trace" e.g.:
+                # r = 0.001 * float(Q.trace())
+                # this is equivalent to assuming 0.1% of the variance
+                # is unused
+                Q[Q_diag_idx, Q_diag_idx] += self.r*Q.trace()
+
+            #solve for weight
+            # weight is w such that sum(Q_ij * w_j) = 1 for all i
+            # XXX astype is due to numpy bug: floats become double
+            w = numx_linalg.solve(Q, numx.ones(k)).astype(self.dtype)
+            w /= w.sum()
+            weights[i] = w
+        return start, weights
+
 class LLENode(Cumulator):
     """Perform a Locally Linear Embedding analysis on the data.
 
@@ -42,7 +131,7 @@ class LLENode(Cumulator):
     """
 
     def __init__(self, k, r=0.001, svd=False, verbose=False,
-                 input_dim=None, output_dim=None, dtype=None):
+                 sparse=False, input_dim=None, output_dim=None, dtype=None):
         """
         :Arguments:
            k
@@ -60,6 +149,11 @@ def __init__(self, k, r=0.001, svd=False, verbose=False,
            verbose
              if true, displays information about the progress
              of the algorithm
+           sparse
+             if true, store the weight matrix as a sparse matrix and
+             compute the projection with ARPACK (``svd`` is ignored);
+             memory grows linearly with the number of training points
+             instead of quadratically. Requires ``scipy``.
            output_dim
              number of dimensions to output or a float between 0.0 and
              1.0. In the latter case, ``output_dim`` specifies the desired
@@ -76,14 +170,71 @@ def __init__(self, k, r=0.001, svd=False, verbose=False,
         else:
             self.desired_variance = None
 
+        if sparse and _sparse is None:
+            raise NodeException("sparse=True requires scipy.sparse.")
+
         super(LLENode, self).__init__(input_dim, output_dim, dtype)
 
         self.k = k
         self.r = r
         self.svd = svd
         self.verbose = verbose
-
-    def _stop_training(self):
+        self.sparse = sparse
+        # neighbor search structures, see _find_neighbors
+        self._kdtree = None
+        self._training_nbrs = None
+
+    def _find_neighbors(self, x, k, skip_self=False, chunk_size=1000):
+        """Return the indices of the k nearest training points of each
+        point in x, sorted by distance.
+
+        If skip_self is True, x must be the training data and no point is
+        counted as its own neighbor. For low-dimensional data a KD-tree
+        of the training data is built once and kept, otherwise the
+        distances are computed for chunk_size points at a time.
+        """
+        data = self.data
+        n = k+1 if skip_self else k
+        if cKDTree is not None and data.shape[1] <= 10:
+            if self._kdtree is None:
+                self._kdtree = cKDTree(data)
+            nbrs = self._kdtree.query(x, k=n)[1].reshape(x.shape[0], n)
+        else:
+            nbrs = numx.zeros((x.shape[0], n), dtype='i')
+            data2 = (data*data).sum(1)
+            for start in range(0, x.shape[0], chunk_size):
+                chunk = x[start:start+chunk_size]
+                # squared distances, up to a constant for each row
+                dist = data2 - 2*mult(chunk, data.T)
+                idx = numx.argpartition(dist, n-1, axis=1)[:, :n]
+                rows = numx.arange(chunk.shape[0])[:, numx.newaxis]
+                order = dist[rows, idx].argsort(axis=1)
+                nbrs[start:start+chunk_size] = idx[rows, order]
+        if skip_self:
+            is_self = nbrs == numx.arange(x.shape[0])[:, numx.newaxis]
+            # with duplicated points the point itself might be missing
+            is_self[~is_self.any(axis=1), -1] = True
+            nbrs = nbrs[~is_self].reshape(x.shape[0], k)
+        return nbrs
+
+    def _get_training_neighbors(self):
+        """Return the k nearest neighbors of each training point. The
+        result is computed only once."""
+        if self._training_nbrs is None:
+            if self.verbose:
+                print(' - searching nearest neighbors...')
+            self._training_nbrs = self._find_neighbors(self.data, self.k,
+                                                       skip_self=True)
+        return self._training_nbrs
+
+    def _stop_training(self, scheduler=None, chunk_size=500):
+        """Compute the LLE projection of the training data.
+
+        The local weights of the data points are computed in chunks of
+        ``chunk_size`` points. If a ``scheduler`` (see `mdp.parallel`) is
+        given, the chunks are processed as its tasks (the scheduler is
+        not shut down).
+        """
         Cumulator._stop_training(self)
 
         if self.verbose:
@@ -96,11 +247,6 @@ def _stop_training(self):
         M = self.data
         N = M.shape[0]
         k = self.k
-        r = self.r
-
-        # indices of diagonal elements
-        W_diag_idx = numx.arange(N)
-        Q_diag_idx = numx.arange(k)
 
         if k > N:
             err = ('k=%i must be less than or '
@@ -117,82 +263,57 @@ def _stop_training(self):
             else:
                 learn_outdim = True
 
-        # do we need to automatically determine the regularization term?
-        auto_reg = r is None
+        # k nearest neighbors of each point
+        nbrss = self._get_training_neighbors()
 
         # determine number of output dims, precalculate useful stuff
+        sig2s = None
         if learn_outdim:
-            Qs, sig2s, nbrss = self._adjust_output_dim()
-
-        # build the weight matrix
-        #XXX future work:
-        #XXX   for faster implementation, W should be a sparse matrix
-        W = numx.zeros((N, N), dtype=self.dtype)
+            sig2s = self._adjust_output_dim()
 
+        # compute the weights, W[nbrs[row], row] = weights[row]
         if self.verbose:
-            print(' - constructing [%i x %i] weight matrix...' % W.shape)
-
-        for row in range(N):
-            if learn_outdim:
-                Q = Qs[row, :, :]
-                nbrs = nbrss[row, :]
-            else:
-                # -----------------------------------------------
-                #  find k nearest neighbors
-                # -----------------------------------------------
-                M_Mi = M-M[row]
-                nbrs = numx.argsort((M_Mi**2).sum(1))[1:k+1]
-                M_Mi = M_Mi[nbrs]
-                # compute covariance matrix of distances
-                Q = mult(M_Mi, M_Mi.T)
-
-            # -----------------------------------------------
-            #  compute weight vector based on neighbors
-            # -----------------------------------------------
-
-            #Covariance matrix may be nearly singular:
-            # add a diagonal correction to prevent numerical errors
-            if auto_reg:
-                # automatic mode: correction is equal to the sum of
-                # the (d_in-d_out) unused variances (as in deRidder &
-                # Duin)
-                if learn_outdim:
-                    sig2 = sig2s[row, :]
-                else:
-                    sig2 = svd(M_Mi, compute_uv=0)**2
-                r = numx.sum(sig2[self.output_dim:])
-                Q[Q_diag_idx, Q_diag_idx] += r
-            else:
-                # Roweis et al instead use "a correction that
-                #   is small compared to the trace" e.g.:
-                # r = 0.001 * float(Q.trace())
-                # this is equivalent to assuming 0.1% of the variance is unused
-                Q[Q_diag_idx, Q_diag_idx] += r*Q.trace()
-
-            #solve for weight
-            # weight is w such that sum(Q_ij * w_j) = 1 for all i
-            # XXX refcast is due to numpy bug: floats become double
-            w = self._refcast(numx_linalg.solve(Q, numx.ones(k)))
-            w /= w.sum()
-
-            #update row of the weight matrix
-            W[nbrs, row] = w
+            print(' - constructing [%i x %i] weight matrix...' % (N, N))
+
+        weights = numx.zeros((N, k), dtype=self.dtype)
+        # the squared singular values are only needed for the automatic
+        # regularization
+        if self.r is not None:
+            sig2s = None
+        chunks = ((start, M[nbrss[start:start+chunk_size]]
+                   - M[start:start+chunk_size, numx.newaxis, :],
+                   None if sig2s is None else sig2s[start:start+chunk_size])
+                  for start in range(0, N, chunk_size))
+        _run_local_fit(_LLELocalFit(self.r, self.output_dim, self.dtype),
+                       chunks, weights, scheduler)
 
         if self.verbose:
             msg = (' - finding [%i x %i] null space of weight matrix\n'
                    '     (may take a while)...' % (self.output_dim, N))
             print(msg)
 
-        self.W = W.copy()
         #to find the null space, we need the bottom d+1
         #  eigenvectors of (W-I).T*(W-I)
+        if self.sparse:
+            # row i of W.T contains the weights of point i
+            WT = _sparse.csr_matrix((weights.ravel(), nbrss.ravel(),
+                                     numx.arange(0, N*k+1, k)),
+                                    shape=(N, N))
+            self.W = WT.T
+            IW = _sparse.identity(N, dtype=self.dtype, format='csr') - WT
+            # M = (I-W.T).T * (I-W.T) is sparse as well
+            sig, U = _sparse_bottom_eigenvectors(IW.T.dot(IW),
+                                                 self.output_dim+1, 1e-6)
+            self.training_projection = U[:, 1:]
+            return
+
+        W_diag_idx = numx.arange(N)
+        W = numx.zeros((N, N), dtype=self.dtype)
+        W[nbrss, W_diag_idx[:, numx.newaxis]] = weights
+        self.W = W.copy()
         #Compute this using the svd of (W-I):
         W[W_diag_idx, W_diag_idx] -= 1.
 
-        #XXX future work:
-        #XXX  use of upcoming ARPACK interface for bottom few eigenvectors
-        #XXX   of a sparse matrix will significantly increase the speed
-        #XXX   of the next step
         if self.svd:
             sig, U = nongeneral_svd(W.T, range=(2, self.output_dim+1))
         else:
@@ -217,24 +338,14 @@ def _adjust_output_dim(self):
         #otherwise, we need to compute output_dim
         #                  from desired_variance
         M = self.data
-        k = self.k
         N, d_in = M.shape
 
         m_est_array = []
-        Qs = numx.zeros((N, k, k))
         sig2s = numx.zeros((N, d_in))
-        nbrss = numx.zeros((N, k), dtype='i')
+        nbrss = self._get_training_neighbors()
 
         for row in range(N):
-            #-----------------------------------------------
-            #  find k nearest neighbors
-            #-----------------------------------------------
-            M_Mi = M-M[row]
-            nbrs = numx.argsort((M_Mi**2).sum(1))[1:k+1]
-            M_Mi = M_Mi[nbrs]
-            # compute covariance matrix of distances
-            Qs[row, :, :] = mult(M_Mi, M_Mi.T)
-            nbrss[row, :] = nbrs
+            M_Mi = M[nbrss[row]]-M[row]
 
             #-----------------------------------------------
             # singular values of M_Mi give the variance:
@@ -267,43 +378,46 @@ def _adjust_output_dim(self):
                                               self.desired_variance))
             print(msg)
 
-        return Qs, sig2s, nbrss
+        return sig2s
 
-    def _execute(self, x):
+    def _execute(self, x, chunk_size=1000):
         #----------------------------------------------------
         # similar algorithm to that within self.stop_training()
         #  refer there for notes & comments on code
+        # the points are processed in chunks of chunk_size points,
+        #  solving all local systems of a chunk at once
         #----------------------------------------------------
-        N = self.data.shape[0]
-        Nx = x.shape[0]
-        W = numx.zeros((Nx, N), dtype=self.dtype)
-
         k, r = self.k, self.r
         d_out = self.output_dim
         Q_diag_idx = numx.arange(k)
+        y = numx.zeros((x.shape[0], d_out), dtype=self.dtype)
 
-        for row in range(Nx):
+        for start in range(0, x.shape[0], chunk_size):
+            chunk = x[start:start+chunk_size]
             #find nearest neighbors of x in M
-            M_xi = self.data-x[row]
-            nbrs = numx.argsort( (M_xi**2).sum(1) )[:k]
-            M_xi = M_xi[nbrs]
-
-            #find corrected covariance matrix Q
-            Q = mult(M_xi, M_xi.T)
-            if r is None and k > d_out:
-                sig2 = (svd(M_xi, compute_uv=0))**2
-                r = numx.sum(sig2[d_out:])
-                Q[Q_diag_idx, Q_diag_idx] += r
-            if r is not None:
-                Q[Q_diag_idx, Q_diag_idx] += r
+            nbrs = self._find_neighbors(chunk, k)
+            M_xi = self.data[nbrs] - chunk[:, numx.newaxis, :]
+
+            #find corrected covariance matrices Q
+            Q = numx.matmul(M_xi, M_xi.transpose(0, 2, 1))
+            if r is None:
+                if k > d_out:
+                    sig2 = apply_stacked(numx_linalg.svd, M_xi,
+                                         compute_uv=False)**2
+                    reg = sig2[:, d_out:].sum(axis=1)
+                    Q[:, Q_diag_idx, Q_diag_idx] += reg[:, numx.newaxis]
+            else:
+                Q[:, Q_diag_idx, Q_diag_idx] += r
 
             #solve for weights
-            w = self._refcast(numx_linalg.solve(Q , numx.ones(k)))
-            w /= w.sum()
-            W[row, nbrs] = w
+            w = apply_stacked(numx_linalg.solve, Q,
+                              numx.ones(Q.shape[:2] + (1,)))[:, :, 0]
+            w /= w.sum(axis=1)[:, numx.newaxis]
 
-        #multiply weights by result of SVD from training
-        return numx.dot(W, self.training_projection)
+            #combine the projections of the neighbors from training
+            y[start:start+chunk_size] = (
+                w[:, :, numx.newaxis]*self.training_projection[nbrs]).sum(1)
+        return y
 
     @staticmethod
     def is_trainable():
@@ -333,6 +447,67 @@ def _mgs(a):
     # q is v
     return v, r
 
+class _HLLELocalFit(object):
+    """Compute the Hessian estimators for a chunk of neighborhoods.
+
+    The data of a task is the tuple (start, nbrhds), where nbrhds[i] are
+    the neighbors of point start+i.
+    """
+
+    def __init__(self, d_out, dtype):
+        self.d_out = d_out
+        self.dtype = dtype
+
+    def __call__(self, data):
+        start, nbrhds = data
+        n, k = nbrhds.shape[:2]
+        d_out = self.d_out
+        dp = d_out*(d_out+1)//2
+        weights = numx.zeros((n, k, dp), dtype=self.dtype)
+        for row in range(n):
+            #-----------------------------------------------
+            #  center the neighborhood using the mean
+            #-----------------------------------------------
+            nbrhd = nbrhds[row] - nbrhds[row].mean(0)
+
+            #-----------------------------------------------
+            #  compute local coordinates
+            #   using a singular value decomposition
+            #-----------------------------------------------
+            U, sig, VT = svd(nbrhd)
+            nbrhd = U.T[:d_out]
+            del VT
+
+            #-----------------------------------------------
+            #  build Hessian estimator
+            #-----------------------------------------------
+            Yi = numx.zeros((dp, k), dtype=self.dtype)
+            ct = 0
+            for i in range(d_out):
+                Yi[ct:ct+d_out-i, :] = nbrhd[i] * nbrhd[i:, :]
+                ct += d_out-i
+            Yi = numx.concatenate([numx.ones((1, k), dtype=self.dtype),
+                                   nbrhd, Yi], 0)
+
+            #-----------------------------------------------
+            #  orthogonalize linear and quadratic forms
+            #   with QR factorization
+            #  and make the weights sum to 1
+            #-----------------------------------------------
+            if k >= 1+d_out+dp:
+                Q, R = numx_linalg.qr(Yi.T)
+                w = Q[:, d_out+1:d_out+1+dp]
+            else:
+                q, r = _mgs(Yi.T)
+                w = q[:, -dp:]
+
+            S = w.sum(0) #sum along columns
+            #if S[i] is too small, set it equal to 1.0
+            # this prevents weights from blowing up
+            S[numx.where(numx.absolute(S)<1E-4)] = 1.0
+            weights[row] = old_div(w, S)
+        return start, weights
+
 class HLLENode(LLENode):
     """Perform a Hessian Locally Linear Embedding analysis on the data.
 
@@ -364,7 +539,7 @@ class HLLENode(LLENode):
     #----------------------------------------------------
 
     def __init__(self, k, r=0.001, svd=False, verbose=False,
-                 input_dim=None, output_dim=None, dtype=None):
+                 sparse=False, input_dim=None, output_dim=None, dtype=None):
         """
         :Keyword arguments:
            k
@@ -383,6 +558,10 @@ def __init__(self, k, r=0.001, svd=False, verbose=False,
            verbose
               if true, displays information about the progress
               of the algorithm
+           sparse
+              if true, store the weight matrix as a sparse matrix and
+              compute the projection with ARPACK (``svd`` is ignored).
+              Requires ``scipy``.
            output_dim
               number of dimensions to output or a float between 0.0
               and 1.0. In the latter case, output_dim specifies the
@@ -392,10 +571,17 @@ def __init__(self, k, r=0.001, svd=False, verbose=False,
               keep as many dimensions as necessary in order to explain
               95% of the input variance)
         """
-        LLENode.__init__(self, k, r, svd, verbose,
+        LLENode.__init__(self, k, r, svd, verbose, sparse,
                          input_dim, output_dim, dtype)
 
-    def _stop_training(self):
+    def _stop_training(self, scheduler=None, chunk_size=500):
+        """Compute the HLLE projection of the training data.
+
+        The local Hessian estimators are computed in chunks of
+        ``chunk_size`` points. If a ``scheduler`` (see `mdp.parallel`) is
+        given, the chunks are processed as its tasks (the scheduler is
+        not shut down).
+        """
         Cumulator._stop_training(self)
 
         k = self.k
@@ -420,9 +606,12 @@ def _stop_training(self):
             else:
                 learn_outdim = True
 
-        # determine number of output dims, precalculate useful stuff
+        # k nearest neighbors of each point
+        nbrss = self._get_training_neighbors()
+
+        # determine number of output dims
         if learn_outdim:
-            Qs, sig2s, nbrss = self._adjust_output_dim()
+            self._adjust_output_dim()
 
         d_out = self.output_dim
 
@@ -441,67 +630,15 @@ def _stop_training(self):
                    % (k, 1+d_out+dp))
             _warnings.warn(wrn, MDPWarning)
 
-        #build the weight matrix
-        #XXX   for faster implementation, W should be a sparse matrix
-        W = numx.zeros((N, dp*N), dtype=self.dtype)
-
+        # compute the weights, W[nbrs[row], row*dp:(row+1)*dp] = weights[row]
         if self.verbose:
-            print(' - constructing [%i x %i] weight matrix...' % W.shape)
-
-        for row in range(N):
-            if learn_outdim:
-                nbrs = nbrss[row, :]
-            else:
-                # -----------------------------------------------
-                #  find k nearest neighbors
-                # -----------------------------------------------
-                M_Mi = M-M[row]
-                nbrs = numx.argsort((M_Mi**2).sum(1))[1:k+1]
+            print(' - constructing [%i x %i] weight matrix...' % (N, dp*N))
 
-            #-----------------------------------------------
-            #  center the neighborhood using the mean
-            #-----------------------------------------------
-            nbrhd = M[nbrs] # this makes a copy
-            nbrhd -= nbrhd.mean(0)
-
-            #-----------------------------------------------
-            #  compute local coordinates
-            #   using a singular value decomposition
-            #-----------------------------------------------
-            U, sig, VT = svd(nbrhd)
-            nbrhd = U.T[:d_out]
-            del VT
-
-            #-----------------------------------------------
-            #  build Hessian estimator
-            #-----------------------------------------------
-            Yi = numx.zeros((dp, k), dtype=self.dtype)
-            ct = 0
-            for i in range(d_out):
-                Yi[ct:ct+d_out-i, :] = nbrhd[i] * nbrhd[i:, :]
-                ct += d_out-i
-            Yi = numx.concatenate([numx.ones((1, k), dtype=self.dtype),
-                                   nbrhd, Yi], 0)
-
-            #-----------------------------------------------
-            #  orthogonalize linear and quadratic forms
-            #   with QR factorization
-            #  and make the weights sum to 1
-            #-----------------------------------------------
-            if k >= 1+d_out+dp:
-                Q, R = numx_linalg.qr(Yi.T)
-                w = Q[:, d_out+1:d_out+1+dp]
-            else:
-                q, r = _mgs(Yi.T)
-                w = q[:, -dp:]
-
-            S = w.sum(0) #sum along columns
-            #if S[i] is too small, set it equal to 1.0
-            # this prevents weights from blowing up
-            S[numx.where(numx.absolute(S)<1E-4)] = 1.0
-            #print w.shape, S.shape, (w/S).shape
-            #print W[nbrs, row*dp:(row+1)*dp].shape
-            W[nbrs, row*dp:(row+1)*dp] = old_div(w, S)
+        weights = numx.zeros((N, k, dp), dtype=self.dtype)
+        chunks = ((start, M[nbrss[start:start+chunk_size]])
+                  for start in range(0, N, chunk_size))
+        _run_local_fit(_HLLELocalFit(d_out, self.dtype),
+                       chunks, weights, scheduler)
 
         #-----------------------------------------------
         # To find the null space, we want the
@@ -514,22 +651,32 @@ def _stop_training(self):
                    'null space of weight matrix...' % (d_out, N))
             print(msg)
 
-        #XXX future work:
-        #XXX  use of upcoming ARPACK interface for bottom few eigenvectors
-        #XXX   of a sparse matrix will significantly increase the speed
-        #XXX   of the next step
-
-        if self.svd:
-            sig, U = nongeneral_svd(W.T, range=(2, d_out+1))
-            Y = U*numx.sqrt(N)
+        # column index of each weight
+        cols = (dp*numx.arange(N)[:, numx.newaxis, numx.newaxis]
+                + numx.arange(dp))
+        cols = numx.broadcast_to(cols, weights.shape)
+        if self.sparse:
+            rows = numx.broadcast_to(nbrss[:, :, numx.newaxis], weights.shape)
+            W = _sparse.csr_matrix((weights.ravel(),
+                                    (rows.ravel(), cols.ravel())),
+                                   shape=(N, dp*N))
+            sig, U = _sparse_bottom_eigenvectors(W.dot(W.T), d_out+1, 1e-6)
+            Y = U[:, 1:]*numx.sqrt(N)
         else:
-            WW = mult(W, W.T)
-            # regularizes the eigenvalues, does not change the eigenvectors:
-            W_diag_idx = numx.arange(N)
-            WW[W_diag_idx, W_diag_idx] += 0.01
-            sig, U = symeig(WW, range=(2, self.output_dim+1), overwrite=True)
+            W = numx.zeros((N, dp*N), dtype=self.dtype)
+            W[nbrss[:, :, numx.newaxis], cols] = weights
+            if self.svd:
+                sig, U = nongeneral_svd(W.T, range=(2, d_out+1))
+            else:
+                WW = mult(W, W.T)
+                # regularizes the eigenvalues, does not change the
+                # eigenvectors:
+                W_diag_idx = numx.arange(N)
+                WW[W_diag_idx, W_diag_idx] += 0.01
+                sig, U = symeig(WW, range=(2, self.output_dim+1),
+                                overwrite=True)
+                del WW
             Y = U*numx.sqrt(N)
-            del WW
         del W
 
         #-----------------------------------------------
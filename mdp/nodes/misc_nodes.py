@@ -13,6 +13,8 @@
 
 import pickle as pickle
 import pickle as real_pickle
+from mdp.utils import mult
+from numpy.lib.stride_tricks import as_strided
 
 class IdentityNode(PreserveDimNode):
     """Execute returns the input data and the node is not trainable.
@@ -31,6 +33,10 @@ def _get_supported_dtypes(self):
     def is_trainable():
         return False
 
+# initial and maximum block sizes used by OneDimensionalHitParade.update
+_HIT_PARADE_BLOCK = 64
+_HIT_PARADE_MAX_BLOCK = 1 << 16
+
 class OneDimensionalHitParade(object):
     """
     Class to produce hit-parades (i.e., a list of the largest
@@ -71,6 +77,24 @@ def update(self, inp):
         inp -- tuple (time-series, time-indices)
         """
         (x, ix) = inp
+        # The hit-parades can only change for values larger than the
+        # smallest stored maximum or smaller than the largest stored minimum.
+        # Since these thresholds only grow (respectively shrink) during the
+        # update, all the other values can be skipped without changing the
+        # result. The data is processed in blocks of increasing size, so
+        # that the thresholds are raised early.
+        start, block = 0, _HIT_PARADE_BLOCK
+        while start < len(x):
+            x_block = x[start:start+block]
+            cand = ((x_block > self.M.min()) |
+                    (x_block < self.m.max())).nonzero()[0]
+            if len(cand):
+                self._update_rows(x_block[cand], ix[start:start+block][cand])
+            start += block
+            block = min(2*block, _HIT_PARADE_MAX_BLOCK)
+
+    def _update_rows(self, x, ix):
+        """Update the hit-parades with each value in turn."""
         rows = len(x)
         d = self.d
         M = self.M
@@ -227,20 +251,27 @@ class TimeFramesNode(Node):
     It is not always possible to invert this transformation (the
     transformation is not surjective. However, the ``pseudo_inverse``
     method does the correct thing when it is indeed possible.
+
+    To apply a linear node (e.g., ``SFANode`` or ``PCANode``) to the
+    frames without building them, see ``TimeFramesLinearNode``.
     """
 
-    def __init__(self, time_frames, gap=1,
+    def __init__(self, time_frames, gap=1, view=False,
                  input_dim=None, dtype=None):
         """
         Input arguments:
         time_frames -- Number of delayed copies
         gap -- Time delay between the copies
+        view -- If True and gap is 1, the output is a read-only view
+                on the (C-contiguous) input data instead of a copy, since
+                consecutive frames overlap in memory.
         """
         self.time_frames = time_frames
         super(TimeFramesNode, self).__init__(input_dim=input_dim,
                                              output_dim=None,
                                              dtype=dtype)
         self.gap = gap
+        self.view = view
 
     def _get_supported_dtypes(self):
         """Return the list of dtypes supported by this node."""
@@ -264,11 +295,23 @@ def _set_output_dim(self, n):
         msg = 'Output dim can not be explicitly set!'
         raise NodeException(msg)
 
+    def _frames_base(self, x):
+        """Return the tuple (base, rows, reverse) describing the frames of x:
+        frame number f of the output (with ``rows`` rows) is
+        ``base[f*gap:f*gap+rows]``, or the frame number time_frames-1-f
+        if reverse is True."""
+        return x, x.shape[0] - (self.time_frames-1)*self.gap, False
+
     def _execute(self, x):
         gap = self.gap
         tf = x.shape[0] - (self.time_frames-1)*gap
         rows = self.input_dim
         cols = self.output_dim
+        if self.view and gap == 1 and x.flags.c_contiguous and tf > 0:
+            # row t of the output is x.ravel()[t*rows:t*rows+cols]
+            y = as_strided(x, shape=(tf, cols), strides=x.strides)
+            y.setflags(write=False)
+            return y
         y = numx.zeros((tf, cols), dtype=self.dtype)
         for frame in range(self.time_frames):
             y[:, frame*rows:(frame+1)*rows] = x[gap*frame:gap*frame+tf, :]
@@ -345,7 +388,14 @@ def __init__(self, time_frames, gap=1, input_dim=None, dtype=None):
         gap -- Time delay between the copies
         """
         super(TimeDelayNode, self).__init__(time_frames, gap,
-                                            input_dim, dtype)
+                                            input_dim=input_dim, dtype=dtype)
+
+    def _frames_base(self, x):
+        # the frames read the input padded with zeros in reversed order
+        hist = (self.time_frames-1)*self.gap
+        base = numx.zeros((x.shape[0]+hist, self.input_dim), dtype=self.dtype)
+        base[hist:] = x
+        return base, x.shape[0], True
 
     def _execute(self, x):
         gap = self.gap
@@ -368,12 +418,17 @@ class TimeDelaySlidingWindowNode(TimeDelayNode):
     ``TimeDelaySlidingWindowNode`` is an alternative to ``TimeDelayNode``
     which should be used for online learning/execution. Whereas the
     ``TimeDelayNode`` works in a batch manner, for online application
-    a sliding window is necessary which yields only one row per call.
+    a sliding window is necessary which keeps the past input rows across
+    calls. Each call can process a block with any number of rows.
 
     Applied to the same data the collection of all returned rows of the
     ``TimeDelaySlidingWindowNode`` is equivalent to the result of the
     ``TimeDelayNode``.
 
+    The last ``(time_frames-1)*gap`` input rows are stored in a buffer,
+    which is only rearranged when it is full, and the output rows are
+    read from it through a strided view.
+
     Original code contributed by Sebastian Hoefer.
     Dec 31, 2010
     """
@@ -390,44 +445,201 @@ def __init__(self, time_frames, gap=1, input_dim=None, dtype=None):
                                                          input_dim, dtype)
         self.sliding_wnd = None
         self.cur_idx = 0
-        self.slide = False
 
-    def _init_sliding_window(self):
-        rows = self.gap+1
-        cols = self.input_dim*self.time_frames
-        self.sliding_wnd = numx.zeros((rows, cols), dtype=self.dtype)
+    def _init_sliding_window(self, rows):
+        """Create a buffer with space for the history and `rows` new rows,
+        and move the current history to its beginning."""
+        hist = (self.time_frames-1)*self.gap
+        buf = numx.zeros((2*(hist+max(rows, 64)), self.input_dim),
+                         dtype=self.dtype)
+        if self.sliding_wnd is not None:
+            buf[:hist] = self.sliding_wnd[self.cur_idx-hist:self.cur_idx]
+        self.sliding_wnd = buf
+        self.cur_idx = hist
 
     def _execute(self, x):
-        assert x.shape[0] == 1
+        rows = x.shape[0]
+        if (self.sliding_wnd is None or
+            self.cur_idx+rows > self.sliding_wnd.shape[0]):
+            self._init_sliding_window(rows)
+
+        buf, cur = self.sliding_wnd, self.cur_idx
+        buf[cur:cur+rows] = x
+        self.cur_idx = cur + rows
+
+        if rows == 1:
+            # cheaper than building a strided view for a single row
+            return buf[cur-self.gap*numx.arange(self.time_frames)].reshape(
+                (1, self.output_dim))
+        # y[t, frame*n:(frame+1)*n] = buf[cur+t-frame*gap]
+        stride, item = buf.strides
+        shape = (rows, self.time_frames, self.input_dim)
+        frames = as_strided(buf[cur:], shape=shape,
+                            strides=(stride, -self.gap*stride, item))
+        y = numx.empty((rows, self.output_dim), dtype=self.dtype)
+        y.reshape(shape)[:] = frames
+        return y
 
-        if self.sliding_wnd is None:
-            self._init_sliding_window()
+def _frames_moments(x, rows, time_frames, gap):
+    """Return the sum of the outer products and the sum of the rows of
+    the output of a TimeFramesNode with ``rows`` rows, computed from x
+    without building the frames.
 
-        gap = self.gap
-        rows = self.sliding_wnd.shape[0]
-        cols = self.output_dim
-        n = self.input_dim
+    The block (f, f+k) of the second moment matrix only depends on the
+    lag k*gap: it is computed once from all the rows of x, and the rows
+    that are outside of each frame are then removed in blocks of gap rows.
+    """
+    n = x.shape[1]
+    dim = n*time_frames
+    total = rows + (time_frames-1)*gap
+    cov = numx.zeros((dim, dim), dtype=x.dtype)
+    def lag_product(start, stop, lag):
+        return mult(x[start:stop].T, x[start+lag:stop+lag])
+    for k in range(time_frames):
+        lag = k*gap
+        nblocks = time_frames-1-k
+        head = [lag_product(j*gap, (j+1)*gap, lag) for j in range(nblocks)]
+        tail = [lag_product(rows+j*gap, rows+(j+1)*gap, lag)
+                for j in range(nblocks)]
+        block = lag_product(0, total-lag, lag)
+        for tail_block in tail:
+            block -= tail_block
+        for f in range(time_frames-k):
+            cov[f*n:(f+1)*n, (f+k)*n:(f+k+1)*n] = block
+            if k:
+                cov[(f+k)*n:(f+k+1)*n, f*n:(f+1)*n] = block.T
+            if f < nblocks:
+                block = block - head[f] + tail[f]
+    avg = numx.concatenate([x[f*gap:f*gap+rows].sum(axis=0)
+                            for f in range(time_frames)])
+    return cov, avg
+
+
+class TimeFramesLinearNode(Node):
+    """Apply a ``TimeFramesNode`` (or ``TimeDelayNode``) followed by a
+    linear node, without building the expanded data.
+
+    During training the covariance matrices of ``PCANode``,
+    ``WhiteningNode`` and ``SFANode`` are computed directly from the
+    input: the blocks of the covariance matrix of the frames only depend
+    on the delay between the frames. During execution the output of these
+    nodes is computed as a sum of the projections of the delayed input.
+    For other nodes the frames are built and passed to the node.
+
+    ``TimeFramesLinearNode(TimeFramesNode(10), SFANode())`` is equivalent
+    to ``Flow([TimeFramesNode(10), SFANode()])``.
+    """
+
+    def __init__(self, frames_node, linear_node, input_dim=None, dtype=None):
+        """
+        Input arguments:
+        frames_node -- A ``TimeFramesNode`` or ``TimeDelayNode``
+        linear_node -- The node applied to the frames
+        """
+        if isinstance(frames_node, TimeDelaySlidingWindowNode):
+            err = "TimeDelaySlidingWindowNode can not be fused."
+            raise NodeException(err)
+        self.frames_node = frames_node
+        self.linear_node = linear_node
+        if input_dim is None:
+            input_dim = frames_node.input_dim
+        if dtype is None:
+            dtype = frames_node.dtype
+        super(TimeFramesLinearNode, self).__init__(
+            input_dim=input_dim, output_dim=linear_node.output_dim,
+            dtype=dtype)
+
+    def _set_input_dim(self, n):
+        self._input_dim = n
+        self.frames_node.input_dim = n
 
-        new_row = numx.zeros(cols, dtype=self.dtype)
-        new_row[:n] = x
+    def _set_dtype(self, t):
+        self._dtype = t
+        self.frames_node.dtype = t
+        self.linear_node.dtype = t
 
-        # Slide
-        if self.slide:
-            self.sliding_wnd[:-1, :] = self.sliding_wnd[1:, :]
+    def _get_supported_dtypes(self):
+        return mdp.utils.get_dtypes('Float')
 
-        # Delay
-        if self.cur_idx-gap >= 0:
-            new_row[n:] = self.sliding_wnd[self.cur_idx-gap, :-n]
+    def is_trainable(self):
+        return self.linear_node.is_trainable()
 
-        # Add new row to matrix
-        self.sliding_wnd[self.cur_idx, :] = new_row
+    @staticmethod
+    def is_invertible():
+        return False
 
-        if self.cur_idx < rows-1:
-            self.cur_idx = self.cur_idx+1 
+    def _linear_class(self):
+        """Return PCANode or SFANode if the linear node can be fused with
+        the frames, or None."""
+        node = self.linear_node
+        # these subclasses do not use the covariance matrices directly
+        if isinstance(node, (mdp.nodes.NIPALSNode, mdp.nodes.SFA2Node)):
+            return None
+        for klass in (mdp.nodes.PCANode, mdp.nodes.SFANode):
+            if isinstance(node, klass):
+                return klass
+        return None
+
+    def _update_cov(self, cov, base, rows, reverse):
+        if rows <= 0:
+            return
+        frames = self.frames_node
+        cov_mtx, avg = _frames_moments(base, rows, frames.time_frames,
+                                       frames.gap)
+        if reverse:
+            n = frames.input_dim
+            perm = numx.arange(frames.output_dim).reshape((-1, n))[::-1]
+            perm = perm.ravel()
+            cov_mtx, avg = cov_mtx[perm][:, perm], avg[perm]
+        cov.update_moments(cov_mtx, avg, rows)
+
+    def _train(self, x, *args, **kwargs):
+        frames, node = self.frames_node, self.linear_node
+        klass = self._linear_class()
+        if klass is None:
+            node.train(frames.execute(x), *args, **kwargs)
+            return
+        if node.input_dim is None:
+            node.input_dim = frames.output_dim
+        base, rows, reverse = frames._frames_base(x)
+        # check the arguments on a view with one row per frame, e.g. the
+        # SFANode needs at least two frames
+        node._check_train_args(base[:max(rows, 0)], *args, **kwargs)
+        node._train_phase_started = True
+        if klass is mdp.nodes.PCANode:
+            self._update_cov(node._cov_mtx, base, rows, reverse)
         else:
-            self.slide = True
+            include_last_sample = kwargs.get('include_last_sample')
+            if include_last_sample is None:
+                include_last_sample = node._include_last_sample
+            self._update_cov(node._cov_mtx, base,
+                             rows if include_last_sample else rows-1, reverse)
+            self._update_cov(node._dcov_mtx, base[1:]-base[:-1], rows-1,
+                             reverse)
+
+    def _stop_training(self, *args, **kwargs):
+        self.linear_node.stop_training(*args, **kwargs)
+        self._output_dim = self.linear_node.output_dim
 
-        return new_row[numx.newaxis,:]
+    def _execute(self, x):
+        frames, node = self.frames_node, self.linear_node
+        klass = self._linear_class()
+        if klass is mdp.nodes.PCANode:
+            weights = node.v
+            bias = -mult(node.avg, node.v).ravel()
+        elif klass is mdp.nodes.SFANode:
+            weights = node.sf
+            bias = -mult(node.avg, node.sf).ravel()
+        else:
+            return node.execute(frames.execute(x))
+        base, rows, reverse = frames._frames_base(x)
+        n, time_frames, gap = frames.input_dim, frames.time_frames, frames.gap
+        y = numx.zeros((rows, weights.shape[1]), dtype=self.dtype)
+        y += bias
+        for f in range(time_frames):
+            start = (time_frames-1-f)*gap if reverse else f*gap
+            y += mult(base[start:start+rows], weights[f*n:(f+1)*n])
+        return y
 
 class EtaComputerNode(Node):
     """Compute the eta values of the normalized training data.
@@ -693,13 +905,21 @@ def _execute(self, x):
 class HistogramNode(PreserveDimNode):
     """Node which stores a history of the data during its training phase.
 
-    The data history is stored in ``self.data_hist`` and can also be deleted to
-    free memory. Alternatively it can be automatically pickled to disk.
+    The data history is stored in ``self.data_hist`` and can also be deleted
+    (or set to None) to free memory. Alternatively it can be automatically
+    pickled to disk.
+
+    If ``hist_size`` is given, the history is a uniform random sample
+    (a reservoir sample) of at most ``hist_size`` rows of the training data,
+    so the memory requirements do not grow with the amount of training data.
+    Assigning a full reservoir of ``hist_size`` rows back to ``data_hist``
+    keeps the number of rows it was sampled from, assigning any other
+    history resets it to the number of assigned rows.
 
     Note that data is only stored during training.
     """
 
-    def __init__(self, hist_fraction=1.0, hist_filename=None,
+    def __init__(self, hist_fraction=1.0, hist_filename=None, hist_size=None,
                  input_dim=None, output_dim=None, dtype=None):
         """Initialize the node.
 
@@ -710,14 +930,54 @@ def __init__(self, hist_fraction=1.0, hist_filename=None,
             is called and data_hist is then cleared (to free memory).
             If filename is None (default value) then data_hist is not cleared
             and can be directly used after training.
+        hist_size -- Maximum number of stored rows. If the data is larger,
+            a uniform random sample of hist_size rows is kept.
+            If None (default value) all the data is stored.
         """
         super(HistogramNode, self).__init__(input_dim=input_dim,
                                             output_dim=output_dim,
                                             dtype=dtype)
         self._hist_filename = hist_filename
         self.hist_fraction = hist_fraction
+        self.hist_size = hist_size
         self.data_hist = None  # stores the data history
 
+    def _get_data_hist(self):
+        # the chunks are only concatenated when the history is requested
+        if len(self._hist_chunks) > 1:
+            self._hist_chunks = [numx.concatenate(self._hist_chunks)]
+        if self._hist_chunks:
+            return self._hist_chunks[0]
+        return None
+
+    def _set_data_hist(self, data_hist):
+        # a reservoir assigned back keeps the number of rows it was
+        # sampled from, any other history resets it
+        if data_hist is None:
+            self._hist_chunks = []
+            self._hist_tlen = 0
+        else:
+            self._hist_chunks = [data_hist]
+            if not (self.hist_size is not None and
+                    len(data_hist) == self.hist_size < self._hist_tlen):
+                self._hist_tlen = len(data_hist)
+
+    def _del_data_hist(self):
+        self._set_data_hist(None)
+
+    data_hist = property(_get_data_hist, _set_data_hist, _del_data_hist)
+
+    def __setstate__(self, state):
+        if '_hist_chunks' not in state:
+            # node pickled before the history was stored in chunks
+            state = dict(state)
+            state['hist_size'] = None
+            data_hist = state.pop('data_hist', None)
+            self.__dict__.update(state)
+            self.data_hist = data_hist
+        else:
+            self.__dict__.update(state)
+
     def _get_supported_dtypes(self):
         return (mdp.utils.get_dtypes('AllFloat') +
                 mdp.utils.get_dtypes('AllInteger') +
@@ -727,10 +987,72 @@ def _train(self, x):
         """Store the history data."""
         if self.hist_fraction < 1.0:
             x = x[numx.random.random(len(x)) < self.hist_fraction]
-        if self.data_hist is not None:
-            self.data_hist = numx.concatenate([self.data_hist, x])
+            self._add_hist(x, copy=False)
         else:
-            self.data_hist = x
+            self._add_hist(x)
+
+    def _add_hist(self, x, copy=True):
+        """Add the rows of x to the data history.
+
+        If copy is False x is stored without copying it, so it must not be
+        modified afterwards.
+
+        When more than hist_size rows have been seen, the reservoir sampling
+        algorithm R is used: row number i replaces a random stored row with
+        probability hist_size/(i+1).
+        """
+        tlen = self._hist_tlen
+        self._hist_tlen += len(x)
+        size = self.hist_size
+        if size is None or self._hist_tlen <= size:
+            if len(x):
+                self._hist_chunks.append(numx.array(x) if copy else x)
+            return
+        if tlen <= size:
+            # fill the reservoir
+            free = size - tlen
+            reservoir = numx.concatenate(self._hist_chunks + [x[:free]])
+            x = x[free:]
+            tlen = size
+        else:
+            reservoir = self._hist_chunks[0]
+        counts = tlen + numx.arange(1, len(x)+1)
+        index = (numx.random.random(len(x)) * counts).astype('l')
+        replace = index < size
+        # for repeated indices the last row wins, like in the sequential loop
+        reservoir[index[replace]] = x[replace]
+        self._hist_chunks = [reservoir]
+
+    def _join_hist(self, data_hist, hist_tlen):
+        """Merge the data history of another node into this one.
+
+        data_hist -- History of the other node (all its data or a reservoir
+            sample).
+        hist_tlen -- Number of rows from which data_hist was sampled.
+        """
+        if data_hist is None or not hist_tlen:
+            return
+        tlen = self._hist_tlen
+        size = self.hist_size
+        if size is None or tlen + hist_tlen <= size:
+            self._hist_chunks.append(data_hist)
+            self._hist_tlen += hist_tlen
+            return
+        own_hist = self.data_hist
+        if own_hist is None:
+            if len(data_hist) > size:
+                data_hist = data_hist[numx.random.permutation(len(data_hist))
+                                      [:size]]
+            self._hist_chunks = [numx.array(data_hist)]
+            self._hist_tlen = hist_tlen
+            return
+        # the number of rows drawn from each sample of the union
+        n_own = numx.random.hypergeometric(tlen, hist_tlen, size)
+        own_index = numx.random.permutation(len(own_hist))[:n_own]
+        other_index = numx.random.permutation(len(data_hist))[:size-n_own]
+        self._hist_chunks = [numx.concatenate([own_hist[own_index],
+                                               data_hist[other_index]])]
+        self._hist_tlen = tlen + hist_tlen
 
     def _stop_training(self):
         """Pickle the histogram data to file and clear it if required."""
@@ -758,7 +1080,7 @@ class AdaptiveCutoffNode(HistogramNode):
     """
 
     def __init__(self, lower_cutoff_fraction=None, upper_cutoff_fraction=None,
-                 hist_fraction=1.0, hist_filename=None,
+                 hist_fraction=1.0, hist_filename=None, hist_size=None,
                  input_dim=None, output_dim=None, dtype=None):
         """Initialize the node.
 
@@ -779,9 +1101,14 @@ def __init__(self, lower_cutoff_fraction=None, upper_cutoff_fraction=None,
             cleared (to free memory).  If filename is ``None``
             (default value) then ``data_hist`` is not cleared and can
             be directly used after training.
+          hist_size
+            Maximum number of rows stored for the histogram. If the
+            training data is larger, the cutoff values are estimated from
+            a uniform random sample of ``hist_size`` rows.
         """
         super(AdaptiveCutoffNode, self).__init__(hist_fraction=hist_fraction,
                                                  hist_filename=hist_filename,
+                                                 hist_size=hist_size,
                                                  input_dim=input_dim,
                                                  output_dim=output_dim,
                                                  dtype=dtype)
@@ -797,15 +1124,21 @@ def _get_supported_dtypes(self):
     def _stop_training(self):
         """Calculate the cutoff bounds based on collected histogram data."""
         if self.lower_cutoff_fraction or self.upper_cutoff_fraction:
-            sorted_data = self.data_hist.copy()
-            sorted_data.sort(axis=0)
+            data = self.data_hist
+            indices = {}
             if self.lower_cutoff_fraction:
-                index = self.lower_cutoff_fraction * len(sorted_data)
-                self.lower_bounds = sorted_data[int(index)]
+                index = self.lower_cutoff_fraction * len(data)
+                indices['lower'] = int(index)
             if self.upper_cutoff_fraction:
-                index = (len(sorted_data) -
-                         self.upper_cutoff_fraction * len(sorted_data))
-                self.upper_bounds = sorted_data[int(index)]
+                index = len(data) - self.upper_cutoff_fraction * len(data)
+                indices['upper'] = int(index)
+            # only the order statistics at the cutoff indices are needed
+            partitioned = numx.partition(data, sorted(indices.values()),
+                                         axis=0)
+            if 'lower' in indices:
+                self.lower_bounds = partitioned[indices['lower']]
+            if 'upper' in indices:
+                self.upper_bounds = partitioned[indices['upper']]
         super(AdaptiveCutoffNode, self)._stop_training()
 
     def _execute(self, x):
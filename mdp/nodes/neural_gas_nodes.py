@@ -5,8 +5,16 @@
 from builtins import object
 __docformat__ = "restructuredtext en"
 
+from collections import deque
+
+import mdp
 from mdp import numx, numx_rand, utils, graph, Node
 
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
 class _NGNodeData(object):
     """Data associated to a node in a Growing Neural Gas graph."""
     def __init__(self, pos, error=0.0, hits=0, label=None):
@@ -25,6 +33,151 @@ def inc_age(self):
         self.age += 1
 
 
+class _NGArrayEngine(object):
+    """Array representation of a (Growing) Neural Gas graph.
+
+    The positions of the nodes are the rows of ``pos``, their cumulative
+    errors are stored in the vector ``cum_error``, and the edges in the
+    symmetric matrix ``ages``, where ``ages[i, j] >= 0`` is the age of the
+    edge between node i and node j and -1 means that there is no edge. The
+    direction of the edges is only kept in the boolean matrix ``heads``
+    (``heads[i, j]`` is True for an edge going from i to j). Free slots
+    (``alive`` is False) are reused for new nodes. ``births`` keeps the
+    insertion order of the nodes, so that the equivalent `mdp.graph.Graph`
+    has its nodes in the same order as if it had been built directly.
+    """
+
+    def __init__(self, dim, dtype, capacity=16):
+        self.pos = numx.zeros((capacity, dim), dtype=dtype)
+        self.cum_error = numx.zeros(capacity)
+        self.alive = numx.zeros(capacity, dtype='bool')
+        self.births = numx.zeros(capacity, dtype='int64')
+        self.ages = -numx.ones((capacity, capacity), dtype='i')
+        self.heads = numx.zeros((capacity, capacity), dtype='bool')
+        self.degree = numx.zeros(capacity, dtype='i')
+        self.n_nodes = 0
+        self._n_births = 0
+        # materialized graph and the number of changes it corresponds to
+        self._graph = None
+        self._graph_version = -1
+        self._version = 0
+
+    def _grow(self):
+        capacity = 2 * len(self.alive)
+        old_capacity = len(self.alive)
+        def grown(array, fill=0):
+            new = numx.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+            new[:old_capacity] = array
+            new[old_capacity:] = fill
+            return new
+        self.pos = grown(self.pos)
+        self.cum_error = grown(self.cum_error)
+        self.alive = grown(self.alive, False)
+        self.births = grown(self.births)
+        self.degree = grown(self.degree)
+        ages = -numx.ones((capacity, capacity), dtype=self.ages.dtype)
+        ages[:old_capacity, :old_capacity] = self.ages
+        self.ages = ages
+        heads = numx.zeros((capacity, capacity), dtype='bool')
+        heads[:old_capacity, :old_capacity] = self.heads
+        self.heads = heads
+
+    def ids(self):
+        """Return the indices of the nodes, in insertion order."""
+        ids = self.alive.nonzero()[0]
+        return ids[self.births[ids].argsort()]
+
+    def add_node(self, pos, error=0.0):
+        if self.n_nodes == len(self.alive):
+            self._grow()
+        idx = (~self.alive).nonzero()[0][0]
+        self.pos[idx] = pos
+        self.cum_error[idx] = error
+        self.alive[idx] = True
+        self.births[idx] = self._n_births
+        self._n_births += 1
+        self.n_nodes += 1
+        self._version += 1
+        return idx
+
+    def remove_node(self, idx):
+        for neighbor in self.neighbors(idx):
+            self.remove_edge(idx, neighbor)
+        self.alive[idx] = False
+        self.n_nodes -= 1
+        self._version += 1
+
+    def add_edge(self, from_, to_):
+        self.ages[from_, to_] = self.ages[to_, from_] = 0
+        self.heads[from_, to_] = True
+        self.degree[from_] += 1
+        self.degree[to_] += 1
+        self._version += 1
+
+    def remove_edge(self, idx1, idx2):
+        """Remove the edge between two nodes, whatever its direction."""
+        self.ages[idx1, idx2] = self.ages[idx2, idx1] = -1
+        self.heads[idx1, idx2] = self.heads[idx2, idx1] = False
+        self.degree[idx1] -= 1
+        self.degree[idx2] -= 1
+        self._version += 1
+
+    def reset_edge_age(self, idx1, idx2):
+        self.ages[idx1, idx2] = self.ages[idx2, idx1] = 0
+
+    def neighbors(self, idx):
+        return (self.ages[idx] >= 0).nonzero()[0]
+
+    def inc_ages(self, idx):
+        """Increase the age of all the edges of a node."""
+        neighbors = self.neighbors(idx)
+        self.ages[idx, neighbors] += 1
+        self.ages[neighbors, idx] += 1
+
+    def square_distances(self, x):
+        """Return the squared distances of all slots from x (infinite for
+        the free slots)."""
+        tmp = self.pos - x
+        dists = (tmp*tmp).sum(axis=1)
+        dists[~self.alive] = numx.inf
+        return dists
+
+    def remove_old_edges(self, max_age):
+        """Remove all the edges older than max_age."""
+        old = self.ages > max_age
+        if old.any():
+            self.ages[old] = -1
+            self.heads[old] = False
+            self.degree = (self.ages >= 0).sum(axis=1).astype('i')
+            self._version += 1
+
+    def modified(self):
+        """Signal that the arrays were changed directly."""
+        self._version += 1
+
+    def to_graph(self):
+        """Return the equivalent graph, as a `mdp.graph.CompactGraphAdapter`
+        (which has the same interface as `mdp.graph.Graph`).
+
+        The graph is a snapshot: changing it does not affect the arrays.
+        """
+        if self._graph_version == self._version:
+            return self._graph
+        g = graph.CompactGraphAdapter()
+        nodes = {}
+        for idx in self.ids():
+            nodes[idx] = g.add_node(_NGNodeData(self.pos[idx].copy(),
+                                                self.cum_error[idx]))
+        heads, tails = self.heads.nonzero()
+        order = numx.lexsort((self.births[tails], self.births[heads]))
+        for head, tail in zip(heads[order], tails[order]):
+            g.add_edge(nodes[head], nodes[tail],
+                       _NGEdgeData(self.ages[head, tail]))
+        self._graph = g
+        self._graph_version = self._version
+        return g
+
+
 class GrowingNeuralGasNode(Node):
     """Learn the topological structure of the input data by building a
     corresponding graph approximation.
@@ -40,13 +193,19 @@ class GrowingNeuralGasNode(Node):
     D. S. Touretzky, and T. K. Leen (editors), Advances in Neural Information
     Processing Systems 7, pages 625-632. MIT Press, Cambridge MA, 1995.
 
+    With ``engine='array'`` the graph is kept in arrays (node positions,
+    errors, and a matrix of edge ages) instead of `mdp.graph.Graph`
+    objects. This is much faster for large graphs. In this case the
+    ``graph`` attribute is built on demand and is a snapshot of the
+    current state: changing it does not affect the node.
+
     **Attributes and methods of interest**
 
     - graph -- The corresponding `mdp.graph.Graph` object
     """
     def __init__(self, start_poss=None, eps_b=0.2, eps_n=0.006, max_age=50,
                  lambda_=100, alpha=0.5, d=0.995, max_nodes=2147483647,
-                 input_dim=None, dtype=None):
+                 engine='graph', input_dim=None, dtype=None):
         """Growing Neural Gas algorithm.
 
         :Parameters:
@@ -99,7 +258,17 @@ def __init__(self, start_poss=None, eps_b=0.2, eps_n=0.006, max_age=50,
             maximal number of nodes in the graph.
 
             Default: 2^31 - 1
+
+          engine
+            ``'graph'`` to store the graph as `mdp.graph.Graph` object,
+            ``'array'`` to store it in arrays.
+
+            Default: 'graph'
         """
+        if engine not in ('graph', 'array'):
+            raise mdp.NodeException("Unknown engine '%s'." % str(engine))
+        self.engine = engine
+        self._engine = None
         self.graph = graph.Graph()
         self.tlen = 0
 
@@ -121,13 +290,37 @@ def _set_input_dim(self, n):
         self._input_dim = n
         self.output_dim = n
 
+    def _get_graph(self):
+        if self._engine is not None:
+            return self._engine.to_graph()
+        return self._graph
+
+    def _set_graph(self, graph):
+        self._graph = graph
+        self._nn_index = None
+
+    graph = property(_get_graph, _set_graph,
+                     doc="The corresponding `mdp.graph.Graph` object.")
+
     def _add_node(self, pos):
+        if self.engine == 'array':
+            if self._engine is None:
+                self._engine = _NGArrayEngine(len(pos), pos.dtype)
+            return self._engine.add_node(pos)
         node = self.graph.add_node(_NGNodeData(pos))
         return node
 
     def _add_edge(self, from_, to_):
+        if self._engine is not None:
+            self._engine.add_edge(from_, to_)
+            return
         self.graph.add_edge(from_, to_, _NGEdgeData())
 
+    def _n_nodes(self):
+        if self._engine is not None:
+            return self._engine.n_nodes
+        return len(self.graph.nodes)
+
     def _get_nearest_nodes(self, x):
         """Return the two nodes in the graph that are nearest to x and their
         squared distances. (Return ([node1, node2], [dist1, dist2])"""
@@ -187,14 +380,14 @@ def _insert_new_node(self):
                                        fnode.data.cum_error)
 
     def get_nodes_position(self):
+        if self._engine is not None:
+            return numx.array(self._engine.pos[self._engine.ids()],
+                              dtype = self.dtype)
         return numx.array([n.data.pos for n in self.graph.nodes],
                           dtype = self.dtype)
 
     def _train(self, input):
-        g = self.graph
-        d = self.d
-
-        if len(g.nodes)==0:
+        if self._n_nodes()==0:
             # if missing, generate two initial nodes at random
             # assuming that the input data has zero mean and unit variance,
             # choose the random position according to a gaussian distribution
@@ -203,6 +396,13 @@ def _train(self, input):
             self._add_node(self._refcast(normal(0.0, 1.0, self.input_dim)))
             self._add_node(self._refcast(normal(0.0, 1.0, self.input_dim)))
 
+        if self._engine is not None:
+            self._train_array(input)
+            return
+
+        g = self.graph
+        d = self.d
+
         # loop on single data points
         for x in input:
             self.tlen += 1
@@ -244,21 +444,135 @@ def _train(self, input):
             for node in g.nodes:
                 node.data.cum_error *= d
 
+    def _train_array(self, input):
+        """Same as the graph training loop, on the array engine."""
+        eng = self._engine
+        d = self.d
+        for x in input:
+            self.tlen += 1
+
+            # step 2 - find the nearest nodes
+            dists = eng.square_distances(x)
+            n0 = dists.argmin()
+            dist0 = dists[n0]
+            dists[n0] = numx.inf
+            n1 = dists.argmin()
+
+            # step 3 - increase age of the emanating edges
+            eng.inc_ages(n0)
+
+            # step 4 - update error
+            eng.cum_error[n0] += numx.sqrt(dist0)
+
+            # step 5 - move nearest node and neighbours
+            eng.pos[n0] += self.eps_b*(x - eng.pos[n0])
+            neighbors = eng.neighbors(n0)
+            eng.pos[neighbors] += self.eps_n*(x - eng.pos[neighbors])
+
+            # step 6 - update n0<->n1 edge
+            if eng.ages[n0, n1] >= 0:
+                eng.reset_edge_age(n0, n1)
+            else:
+                eng.add_edge(n0, n1)
+
+            # step 7 - remove old edges
+            neighbors = eng.neighbors(n0)
+            for n in neighbors[eng.ages[n0, neighbors] > self.max_age]:
+                eng.remove_edge(n0, n)
+                if eng.degree[n] == 0:
+                    eng.remove_node(n)
+            if eng.degree[n0] == 0:
+                eng.remove_node(n0)
+
+            # step 8 - add a new node each lambda steps
+            if not self.tlen % self.lambda_ and eng.n_nodes < self.max_nodes:
+                self._insert_new_node_array()
+
+            # step 9 - decrease errors
+            eng.cum_error *= d
+        eng.modified()
+
+    def _insert_new_node_array(self):
+        eng = self._engine
+        # determine the node with the highest error
+        errors = numx.where(eng.alive, eng.cum_error, -numx.inf)
+        qnode = errors.argmax()
+        # determine the neighbour with the highest error
+        neighbors = eng.neighbors(qnode)
+        fnode = neighbors[eng.cum_error[neighbors].argmax()]
+        # new node, halfway between the worst node and the worst of
+        # its neighbors
+        new_node = eng.add_node(0.5*(eng.pos[qnode] + eng.pos[fnode]))
+        # update edges
+        eng.remove_edge(qnode, fnode)
+        eng.add_edge(qnode, new_node)
+        eng.add_edge(fnode, new_node)
+        # update errors
+        eng.cum_error[qnode] *= self.alpha
+        eng.cum_error[fnode] *= self.alpha
+        eng.cum_error[new_node] = 0.5*(eng.cum_error[qnode] +
+                                       eng.cum_error[fnode])
+
+    def _get_nn_index(self, kdtree):
+        """Return the positions of the nodes and, if kdtree is True, a
+        KD-tree built on them. The snapshot is reused by later queries."""
+        if self._nn_index is None:
+            self._nn_index = (self.get_nodes_position(), None)
+        pos, tree = self._nn_index
+        if kdtree and tree is None:
+            tree = cKDTree(pos)
+            self._nn_index = (pos, tree)
+        return pos, tree
+
+    def nearest_neighbor_ids(self, input, kdtree=None, chunk_size=1000):
+        """Assign each point in the input data to the nearest node in
+        the graph. Return the array of the indices of the nearest nodes
+        (in the order of ``graph.nodes`` and `get_nodes_position`) and
+        the array of distances.
+
+        The positions of the nodes are copied into an array at the first
+        query after training, so that the input is processed in chunks of
+        ``chunk_size`` points with a few array operations each. If
+        ``kdtree`` is True the positions are stored in a KD-tree
+        (``scipy.spatial.cKDTree``), which is faster for graphs with many
+        nodes in a low-dimensional space. By default a KD-tree is used if
+        it is available and the input dimension is at most 10.
+        Executing this function will close the training phase if
+        necessary."""
+        self._pre_execution_checks(input)
+        if kdtree is None:
+            kdtree = cKDTree is not None and self.input_dim <= 10
+        elif kdtree and cKDTree is None:
+            err = "The KD-tree requires scipy.spatial."
+            raise mdp.NodeException(err)
+        x = self._refcast(input)
+        pos, tree = self._get_nn_index(kdtree)
+        if tree is not None:
+            dists, ids = tree.query(x)
+            return ids, dists
+        ids = numx.empty(x.shape[0], dtype=numx.intp)
+        pos2 = (pos*pos).sum(axis=1)
+        for start in range(0, x.shape[0], chunk_size):
+            chunk = x[start:start+chunk_size]
+            dists = pos2 - 2*numx.dot(chunk, pos.T)
+            ids[start:start+chunk_size] = dists.argmin(axis=1)
+        # compute the distances to the nearest nodes directly, as the
+        # expansion above is affected by rounding errors
+        tmp = x - pos[ids]
+        return ids, numx.sqrt((tmp*tmp).sum(axis=1))
+
     def nearest_neighbor(self, input):
         """Assign each point in the input data to the nearest node in
         the graph. Return the list of the nearest node instances, and
         the list of distances.
         Executing this function will close the training phase if
-        necessary."""
-        super(GrowingNeuralGasNode, self).execute(input)
+        necessary.
 
-        nodes = []
-        dists = []
-        for x in input:
-            (n0, _), dist = self._get_nearest_nodes(x)
-            nodes.append(n0)
-            dists.append(numx.sqrt(dist[0]))
-        return nodes, dists
+        See `nearest_neighbor_ids` for a faster version returning arrays.
+        """
+        ids, dists = self.nearest_neighbor_ids(input)
+        nodes = self.graph.nodes
+        return [nodes[idx] for idx in ids], list(dists)
 
 class NeuralGasNode(GrowingNeuralGasNode):
     """Learn the topological structure of the input data by building a
@@ -269,6 +583,15 @@ class NeuralGasNode(GrowingNeuralGasNode):
     Maekisara, K., Simula, O., and Kangas, J. (eds.), Artificial Neural
     Networks. Elsevier, North-Holland., 1991.
 
+    As for `GrowingNeuralGasNode`, ``engine='array'`` keeps the graph
+    in arrays, so that the ranking and the update of all the nodes are
+    done with a few array operations per data point. On the array engine
+    the batch Neural Gas algorithm is also available (``batch=True``):
+    each epoch all nodes are moved at once to the weighted mean of the
+    data, with the weights depending on the ranks (see Cottrell, M.,
+    Hammer, B., Hasenfuss, A., and Villmann, T.: Batch and median neural
+    gas. Neural Networks 19, p. 762--771, 2006).
+
     **Attributes and methods of interest**
 
     - graph -- The corresponding `mdp.graph.Graph` object
@@ -284,6 +607,8 @@ def __init__(self, num_nodes = 10,
                        max_age_f=200,               # final edge lifetime
                        max_epochs=100,
                        n_epochs_to_train=None,
+                       engine='graph',
+                       batch=False,
                        input_dim=None,
                        dtype=None):
         """Neural Gas algorithm.
@@ -332,8 +657,27 @@ def __init__(self, num_nodes = 10,
             number of epochs to train on each call. Useful for batch learning
             and for visualization of the training process. Default is to
             train once until max_epochs is reached.
+
+          engine
+            ``'graph'`` (default) to store the graph as `mdp.graph.Graph`
+            object, ``'array'`` to store it in arrays.
+
+          batch
+            if True, use the batch Neural Gas algorithm, which processes
+            all data points of a training chunk in each update. epsilon
+            is not used in this case, and edges not refreshed during an
+            epoch are aged by the number of data points. Requires
+            ``engine='array'``.
         """
 
+        if engine not in ('graph', 'array'):
+            raise mdp.NodeException("Unknown engine '%s'." % str(engine))
+        if batch and engine != 'array':
+            err = "Batch Neural Gas requires engine='array'."
+            raise mdp.NodeException(err)
+        self.engine = engine
+        self.batch = batch
+        self._engine = None
         self.graph = graph.Graph()
 
         if n_epochs_to_train is None:
@@ -364,9 +708,7 @@ def __init__(self, num_nodes = 10,
 
 
     def _train(self, input):
-        g = self.graph
-
-        if len(g.nodes) == 0:
+        if self._n_nodes() == 0:
             # if missing, generate num_nodes initial nodes at random
             # assuming that the input data has zero mean and unit variance,
             # choose the random position according to a gaussian distribution
@@ -375,6 +717,7 @@ def _train(self, input):
             for _ in range(self.num_nodes):
                 self._add_node(self._refcast(normal(0.0, 1.0, self.input_dim)))
 
+        g = self.graph if self._engine is None else None
         epoch = self.epoch
         e_i = self.epsilon_i
         e_f = self.epsilon_f
@@ -395,6 +738,13 @@ def _train(self, input):
             lmbda = l_i * ((old_div(l_f,l_i))**denom)
             T = T_i * ((old_div(T_f,T_i))**denom)
             epoch += 1
+            if self._engine is not None:
+                if self.batch:
+                    self._batch_epoch(di, lmbda, T)
+                else:
+                    self._array_epoch(di, epsilon, lmbda, T)
+                remaining_epochs -= 1
+                continue
             for x in di:
                 # Step 1 rank nodes according to their distance to random point
                 ranked_nodes = self._rank_nodes_by_distance(x)
@@ -426,23 +776,100 @@ def _train(self, input):
                 self._remove_old_edges(max_age=T)
             remaining_epochs -= 1
         self.epoch = epoch
+        if self._engine is not None:
+            self._engine.modified()
+
+    def _ranks(self, dists):
+        """Return the rank of each node given the distances (free slots of
+        the array engine have infinite distance and come last)."""
+        order = dists.argsort(axis=-1)
+        ranks = numx.empty(order.shape, dtype='d')
+        if dists.ndim == 1:
+            ranks[order] = numx.arange(len(order))
+        else:
+            rows = numx.arange(order.shape[0])[:, numx.newaxis]
+            ranks[rows, order] = numx.arange(order.shape[1])
+        return order, ranks
+
+    def _array_epoch(self, di, epsilon, lmbda, T):
+        """One epoch of online Neural Gas on the array engine.
+
+        Since all the edges age at every step, the ages are not updated
+        one by one: each edge stores the step at which its age was zero,
+        and the edges are queued in that order, so that the edges older
+        than T are found at the front of the queue.
+        """
+        eng = self._engine
+        # step at which the age of each edge was zero
+        births = -eng.ages.astype('int64')
+        heads, tails = numx.triu(eng.ages >= 0).nonzero()
+        order = births[heads, tails].argsort(kind='mergesort')
+        queue = deque(zip(births[heads, tails][order].tolist(),
+                          heads[order].tolist(), tails[order].tolist()))
+        for step, x in enumerate(di):
+            # Step 1 rank nodes according to their distance to random point
+            order, ranks = self._ranks(eng.square_distances(x))
+
+            # Step 2 move nodes
+            h = epsilon * numx.exp(-ranks / lmbda)
+            h[~eng.alive] = 0.
+            eng.pos += h[:, numx.newaxis] * (x - eng.pos)
+
+            # Step 3 update edge weight (all the ages grow with step)
+            step += 1
+
+            # Step 4 set age of edge between first two nodes to zero
+            #  or create it if it doesn't exist.
+            n0, n1 = order[0], order[1]
+            if eng.ages[n0, n1] < 0:
+                eng.add_edge(n0, n1)
+            births[n0, n1] = births[n1, n0] = step
+            queue.append((step, min(n0, n1), max(n0, n1)))
+
+            # step 5 delete edges with age > max_age
+            while queue and step - queue[0][0] > T:
+                birth, n0, n1 = queue.popleft()
+                # skip the edges that were refreshed or removed since
+                if eng.ages[n0, n1] >= 0 and births[n0, n1] == birth:
+                    eng.remove_edge(n0, n1)
+        # store the current ages
+        edges = eng.ages >= 0
+        eng.ages[edges] = (len(di) - births[edges]).astype(eng.ages.dtype)
+
+    def _batch_epoch(self, di, lmbda, T):
+        """One epoch of batch Neural Gas on the array engine."""
+        eng = self._engine
+        ids = eng.alive.nonzero()[0]
+        pos = eng.pos[ids]
+        # squared distances of all data points from all nodes
+        dists = ((di*di).sum(axis=1)[:, numx.newaxis] + (pos*pos).sum(axis=1)
+                 - 2 * utils.mult(di, pos.T))
+        order, ranks = self._ranks(dists)
+        # every node moves to the mean of the data weighted by the ranks
+        h = numx.exp(-ranks / lmbda)
+        eng.pos[ids] = (utils.mult(h.T, di) /
+                        h.sum(axis=0)[:, numx.newaxis]).astype(eng.pos.dtype)
+        # age all edges by the number of data points, then refresh the
+        # edges between the two nearest nodes of each data point
+        eng.ages[eng.ages >= 0] += di.shape[0]
+        pairs = set(zip(ids[order[:, 0]], ids[order[:, 1]]))
+        for n0, n1 in pairs:
+            if eng.ages[n0, n1] >= 0:
+                eng.reset_edge_age(n0, n1)
+            else:
+                eng.add_edge(n0, n1)
+        eng.remove_old_edges(T)
 
 
     def _rank_nodes_by_distance(self, x):
         """Return the nodes in the graph in a list ranked by their squared
         distance to x. """
 
-        #TODO: Refactor together with GNGNode._get_nearest_nodes
-
-        # distance function
-        def _distance_from_node(node):
-            tmp = node.data.pos - x
-            return utils.mult(tmp, tmp) # maps to mdp.numx.dot
-
         g = self.graph
 
         # distances of all graph nodes from x
-        distances = numx.array(list(map(_distance_from_node, g.nodes)))
+        tmp = self.get_nodes_position() - x
+        distances = (tmp*tmp).sum(axis=1)
         ids = distances.argsort()
         ranked_nodes = [g.nodes[id] for id in ids]
 
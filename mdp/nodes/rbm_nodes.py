@@ -21,6 +21,61 @@ def rrep(x, n):
     shp = x.shape + (1,)
     return x.reshape(shp).repeat(n, axis=-1)
 
+def _sigmoid_inplace(a):
+    """Replace the values in a by 1/(1+exp(-a)), without temporary arrays.
+    """
+    numx.negative(a, out=a)
+    exp(a, out=a)
+    a += 1.
+    numx.reciprocal(a, out=a)
+
+
+class _RandomPool(object):
+    """Uniform random numbers in [0, 1), generated in large blocks to
+    reduce the overhead of calling the random number generator."""
+
+    def __init__(self, size, dtype):
+        self.size = size
+        self.dtype = dtype
+        self._pool = numx.zeros((0,), dtype=dtype)
+        self._pos = 0
+
+    def uniform(self, shape):
+        n = int(numx.prod(shape))
+        if self._pos + n > self._pool.shape[0]:
+            self._pool = random(max(self.size, n)).astype(self.dtype)
+            self._pos = 0
+        values = self._pool[self._pos:self._pos+n].reshape(shape)
+        self._pos += n
+        return values
+
+
+class _GibbsBuffers(object):
+    """Preallocated arrays for the Contrastive Divergence updates of an
+    RBM on mini-batches of at most batch_size observations."""
+
+    def __init__(self, batch_size, visible_dim, hidden_dim, dtype):
+        self.batch_size = batch_size
+        self.dtype = dtype
+        def zeros(dim):
+            return numx.zeros((batch_size, dim), dtype=dtype)
+        self.v = zeros(visible_dim)
+        self.ph_data, self.h_data = zeros(hidden_dim), zeros(hidden_dim)
+        self.pv_model, self.v_model = zeros(visible_dim), zeros(visible_dim)
+        self.ph_model, self.h_model = zeros(hidden_dim), zeros(hidden_dim)
+        self.data_term = numx.zeros((visible_dim, hidden_dim), dtype=dtype)
+        self.model_term = numx.zeros((visible_dim, hidden_dim), dtype=dtype)
+        self.pool = _RandomPool(max(1 << 16, 8*batch_size*max(visible_dim,
+                                                            hidden_dim)),
+                                dtype)
+
+    def __getitem__(self, n):
+        """Return the buffers for a batch of n observations, as a
+        dictionary."""
+        names = ('v', 'ph_data', 'h_data', 'pv_model', 'v_model',
+                 'ph_model', 'h_model')
+        return dict((name, getattr(self, name)[:n]) for name in names)
+
 
 class RBMNode(mdp.Node):
     """Restricted Boltzmann Machine node. An RBM is an undirected
@@ -64,6 +119,8 @@ def __init__(self, hidden_dim, visible_dim = None, dtype = None):
         """
         super(RBMNode, self).__init__(visible_dim, hidden_dim, dtype)
         self._initialized = False
+        self._gibbs_buffers = None
+        self._pcd_chains = None
 
     def _init_weights(self):
         # weights and biases are initialized to small random values to
@@ -81,20 +138,38 @@ def _init_weights(self):
         # delta w, bv, bh used for momentum term
         self._delta = (0., 0., 0.)
 
-    def _sample_h(self, v):
+    def _sample_h(self, v, out=None, pool=None):
         # returns P(h=1|v,W,b) and a sample from it
-        probs = old_div(1.,(1. + exp(-self.bh - mult(v, self.w))))
-        h = (probs > random(probs.shape)).astype(self.dtype)
+        # if out=(probs, h) is given, the results are written in
+        # those arrays, and the random numbers are taken from pool
+        if out is None:
+            probs = old_div(1.,(1. + exp(-self.bh - mult(v, self.w))))
+            h = (probs > random(probs.shape)).astype(self.dtype)
+            return probs, h
+        probs, h = out
+        mult(v, self.w, out=probs)
+        probs += self.bh
+        _sigmoid_inplace(probs)
+        numx.less(pool.uniform(probs.shape), probs, out=h, casting='unsafe')
         return probs, h
 
-    def _sample_v(self, h):
+    def _sample_v(self, h, out=None, pool=None):
         # returns  P(v=1|h,W,b) and a sample from it
-        probs = old_div(1.,(1. + exp(-self.bv - mult(h, self.w.T))))
-        v = (probs > random(probs.shape)).astype(self.dtype)
+        # out and pool as in _sample_h
+        if out is None:
+            probs = old_div(1.,(1. + exp(-self.bv - mult(h, self.w.T))))
+            v = (probs > random(probs.shape)).astype(self.dtype)
+            return probs, v
+        probs, v = out
+        mult(h, self.w.T, out=probs)
+        probs += self.bv
+        _sigmoid_inplace(probs)
+        numx.less(pool.uniform(probs.shape), probs, out=v, casting='unsafe')
         return probs, v
 
     def _train(self, v, n_updates=1, epsilon=0.1, decay=0., momentum=0.,
-               update_with_ph=True, verbose=False):
+               update_with_ph=True, batch_size=None, n_epochs=1,
+               shuffle=True, persistent=False, verbose=False):
         """Update the internal structures according to the input data `v`.
         The training is performed using Contrastive Divergence (CD).
 
@@ -115,29 +190,100 @@ def _train(self, v, n_updates=1, epsilon=0.1, decay=0., momentum=0.,
             probability of the hidden unit activations instead of a
             sample from it. This is in order to speed up sequential
             learning of RBMs. Set this to False to use the samples instead.
+          batch_size
+            if given, `v` is split into mini-batches of ``batch_size``
+            observations, and the weights are updated after each of them.
+            By default all of `v` is used for a single update.
+          n_epochs
+            number of passes through `v`. Default value: 1
+          shuffle
+            if True, the observations are assigned to the mini-batches
+            in a different random order in each epoch. Default value: True
+          persistent
+            if True, use Persistent Contrastive Divergence (Tieleman, T.
+            (2008). Training restricted Boltzmann machines using
+            approximations to the likelihood gradient. ICML 2008): the
+            Gibbs chains of the model term are not restarted at the data,
+            but continue from their state after the last update, also
+            across calls to `train`. Default value: False
+
+        The sampling arrays are allocated once for all mini-batches.
+        To train in single precision, create the node with
+        ``dtype='float32'``.
         """
         if not self._initialized:
             self._init_weights()
 
-        # useful quantities
+        n = v.shape[0]
+        if batch_size is None or batch_size > n:
+            batch_size = n
+        buffers = self._gibbs_buffers
+        if (buffers is None or buffers.batch_size < batch_size or
+            buffers.dtype != self.dtype):
+            buffers = _GibbsBuffers(batch_size, self.input_dim,
+                                    self.output_dim, self.dtype)
+            self._gibbs_buffers = buffers
+        if persistent and (self._pcd_chains is None or
+                           self._pcd_chains.shape[0] < batch_size):
+            self._pcd_chains = None
+
+        for epoch in range(n_epochs):
+            self._train_err = 0.
+            order = None
+            if shuffle and batch_size < n:
+                order = mdp.numx_rand.permutation(n)
+            for start in range(0, n, batch_size):
+                stop = min(start+batch_size, n)
+                bufs = buffers[stop-start]
+                if order is None:
+                    batch = v[start:stop]
+                else:
+                    batch = numx.take(v, order[start:stop], axis=0,
+                                      out=bufs['v'])
+                self._cd_update(batch, bufs, buffers, n_updates, epsilon,
+                                decay, momentum, update_with_ph, persistent)
+
+        if verbose:
+            print('training error', old_div(self._train_err,v.shape[0]))
+            ph, h = self._sample_h(v)
+            print('energy', self._energy(v, ph).sum())
+
+    def _cd_update(self, v, bufs, buffers, n_updates, epsilon, decay,
+                   momentum, update_with_ph, persistent):
+        # one CD update of the weights using the observations in v;
+        # bufs are the arrays in buffers for this batch size
         n = v.shape[0]
         w, bv, bh = self.w, self.bv, self.bh
+        pool = buffers.pool
 
         # old gradients for momentum term
         dw, dbv, dbh = self._delta
 
         # first update of the hidden units for the data term
-        ph_data, h_data = self._sample_h(v)
+        ph_data, h_data = self._sample_h(v, out=(bufs['ph_data'],
+                                                 bufs['h_data']), pool=pool)
         # n updates of both v and h for the model term
-        h_model = h_data.copy()
+        if persistent:
+            if self._pcd_chains is None:
+                self._pcd_chains = numx.zeros((buffers.batch_size,
+                                               self.output_dim),
+                                              dtype=self.dtype)
+                self._pcd_chains[:n] = h_data
+            h_model = self._pcd_chains[:n]
+        else:
+            h_model = bufs['h_model']
+            h_model[:] = h_data
         for i in range(n_updates):
-            pv_model, v_model = self._sample_v(h_model)
-            ph_model, h_model = self._sample_h(v_model)
+            pv_model, v_model = self._sample_v(
+                h_model, out=(bufs['pv_model'], bufs['v_model']), pool=pool)
+            ph_model, h_model = self._sample_h(
+                v_model, out=(bufs['ph_model'], h_model), pool=pool)
 
         # update w
-        data_term = mult(v.T, ph_data)
-        model_term = mult(v_model.T, ph_model)
-        dw = momentum*dw + epsilon*(old_div((data_term - model_term),n) - decay*w)
+        data_term = mult(v.T, ph_data, out=buffers.data_term)
+        model_term = mult(v_model.T, ph_model, out=buffers.model_term)
+        data_term -= model_term
+        dw = momentum*dw + epsilon*(old_div(data_term,n) - decay*w)
         w += dw
 
         # update bv
@@ -157,17 +303,13 @@ def _train(self, v, n_updates=1, epsilon=0.1, decay=0., momentum=0.,
         bh += dbh
 
         self._delta = (dw, dbv, dbh)
-        self._train_err = float(((v-v_model)**2.).sum())
-
-        if verbose:
-            print('training error', old_div(self._train_err,v.shape[0]))
-            ph, h = self._sample_h(v)
-            print('energy', self._energy(v, ph).sum())
+        self._train_err += float(((v-v_model)**2.).sum())
 
     def _stop_training(self):
         #del self._delta
         #del self._train_err
-        pass
+        self._gibbs_buffers = None
+        self._pcd_chains = None
 
     # execution methods
 
@@ -270,24 +412,47 @@ def __init__(self, hidden_dim, labels_dim, visible_dim=None, dtype=None):
 
         self.output_dim = hidden_dim
         self._initialized = False
+        self._gibbs_buffers = None
+        self._pcd_chains = None
 
     def _set_input_dim(self, n):
         self._input_dim = n
         self._visible_dim = n - self._labels_dim
 
-    def _sample_v(self, h, sample_l=False, concatenate=True):
+    def _sample_v(self, h, sample_l=False, concatenate=True, out=None,
+                  pool=None):
         # returns  P(v=1|h,W,b), a sample from it, P(l=1|h,W,b),
         # and a sample from it
+        # if out=(probs, x) is given (only with concatenate=True and
+        # sample_l=False), the results are written in those arrays, and
+        # the random numbers are taken from pool
 
         ldim, vdim = self._labels_dim, self._visible_dim
 
+        if out is not None:
+            probs, x = out
+            mult(h, self.w.T, out=probs)
+            probs += self.bv
+            # visible units
+            probs_v = probs[:, :vdim]
+            _sigmoid_inplace(probs_v)
+            numx.less(pool.uniform(probs_v.shape), probs_v,
+                      out=x[:, :vdim], casting='unsafe')
+            # label units
+            probs_l = probs[:, vdim:]
+            probs_l -= probs_l.max(axis=1)[:, numx.newaxis]
+            exp(probs_l, out=probs_l)
+            probs_l /= probs_l.sum(axis=1)[:, numx.newaxis]
+            x[:, vdim:] = probs_l
+            return probs, x
+
         # activation
         a = self.bv + mult(h, self.w.T)
         av, al = a[:, :vdim], a[:, vdim:]
 
         # ## visible units: logistic activation
         probs_v = old_div(1.,(1. + exp(-av)))
-        v = (probs_v > random(probs_v.shape)).astype('d')
+        v = (probs_v > random(probs_v.shape)).astype(self.dtype)
 
         # ## label units: softmax activation
         # subtract maximum to regularize exponent
@@ -368,6 +533,7 @@ def is_invertible():
         return False
 
     def train(self, v, l, n_updates=1, epsilon=0.1, decay=0., momentum=0.,
+              batch_size=None, n_epochs=1, shuffle=True, persistent=False,
               verbose=False):
         """Update the internal structures according to the visible data `v`
         and the labels `l`.
@@ -388,6 +554,9 @@ def train(self, v, l, n_updates=1, epsilon=0.1, decay=0., momentum=0.,
             weight decay term. Default value: 0.
           momentum
             momentum term. Default value: 0.
+          batch_size, n_epochs, shuffle, persistent
+            mini-batch training and Persistent Contrastive Divergence,
+            see `RBMNode.train`
         """
 
         if not self.is_training():
@@ -403,4 +572,8 @@ def train(self, v, l, n_updates=1, epsilon=0.1, decay=0., momentum=0.,
                                               epsilon=epsilon,
                                               decay=decay,
                                               momentum=momentum,
+                                              batch_size=batch_size,
+                                              n_epochs=n_epochs,
+                                              shuffle=shuffle,
+                                              persistent=persistent,
                                               verbose=verbose)
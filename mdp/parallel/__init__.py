@@ -29,7 +29,8 @@
 from .thread_schedule import ThreadScheduler
 from .parallelnodes import (
     ParallelExtensionNode, NotForkableParallelException, JoinParallelException,
-    ParallelPCANode, ParallelSFANode, ParallelFDANode, ParallelHistogramNode
+    ParallelPCANode, ParallelSFANode, ParallelFDANode, ParallelHistogramNode,
+    ParallelRBMNode, ParallelRBMWithLabelsNode
 )
 from .parallelclassifiers import (
     ParallelGaussianClassifier, ParallelNearestMeanClassifier,
@@ -61,7 +62,7 @@
     "ParallelExtensionNode", "JoinParallelException",
     "NotForkableParallelException",
     "ParallelSFANode", "ParallelSFANode", "ParallelFDANode",
-    "ParallelHistogramNode",
+    "ParallelHistogramNode", "ParallelRBMNode", "ParallelRBMWithLabelsNode",
     "FlowTaskCallable", "FlowTrainCallable", "FlowExecuteCallable",
     "ExecuteResultContainer", "TrainResultContainer", "ParallelFlowException",
     "NoTaskException",
@@ -14,7 +14,6 @@
 import inspect
 
 import mdp
-from mdp import numx
 
 
 class NotForkableParallelException(mdp.NodeException):
@@ -246,8 +245,182 @@ def _fork(self):
         return self._default_fork()
 
     def _join(self, forked_node):
-        if (self.data_hist is not None) and (forked_node.data_hist is not None):
-            self.data_hist = numx.concatenate([self.data_hist,
-                                            forked_node.data_hist])
-        elif forked_node.data_hist is not None:
-            self.data_hist = forked_node.data_hist
+        # for a bounded history the reservoir samples are merged
+        self._join_hist(forked_node.data_hist, forked_node._hist_tlen)
+
+
+class ParallelRBMNode(ParallelExtensionNode, mdp.nodes.RBMNode):
+    """Parallel version of the RBMNode.
+
+    Every fork runs the Contrastive Divergence updates on its own data chunk,
+    starting from the parameters and the momentum of the parent node. When
+    the forks are joined only their weight and bias deltas and their last
+    momentum terms are used: by default the deltas of all the forks created
+    from the same parameters are averaged and applied in a single synchronous
+    step (e.g., one step per ParallelFlow.train call), and the parent momentum
+    is set to the average of the fork momenta.
+
+    If max_staleness is set to an integer the node instead applies the
+    (averaged) delta of every joined fork immediately, which allows
+    asynchronous updates. Deltas computed from parameters that are more than
+    max_staleness updates old are discarded.
+
+    A trained fork is pickled (e.g., when it is sent back by a process
+    scheduler) with its parameter deltas instead of its parameters, so the
+    unpickled node can only be joined. Trained forks can not be forked.
+
+    Note that the weights are initialized when the node is forked for the
+    first time, so the visible_dim must be known in advance.
+    """
+
+    # The defaults of the parallel state are class attributes, so that they
+    # are also available for nodes created before the parallel extension was
+    # activated.
+    max_staleness = None
+    # number of updates applied to the parameters by _join
+    _version = 0
+    # state of the synchronous step collecting the fork deltas
+    _step_version = None
+    _step_base = None
+    _step_sums = None
+    _step_n = 0
+    # fork state: parent version and parameters at the time of the fork,
+    # the own deltas of a pickled trained fork and the summed deltas and
+    # momenta of the joined forks
+    _fork_version = None
+    _fork_base = None
+    _fork_delta = None
+    _fork_sums = None
+
+    def __init__(self, hidden_dim, visible_dim=None, dtype=None,
+                 max_staleness=None):
+        """
+        :Parameters:
+          hidden_dim
+            number of hidden variables
+          visible_dim
+            number of observed variables
+          max_staleness
+            maximal number of updates between the fork and the join of a
+            delta for asynchronous updates, None for synchronous steps
+        """
+        super(ParallelRBMNode, self).__init__(hidden_dim,
+                                              visible_dim=visible_dim,
+                                              dtype=dtype)
+        self.max_staleness = max_staleness
+
+    def _fork(self):
+        if self._fork_version is not None and self._train_phase_started:
+            err = "a trained fork can not be forked"
+            raise NotForkableParallelException(err)
+        if self.input_dim is None:
+            err = "visible_dim must be set before forking the node"
+            raise NotForkableParallelException(err)
+        if not self._initialized:
+            self._init_weights()
+        # do not copy the Gibbs sampling buffers and the step state
+        skipped = dict((key, self.__dict__.pop(key))
+                       for key in ("_gibbs_buffers", "_step_base",
+                                   "_step_sums", "_fork_sums")
+                       if key in self.__dict__)
+        try:
+            forked_node = self.copy()
+        finally:
+            self.__dict__.update(skipped)
+        forked_node._gibbs_buffers = None
+        forked_node._train_phase_started = False
+        forked_node._fork_version = self._version
+        forked_node._rbm_set_fork_base()
+        return forked_node
+
+    def _join(self, forked_node):
+        """Combine the parameter deltas and momenta of the forked node."""
+        sums = self._rbm_fork_sums(forked_node)
+        if self._fork_version is not None:
+            # this is a fork, just collect the deltas of the other forks
+            self._fork_sums = self._rbm_add_sums(self._fork_sums, sums)
+            self._fork_version = min(self._fork_version,
+                                     forked_node._fork_version)
+            return
+        if not self._initialized:
+            self._init_weights()
+        version = self._version
+        if self.max_staleness is None:
+            if forked_node._fork_version != self._step_version:
+                # the fork is based on the current parameters, start a step
+                self._step_base = (self.w.copy(), self.bv.copy(),
+                                   self.bh.copy())
+                self._step_version = version
+                self._step_sums = None
+            self._step_sums = self._rbm_add_sums(self._step_sums, sums)
+            deltas, momenta, n_deltas = self._step_sums
+            params = self._step_base
+        else:
+            if version - forked_node._fork_version > self.max_staleness:
+                return
+            deltas, momenta, n_deltas = sums
+            params = (self.w, self.bv, self.bh)
+        self.w, self.bv, self.bh = [self._refcast(param + delta / n_deltas)
+                                    for param, delta in zip(params, deltas)]
+        self._delta = tuple(momentum / n_deltas for momentum in momenta)
+        # forks of the updated parameters belong to the next step
+        self._version = version + 1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._fork_version is None:
+            return state
+        if self._train_phase_started:
+            # only keep the deltas of a trained fork
+            if self._fork_delta is None:
+                state["_fork_delta"] = self._rbm_own_delta()
+            state.update(w=None, bv=None, bh=None, _gibbs_buffers=None,
+                         _pcd_chains=None)
+        # the parameters at the time of the fork are restored on unpickling
+        state["_fork_base"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._fork_version is not None and self._fork_delta is None:
+            self._rbm_set_fork_base()
+
+    def _rbm_set_fork_base(self):
+        """Store a copy of the current parameters of a fork."""
+        self._fork_base = (self.w.copy(), self.bv.copy(), self.bh.copy())
+
+    def _rbm_own_delta(self):
+        """Return the parameter deltas of the training in this fork."""
+        if self._fork_delta is not None:
+            return self._fork_delta
+        return tuple(param - base for param, base
+                     in zip((self.w, self.bv, self.bh), self._fork_base))
+
+    @staticmethod
+    def _rbm_add_sums(sums, other_sums):
+        """Add two (delta sums, momentum sums, number of deltas) tuples."""
+        if sums is None:
+            return other_sums
+        return (tuple(a + b for a, b in zip(sums[0], other_sums[0])),
+                tuple(a + b for a, b in zip(sums[1], other_sums[1])),
+                sums[2] + other_sums[2])
+
+    @classmethod
+    def _rbm_fork_sums(cls, forked_node):
+        """Return the summed deltas and momenta of a fork and their number."""
+        if forked_node._fork_version is None:
+            err = "the joined node has not been created by fork"
+            raise JoinParallelException(err)
+        sums = (forked_node._rbm_own_delta(), forked_node._delta, 1)
+        return cls._rbm_add_sums(forked_node._fork_sums, sums)
+
+
+class ParallelRBMWithLabelsNode(ParallelRBMNode, mdp.nodes.RBMWithLabelsNode):
+    """Parallel version of the RBMWithLabelsNode, see ParallelRBMNode."""
+
+    def __init__(self, hidden_dim, labels_dim, visible_dim=None, dtype=None,
+                 max_staleness=None):
+        mdp.nodes.RBMWithLabelsNode.__init__(self, hidden_dim, labels_dim,
+                                             visible_dim=visible_dim,
+                                             dtype=dtype)
+        self.max_staleness = max_staleness
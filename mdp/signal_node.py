@@ -743,6 +743,120 @@ def _set_output_dim(self, n):
         self._output_dim = n
 
 
+class _CumulatorBuffer(object):
+    """Growable array used by the cumulators to collect the training data.
+
+    The data is appended into a preallocated array whose capacity grows
+    geometrically, so that in the end the collected data is available as
+    a contiguous array without concatenating the single chunks (which
+    would require twice the memory of the data).
+
+    If ``memmap_threshold`` is given, the buffer is moved to a
+    memory-mapped temporary file in ``memmap_dir`` as soon as its size
+    exceeds ``memmap_threshold`` bytes.
+    """
+
+    def __init__(self, memmap_threshold=None, memmap_dir=None):
+        self.memmap_threshold = memmap_threshold
+        self.memmap_dir = memmap_dir
+        self.length = 0
+        self._buffer = None
+        # temporary file, only used when the buffer is memory-mapped
+        self._file = None
+
+    def __len__(self):
+        return self.length
+
+    def append(self, data):
+        """Append the rows of data to the buffer.
+
+        If the dtype of data can not be safely cast to the dtype of the
+        buffer, the buffer is reallocated with the promoted dtype (as
+        numx.concatenate would do).
+        """
+        data = numx.asarray(data)
+        if self._buffer is None:
+            self._buffer = numx.empty((max(len(data), 1),) + data.shape[1:],
+                                      dtype=data.dtype)
+        dtype = numx.promote_types(self._buffer.dtype, data.dtype)
+        end = self.length + len(data)
+        if end > len(self._buffer) or dtype != self._buffer.dtype:
+            capacity = len(self._buffer)
+            if end > capacity:
+                capacity = max(end, 2 * capacity)
+            self._grow(capacity, dtype)
+        self._buffer[self.length:end] = data
+        self.length = end
+
+    def array(self):
+        """Return the collected data as a contiguous array (not a copy).
+
+        The unused capacity of the buffer is freed if possible.
+        """
+        if self._buffer is None:
+            return numx.array([])
+        if self._file is None and len(self._buffer) > self.length:
+            self._resize((self.length,) + self._buffer.shape[1:])
+        return self._buffer[:self.length]
+
+    def _resize(self, shape):
+        """Resize the buffer in place, return False if this is not possible
+        because views of the buffer exist.
+
+        realloc can usually move large buffers without a second copy of the
+        data, so that the peak memory is the new capacity.
+        """
+        try:
+            self._buffer.resize(shape)
+        except ValueError:
+            return False
+        return True
+
+    def _grow(self, capacity, dtype):
+        """Move the data to a buffer with the given capacity and dtype.
+
+        The buffer is resized in place if the dtype does not change and no
+        views of it exist. Otherwise the data is copied to a new buffer,
+        and the old buffer is not modified.
+        """
+        shape = (capacity,) + self._buffer.shape[1:]
+        nbytes = (capacity * numx.dtype(dtype).itemsize *
+                  int(numx.prod(self._buffer.shape[1:])))
+        to_memmap = (self._file is not None or
+                     (self.memmap_threshold is not None and
+                      nbytes > self.memmap_threshold))
+        if (not to_memmap and dtype == self._buffer.dtype and
+            self._resize(shape)):
+            return
+        old_buffer = self._buffer
+        if self._file is not None and dtype == old_buffer.dtype:
+            # extend the file, the data on disk is not copied
+            # (existing mappings of the file stay valid)
+            old_buffer.flush()
+            self._file.truncate(nbytes)
+            self._buffer = numx.memmap(self._file, dtype=dtype,
+                                       mode='r+', shape=shape)
+            return
+        if to_memmap:
+            import tempfile
+            self._file = tempfile.TemporaryFile(prefix='MDPcumulator_',
+                                                dir=self.memmap_dir)
+            self._file.truncate(nbytes)
+            self._buffer = numx.memmap(self._file, dtype=dtype,
+                                       mode='r+', shape=shape)
+        else:
+            self._buffer = numx.empty(shape, dtype=dtype)
+        self._buffer[:self.length] = old_buffer[:self.length]
+
+    def __getstate__(self):
+        # the temporary file can not be pickled, store the data instead
+        state = self.__dict__.copy()
+        if self._file is not None:
+            state['_buffer'] = numx.array(self._buffer)
+            state['_file'] = None
+        return state
+
+
 def VariadicCumulator(*fields):
     """A VariadicCumulator is a `Node` whose training phase simply collects
     all input data. In this way it is possible to easily implement
@@ -751,9 +865,19 @@ def VariadicCumulator(*fields):
     The data is accessible in the attributes given with the VariadicCumulator's
     constructor after the beginning of the `Node._stop_training` phase.
     ``self.tlen`` contains the number of data points collected.
+
+    The data is collected in growable buffers, so that no extra copy is
+    needed when the training is finished. If the attribute
+    ``memmap_threshold`` is set (in bytes) before the training starts,
+    buffers larger than this are moved to memory-mapped temporary files
+    (in the directory ``memmap_dir``, by default the system temporary
+    directory).
     """
 
     class Cumulator(Node):
+        memmap_threshold = None
+        memmap_dir = None
+
         def __init__(self, *args, **kwargs):
             super(Cumulator, self).__init__(*args, **kwargs)
             self._cumulator_fields = fields
@@ -765,16 +889,24 @@ def __init__(self, *args, **kwargs):
             self.tlen = 0
 
         def _train(self, *args):
-            """Collect all input data in a list."""
+            """Collect all input data in a buffer."""
             self.tlen += args[0].shape[0]
             for field, data in zip(self._cumulator_fields, args):
-                getattr(self, field).append(data)
+                buffer = getattr(self, field)
+                if not isinstance(buffer, _CumulatorBuffer):
+                    buffer = _CumulatorBuffer(self.memmap_threshold,
+                                              self.memmap_dir)
+                    setattr(self, field, buffer)
+                buffer.append(data)
 
         def _stop_training(self, *args, **kwargs):
-            """Concatenate the collected data in a single array."""
+            """Make the collected data available as a single array."""
             for field in self._cumulator_fields:
                 data = getattr(self, field)
-                setattr(self, field, numx.concatenate(data, 0))
+                if isinstance(data, _CumulatorBuffer):
+                    setattr(self, field, data.array())
+                else:
+                    setattr(self, field, numx.concatenate(data, 0))
 
     return Cumulator
 
@@ -138,6 +138,29 @@ def sfa_benchmark():
     #src = src.reshape(1000,5,nsrc)
     flow.train([None, [src], [src]])
 
+def knn_lsh_benchmark(npoints, dim, k, n_tables, n_bits):
+    """    Label random data with the approximate (LSH) KNNClassifier
+    and report the recall@k with respect to the exact search.
+    Arguments: (npoints,dim,k,n_tables,n_bits)."""
+    numx_rand.seed(7391852)
+    x = numx_rand.normal(size=(npoints, dim))
+    query = numx_rand.normal(size=(1000, dim))
+    node = mdp.nodes.KNNClassifier(k=k, approx='lsh',
+                                   n_tables=n_tables, n_bits=n_bits)
+    node.train(x, 0)
+    node.stop_training()
+    tstart = TIMEFUNC()
+    approx = node._lsh_neighbors(query)
+    t_approx = TIMEFUNC()-tstart
+    # the exact search processes the queries in blocks of bounded memory
+    tstart = TIMEFUNC()
+    exact = node._exact_neighbors(query)
+    t_exact = TIMEFUNC()-tstart
+    recall = numx.mean([len(set(a) & set(e)) / float(k)
+                        for a, e in zip(approx, exact)])
+    print('    recall@%d: %.3f, query time approx/exact: %.2f/%.2f sec' %
+          (k, recall, t_approx, t_exact))
+
 #### benchmark tools
 
 # function used to measure time
@@ -214,7 +237,10 @@ def run_benchmarks(bench_funcs, time_digits=15):
 #    BENCH_FUNCS = [(polynomial_expansion_benchmark, POLY_EXP_ARGS)]
 BENCH_FUNCS = [(polynomial_expansion_benchmark, POLY_EXP_ARGS),
                (isfa_spiral_benchmark, [[]]),
-               (sfa_benchmark, [[]])]
+               (sfa_benchmark, [[]]),
+               (knn_lsh_benchmark, [(100000, 16, 10, 8, 12),
+                                    (100000, 16, 10, 16, 12),
+                                    (100000, 16, 10, 16, 8)])]
 
 def get_benchmarks():
     return BENCH_FUNCS
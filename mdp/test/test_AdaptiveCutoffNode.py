@@ -35,3 +35,15 @@ def test_AdaptiveCutoffNode_randomdata():
     node.stop_training()
     node.execute(x)
 
+
+def test_AdaptiveCutoffNode_histsize():
+    """Test AdaptiveCutoffNode with a bounded history."""
+    node = mdp.nodes.AdaptiveCutoffNode(lower_cutoff_fraction= 0.2,
+                                    upper_cutoff_fraction=0.4,
+                                    hist_size=2000)
+    for i in range(10):
+        node.train(numx_rand.random((1000, 3)))
+    node.stop_training()
+    assert node.data_hist.shape == (2000, 3)
+    assert_array_almost_equal(node.lower_bounds, [0.2]*3, 1)
+    assert_array_almost_equal(node.upper_bounds, [0.6]*3, 1)
@@ -133,3 +133,23 @@ def testConvolution2DNode_shape_mismatch():
     node = mdp.nodes.Convolution2DNode(filters, input_shape=(3,2))
     with py.test.raises(mdp.NodeException):
         node.execute(x)
+
+@requires_signal
+def testConvolution2DNode_fft_batch():
+    import scipy.signal
+    x = numx.random.random((7,17,12))
+    filters = numx.random.random((3,6,5))
+    for mode in ['valid', 'same', 'full']:
+        node = mdp.nodes.Convolution2DNode(filters, mode=mode,
+                                           output_2d=False, workers=2)
+        y = node.execute(x)
+        for n_im in range(x.shape[0]):
+            for n_flt in range(filters.shape[0]):
+                expected = scipy.signal.fftconvolve(x[n_im], filters[n_flt],
+                                                    mode=mode)
+                assert_array_almost_equal(y[n_im,n_flt], expected, 10)
+    # the spectra of the filters are cached, and reset with the filters
+    assert node._filters_spectra is not None
+    node.filters = filters[::-1].copy()
+    assert node._filters_spectra is None
+    assert_array_almost_equal(node.execute(x), y[:,::-1], 10)
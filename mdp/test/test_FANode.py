@@ -58,6 +58,25 @@ def test_FANode_indim():
     x = numx_rand.normal(size=(5000, 500))
     mdp.nodes.FANode(output_dim=1)(x)
 
+def test_FANode_highdim():
+    # the EM-cycles never build dxd matrices, check the results against
+    # the direct computation
+    d, k = 400, 3
+    A = numx_rand.normal(size=(k, d))
+    x = mult(numx_rand.normal(size=(2000, k)), A)
+    x += numx_rand.normal(size=(2000, d)) * (uniform((d,))+0.5)
+    fa = mdp.nodes.FANode(output_dim=k)
+    fa.train(x)
+    fa.stop_training()
+    assert numx.all(numx.diff(fa.lhood) > -1e-10)
+    B = utils.inv(mult(fa.A, fa.A.T) + numx.diag(fa.sigma))
+    assert_array_almost_equal(fa.E_y_mtx, mult(B, fa.A), 6)
+    # check the final log-likelihood
+    cov_mtx = numx.cov(x, rowvar=0, bias=1)
+    lhood = (-d/2. * numx.log(2.*numx.pi) + 0.5*numx.log(numx_linalg.det(B)) -
+             0.5*(B*cov_mtx).sum())
+    assert lhood >= fa.lhood[-1] - 1e-8
+
 def test_FANode_singular_cov():
     x = numx.array([[ 1., 1., 0., 0., 0.],
                     [ 0., 1., 1., 0., 0.],
@@ -75,3 +75,36 @@ def distr(size): return normal(0, 1., size=(size)) * std_
     classification = node.label(x)
 
     assert_array_equal(classes, classification)
+
+def testGaussianClassifier_class_probabilities():
+    dim = 3
+    node = mdp.nodes.GaussianClassifier()
+    for lbl in range(4):
+        x = normal(0., 1., size=(500, dim)) + 3*lbl
+        node.train(x, lbl)
+    node.stop_training()
+    x = normal(0., 3., size=(20, dim))
+    # compare with the direct evaluation of the gaussian densities
+    probs = numx.zeros((20, 4))
+    for i in range(4):
+        x_mn = x - node.means[i]
+        exponent = -0.5 * (mult(x_mn, node.inv_covs[i])*x_mn).sum(axis=1)
+        constant = ((2.*numx.pi)**(-dim/2.) /
+                    numx.sqrt(numx_linalg.det(utils.inv(node.inv_covs[i]))))
+        probs[:, i] = constant * numx.exp(exponent) * node.p[i]
+        assert_array_almost_equal(node._gaussian_prob(x, i),
+                                  constant * numx.exp(exponent))
+    probs /= probs.sum(axis=1)[:, numx.newaxis]
+    assert_array_almost_equal(node.class_probabilities(x), probs)
+    # points far away from all classes must not underflow
+    far = numx.ones((5, dim)) * 1e3
+    class_prob = node.class_probabilities(far)
+    assert numx.all(numx.isfinite(class_prob))
+    assert_array_almost_equal(class_prob.sum(axis=1), numx.ones(5))
+
+def testGaussianClassifier_singular():
+    node = mdp.nodes.GaussianClassifier()
+    x = normal(0., 1., size=(100, 3))
+    x[:, 2] = 0.
+    node.train(x, 1)
+    py.test.raises(mdp.NodeException, node.stop_training)
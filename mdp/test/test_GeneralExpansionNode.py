@@ -65,3 +65,24 @@ def testGeneralExpansionNode_inverse():
             break
     assert cond, 'inversion not good enough by use_hint=False'
 
+
+def testGeneralExpansionNode_inverse_chunks():
+    input_dim = 5
+    funcs = [lambda x:x, lambda x: x**2, numx.sin]
+    cen = mdp.nodes.GeneralExpansionNode(funcs)
+    input = numx.random.normal(size=(300, input_dim))
+    out = cen.execute(input)
+    noisy = out + numx.random.normal(size=out.shape)*1e-3
+    app_input = cen.pseudo_inverse(noisy, use_hint=True, chunk_size=70)
+    assert app_input.shape == input.shape
+    assert_array_almost_equal(app_input, input, 2)
+    # the result of the batched optimization is a local minimum
+    hint = input + numx.random.normal(size=input.shape)*1e-2
+    app_input = cen.pseudo_inverse(out, use_hint=hint, chunk_size=70)
+    assert_array_almost_equal(app_input, input, 6)
+    scheduler = mdp.parallel.ThreadScheduler(n_threads=2,
+                                             copy_callable=False)
+    sched_input = cen.pseudo_inverse(out, use_hint=hint, chunk_size=70,
+                                     scheduler=scheduler)
+    scheduler.shutdown()
+    assert_array_almost_equal(sched_input, app_input, 10)
@@ -56,3 +56,55 @@ def test_GrowingNeuralGasNode():
     assert_equal(dists[0],1.)
     assert_array_equal(nodes[0].data.pos,numx.asarray([2,0]))
 
+
+def test_GrowingNeuralGasNode_array_engine():
+    # the array engine must give the same graph as the graph engine
+    dim = 3
+    data = normal(0., 1., size=(3000, dim))
+    start_poss = [normal(0., 1., size=dim), normal(0., 1., size=dim)]
+    gng = mdp.nodes.GrowingNeuralGasNode(start_poss=start_poss, max_age=20,
+                                         lambda_=50)
+    agng = mdp.nodes.GrowingNeuralGasNode(start_poss=start_poss, max_age=20,
+                                          lambda_=50, engine='array')
+    for chunk in range(3):
+        gng.train(data[chunk*1000:(chunk+1)*1000])
+        agng.train(data[chunk*1000:(chunk+1)*1000])
+    gng.stop_training()
+    agng.stop_training()
+    assert len(agng.graph.nodes) > 10
+    assert_array_almost_equal(gng.get_nodes_position(),
+                              agng.get_nodes_position())
+    # same edges between the same nodes
+    def edges(g):
+        index = dict((n, i) for i, n in enumerate(g.nodes))
+        return sorted((index[e.head], index[e.tail], e.data.age)
+                      for e in g.edges)
+    assert edges(gng.graph) == edges(agng.graph)
+    assert_array_almost_equal([n.data.cum_error for n in gng.graph.nodes],
+                              [n.data.cum_error for n in agng.graph.nodes])
+    # the graph is materialized only once
+    assert agng.graph is agng.graph
+    nodes, dists = agng.nearest_neighbor(data[:10])
+    gnodes, gdists = gng.nearest_neighbor(data[:10])
+    assert_array_almost_equal(dists, gdists)
+
+
+def test_GrowingNeuralGasNode_nearest_neighbor_ids():
+    dim = 3
+    data = normal(0., 1., size=(2500, dim))
+    gng = mdp.nodes.GrowingNeuralGasNode(max_age=20, lambda_=20,
+                                         engine='array')
+    gng.train(data)
+    x = normal(0., 1., size=(2100, dim))
+    ids, dists = gng.nearest_neighbor_ids(x, kdtree=False, chunk_size=500)
+    pos = gng.get_nodes_position()
+    # brute force
+    all_dists = numx.sqrt(((x[:, numx.newaxis, :] - pos)**2).sum(axis=2))
+    assert_array_equal(ids, all_dists.argmin(axis=1))
+    assert_array_almost_equal(dists, all_dists.min(axis=1))
+    if mdp.numx_description == 'scipy':
+        tree_ids, tree_dists = gng.nearest_neighbor_ids(x, kdtree=True)
+        assert_array_equal(tree_ids, ids)
+        assert_array_almost_equal(tree_dists, dists)
+    nodes, ndists = gng.nearest_neighbor(x[:5])
+    assert [gng.graph.nodes.index(n) for n in nodes] == list(ids[:5])
@@ -1,3 +1,4 @@
+from builtins import range
 from ._tools import *
 
 def testHistogramNode_nofraction():
@@ -18,3 +19,59 @@ def testHistogramNode_fraction():
     node.train(x1)
     node.train(x2)
     assert len(node.data_hist) < 1000
+
+def testHistogramNode_size():
+    """Test HistogramNode with a bounded history."""
+    node = mdp.nodes.HistogramNode(hist_size=50)
+    x = numx.arange(300.).reshape((100, 3))
+    node.train(x[:30])
+    assert numx.all(node.data_hist == x[:30])
+    node.train(x[30:])
+    assert node.data_hist.shape == (50, 3)
+    # the rows are distinct rows of the input
+    assert len(set(node.data_hist[:,0])) == 50
+    assert numx.all(node.data_hist[:,1] == node.data_hist[:,0] + 1)
+    # the input was not modified
+    assert numx.all(x == numx.arange(300.).reshape((100, 3)))
+
+def testHistogramNode_assign_reservoir():
+    """Test that assigning the reservoir back keeps its row count."""
+    node = mdp.nodes.HistogramNode(hist_size=50)
+    node.train(numx_rand.random((200, 3)))
+    node.data_hist = node.data_hist.copy()
+    assert node._hist_tlen == 200
+    node.data_hist = node.data_hist[:20]
+    assert node._hist_tlen == 20
+
+def testHistogramNode_reused_buffer():
+    """Test that the stored history is not changed with the input."""
+    node = mdp.nodes.HistogramNode()
+    buf = numx.zeros((10, 2))
+    for i in range(3):
+        buf[:] = i
+        node.train(buf)
+    assert numx.all(node.data_hist[:,0] == numx.repeat(numx.arange(3.), 10))
+
+def testHistogramNode_del_data_hist():
+    """Test that the history can be deleted."""
+    node = mdp.nodes.HistogramNode()
+    node.train(numx_rand.random((10, 3)))
+    del node.data_hist
+    assert node.data_hist is None
+    x = numx_rand.random((5, 3))
+    node.train(x)
+    assert numx.all(node.data_hist == x)
+
+def testHistogramNode_old_state():
+    """Test unpickling a node with the history stored in data_hist."""
+    node = mdp.nodes.HistogramNode()
+    x = numx_rand.random((10, 3))
+    node.train(x)
+    state = node.__dict__.copy()
+    del state['_hist_chunks'], state['_hist_tlen'], state['hist_size']
+    state['data_hist'] = x
+    old_node = mdp.nodes.HistogramNode.__new__(mdp.nodes.HistogramNode)
+    old_node.__setstate__(state)
+    assert numx.all(old_node.data_hist == x)
+    old_node.train(x)
+    assert old_node.data_hist.shape == (20, 3)
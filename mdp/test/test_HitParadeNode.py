@@ -53,3 +53,17 @@ def testOneDimensionalHitParade():
     assert_array_equal(ind_maxima,[110,103,0,10,50])
     assert_array_equal(minima,[-3.1,-3,-1.5,-1.4,-1.3])
     assert_array_equal(ind_minima,[123,130,1,11,51])
+
+def testOneDimensionalHitParade_blocks():
+    # the pruned update must give the same result as checking every value
+    for signal in [(uniform(5000)-0.5)*2,
+                   numx.cumsum(uniform(5000)-0.5),
+                   (uniform(5000)*10).astype('i')]:
+        for gap in [0, 3, 40]:
+            hit = mdp.nodes._OneDimensionalHitParade(4, gap, signal.dtype)
+            ref = mdp.nodes._OneDimensionalHitParade(4, gap, signal.dtype)
+            for start, stop in [(0, 1), (1, 700), (700, 5000)]:
+                hit.update((signal[start:stop], numx.arange(start, stop)))
+                ref._update_rows(signal[start:stop], numx.arange(start, stop))
+            assert_array_equal(hit.get_maxima(), ref.get_maxima())
+            assert_array_equal(hit.get_minima(), ref.get_minima())
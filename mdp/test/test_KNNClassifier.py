@@ -53,3 +53,68 @@ def distr(size): return normal(0, 1., size=(size)) * std_
     node.train(x, classes)
     classification = node.label(x)
     assert_array_equal(classes, classification)
+
+def testKNNClassifier_lsh_label():
+    # same two gaussians as above, labelled with the approximate search
+    mean1 = [0., 2.]
+    mean2 = [0., -2.]
+    std_ = numx.array([1., 0.2])
+    npoints = 500
+    def distr(size): return normal(0, 1., size=(size)) * std_
+    x1 = distr((npoints,2)) + mean1
+    utils.rotate(x1, 45, units='degrees')
+    x2 = distr((npoints,2)) + mean2
+    utils.rotate(x2, 45, units='degrees')
+    x = numx.concatenate((x1, x2), axis=0)
+    classes = numx.concatenate((numx.ones((npoints,), dtype='i'),
+                                2*numx.ones((npoints,), dtype='i')))
+    node = mdp.nodes.KNNClassifier(k=3, approx='lsh', n_tables=6, n_bits=4)
+    node.train(x, classes)
+    node.stop_training()
+    assert len(node._lsh_keys) == 6
+    classification = numx.array(node.label(x))
+    assert (classification == classes).mean() > 0.95
+
+def testKNNClassifier_lsh_recall():
+    # the recall depends on the random hyperplanes, so fix the seed
+    numx_rand.seed(1234)
+    x = normal(0., 1., size=(2000, 5))
+    node = mdp.nodes.KNNClassifier(k=5, approx='lsh', n_tables=10, n_bits=6)
+    node.train(x, 0)
+    node.stop_training()
+    query = normal(0., 1., size=(50, 5))
+    exact = node._exact_neighbors(query)
+    approx = node._lsh_neighbors(query)
+    assert approx.shape == (50, 5)
+    recall = numx.mean([len(set(a) & set(e)) / 5.
+                        for a, e in zip(approx, exact)])
+    assert recall > 0.8
+    # with a single table of many bits the buckets are almost empty
+    # and we fall back to the exact search
+    x = normal(0., 1., size=(2000, 20))
+    query = normal(0., 1., size=(5, 20))
+    node = mdp.nodes.KNNClassifier(k=5, approx='lsh', n_tables=1, n_bits=40)
+    node.train(x, 0)
+    node.stop_training()
+    assert_array_equal(node._lsh_neighbors(query),
+                       node._exact_neighbors(query))
+
+def testKNNClassifier_exact_blocks():
+    x = normal(0., 1., size=(300, 3))
+    query = normal(0., 1., size=(40, 3))
+    # use blocks of 7 points
+    node = mdp.nodes.KNNClassifier(k=4, block_size=7 * 300)
+    node.train(x, 0)
+    node.stop_training()
+    square_distances = ((query[:, numx.newaxis, :] - x)**2).sum(2)
+    assert_array_equal(node._exact_neighbors(query),
+                       square_distances.argsort(axis=1)[:, :4])
+
+def testKNNClassifier_unknown_approx():
+    py.test.raises(mdp.NodeException,
+                   mdp.nodes.KNNClassifier, approx='ivf')
+
+def testKNNClassifier_n_bits():
+    # the bucket keys do not fit into 64 bits
+    py.test.raises(mdp.NodeException,
+                   mdp.nodes.KNNClassifier, approx='lsh', n_bits=64)
@@ -60,3 +60,48 @@ def test_NeuralGasNode_nearest_neighbor():
     nodes, dists = ng.nearest_neighbor(numx.asarray([[3.,0]]))
     assert_almost_equal(dists[0], 1., 7)
     assert_almost_equal(nodes[0].data.pos, numx.asarray([2., 0.]), 7)
+
+def test_NeuralGasNode_array_engine():
+    # the array engine must give the same graph as the graph engine
+    data = normal(0., 1., size=(300, 3))
+    start_poss = [normal(0., 1., size=3) for _ in range(8)]
+    nodes = []
+    for engine in ['graph', 'array']:
+        numx_rand.seed(7)
+        ng = mdp.nodes.NeuralGasNode(start_poss=[p.copy() for p in start_poss],
+                                     max_epochs=5, engine=engine)
+        ng.train(data)
+        ng.stop_training()
+        nodes.append(ng)
+    ng, ang = nodes
+    assert_array_almost_equal(ng.get_nodes_position(),
+                              ang.get_nodes_position())
+    def edges(g):
+        index = dict((n, i) for i, n in enumerate(g.nodes))
+        return sorted((index[e.head], index[e.tail], e.data.age)
+                      for e in g.edges)
+    assert edges(ng.graph) == edges(ang.graph)
+
+def test_NeuralGasNode_batch():
+    # nodes should spread along a line
+    dim = 4
+    npoints = 1000
+    const = _uniform(-10,10,[dim])
+    dir = _uniform(-1,1,[dim])
+    dir /= utils.norm2(dir)
+    x = _uniform(-1,1,[npoints])
+    data = numx.outer(x, dir)+const
+    ng = mdp.nodes.NeuralGasNode(num_nodes=5, start_poss=[data[n,:]
+                                                         for n in range(5)],
+                                 max_epochs=30, engine='array', batch=True)
+    ng.train(data)
+    ng.stop_training()
+    poss = ng.get_nodes_position() - const
+    proj = numx.dot(poss, dir)
+    # nodes lie on the line and cover it
+    assert_array_almost_equal(poss, numx.outer(proj, dir), 7)
+    assert proj.max() - proj.min() > 1.
+    # the graph is a chain
+    deg = sorted(n.degree() for n in ng.graph.nodes)
+    assert deg == [1, 1, 2, 2, 2]
+    py.test.raises(mdp.NodeException, mdp.nodes.NeuralGasNode, batch=True)
@@ -57,3 +57,38 @@ def scalar_to_covs(x, n):
     rbf = mdp.nodes.RBFExpansionNode(centers, sizes)
     check_mn_cov(rbf, sizes)
 
+
+def testRBFExpansionNode_chunks():
+    dim, n = 3, 20
+    centers = numx_rand.random((n, dim))
+    sizes = 0.05 + numx_rand.random(n)*0.1
+    x = numx_rand.random((250, dim))
+    expected = numx.zeros((250, n))
+    for i in range(n):
+        expected[:,i] = numx.exp(-0.5*((x-centers[i])**2).sum(axis=1)/sizes[i])
+    rbf = mdp.nodes.RBFExpansionNode(centers, sizes, chunk_size=60)
+    assert_array_almost_equal(rbf(x), expected)
+    out = numx.empty((250, n))
+    y = rbf.execute(x, out=out)
+    assert y is out
+    assert_array_almost_equal(out, expected)
+    # float32
+    rbf = mdp.nodes.RBFExpansionNode(centers, sizes, dtype='f')
+    y = rbf(x)
+    assert y.dtype == numx.dtype('f')
+    assert_array_almost_equal(y, expected, 5)
+
+def testRBFExpansionNode_radius():
+    if mdp.numx_description != 'scipy':
+        py.test.skip('radius cutoff requires scipy')
+    dim, n = 3, 20
+    centers = numx_rand.random((n, dim))
+    sizes = 0.01
+    x = numx_rand.random((250, dim))
+    dense = mdp.nodes.RBFExpansionNode(centers, sizes)(x)
+    rbf = mdp.nodes.RBFExpansionNode(centers, sizes, radius=2., chunk_size=60)
+    y = rbf(x)
+    assert y.format == 'csr'
+    assert y.nnz < 250*n
+    dense[dense < numx.exp(-0.5*2.**2)] = 0.
+    assert_array_almost_equal(y.toarray(), dense)
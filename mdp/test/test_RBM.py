@@ -308,3 +308,53 @@ def test_RBMWithLabelsNode():
     nzeros = idxzeros.sum()
     point5 = numx.zeros((nzeros, L)) + 0.5
     assert_array_almost_equal(pl[idxzeros], point5, 2)
+
+def test_RBM_minibatch_learning():
+    # same problem as in test_RBM_learning, trained on mini-batches
+    I, J = 4, 2
+    N = int(1e4)
+    v = numx.zeros((N,I))
+    r = numx_rand.random(N)
+    v[r>0.666, :] = [0,1,0,1]
+    v[(r>0.333) & (r<=0.666), :] = [1,0,1,0]
+
+    for dtype in ('d', 'f'):
+        bm = mdp.nodes.RBMNode(J, I, dtype=dtype)
+        for k in range(50):
+            bm.train(v, batch_size=100, epsilon=0.3, momentum=0.5)
+            if old_div(bm._train_err,N)<0.1: break
+        assert old_div(bm._train_err, N) < 0.1
+        assert bm.w.dtype == numx.dtype(dtype)
+        bm.stop_training()
+
+def test_RBM_persistent():
+    I, J = 6, 3
+    v = (numx_rand.random((250, I)) > 0.5).astype('d')
+    bm = mdp.nodes.RBMNode(J, I)
+    bm.train(v, batch_size=100, n_epochs=2, persistent=True)
+    # the chains continue across mini-batches and calls
+    chains = bm._pcd_chains
+    assert chains.shape == (100, J)
+    bm.train(v, batch_size=100, persistent=True)
+    assert bm._pcd_chains is chains
+    bm.stop_training()
+    assert bm._pcd_chains is None and bm._gibbs_buffers is None
+
+def test_RBMWithLabelsNode_minibatch():
+    I, J, L = 4, 4, 2
+    N = 2000
+    v = numx.zeros((N,I))
+    l = numx.zeros((N,L))
+    v[:N//2, :] = [1,0,1,0]
+    v[N//2:, :] = [0,1,0,1]
+    l[:N//2, 0] = 1
+    l[N//2:, 1] = 1
+    bm = mdp.nodes.RBMWithLabelsNode(J, L, I)
+    for k in range(100):
+        bm.train(v, l, batch_size=50, epsilon=0.2, momentum=0.5)
+        if old_div(bm._train_err, N) < 0.1: break
+    assert old_div(bm._train_err, N) < 0.1
+    # the labels are predicted from the visible units
+    ph, h = bm._sample_h(numx.concatenate((v, l*0.), axis=1))
+    pv, pl, sv, sl = bm._sample_v(ph, concatenate=False)
+    assert (pl.argmax(axis=1) == l.argmax(axis=1)).mean() > 0.9
@@ -78,3 +78,14 @@ def test_TimeDelayNodes():
 
     assert_array_equal(real_res, slider_res)
 
+
+def test_TimeDelaySlidingWindowNode_blocks():
+    x = numx_rand.random((500, 3))
+    for time_frames, gap in [(1, 1), (3, 2), (4, 7), (2, 40)]:
+        node = TimeDelayNode(time_frames=time_frames, gap=gap)
+        slider = TimeDelaySlidingWindowNode(time_frames=time_frames, gap=gap)
+        cuts = [0, 1, 2, 100, 103, 203, 204, 500]
+        slider_res = numx.concatenate([slider.execute(x[start:stop])
+                                       for start, stop
+                                       in zip(cuts[:-1], cuts[1:])])
+        assert_array_equal(node.execute(x), slider_res)
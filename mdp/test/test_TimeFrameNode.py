@@ -25,3 +25,40 @@ def test_TimeFramesNode():
 
 def test_TimeFramesNodeBugInputDim():
     mdp.nodes.TimeFramesNode(time_frames=10, gap=1, input_dim=1)
+
+def test_TimeFramesNode_view():
+    inp = numx_rand.random((20, 3))
+    out = mdp.nodes.TimeFramesNode(4, view=True).execute(inp)
+    assert_array_equal(out, mdp.nodes.TimeFramesNode(4).execute(inp))
+    assert not out.flags.writeable
+    assert numx.may_share_memory(out, inp)
+
+def test_TimeFramesLinearNode():
+    x1 = numx_rand.random((300, 3))
+    x2 = numx_rand.random((50, 3))
+    for frames_class in (mdp.nodes.TimeFramesNode, mdp.nodes.TimeDelayNode):
+        for linear_class in (mdp.nodes.PCANode, mdp.nodes.SFANode,
+                             mdp.nodes.WhiteningNode):
+            for gap in (1, 3):
+                fused = mdp.nodes.TimeFramesLinearNode(
+                    frames_class(4, gap), linear_class())
+                flow = mdp.Flow([frames_class(4, gap), linear_class()])
+                for x in (x1, x2):
+                    fused.train(x)
+                    flow[1].train(flow[0].execute(x))
+                fused.stop_training()
+                flow[1].stop_training()
+                assert_equal(fused.output_dim, 12)
+                assert_array_almost_equal(abs(fused.execute(x1)),
+                                          abs(flow.execute(x1)), 6)
+
+def test_TimeFramesLinearNode_train_args():
+    # like the flow, the fused SFANode needs at least two frames
+    for frames_node, x in ((mdp.nodes.TimeFramesNode(4), numx.ones((4, 3))),
+                           (mdp.nodes.TimeDelayNode(4), numx.ones((1, 3)))):
+        fused = mdp.nodes.TimeFramesLinearNode(frames_node,
+                                               mdp.nodes.SFANode())
+        flow = mdp.Flow([frames_node.copy(), mdp.nodes.SFANode()])
+        py.test.raises(mdp.TrainingException, flow[1].train,
+                       flow[0].execute(x))
+        py.test.raises(mdp.TrainingException, fused.train, x)
@@ -31,3 +31,74 @@ def _stop_training(self, *args, **kwargs):
     for i in range(NREP):
         ab.train(x[i], y[i])
     ab.stop_training()
+
+def test_VariadicCumulator_memmap():
+    ONELEN = 101
+    NREP = 7
+    x = [numx_rand.rand(ONELEN, 3) for _ in range(NREP)]
+    y = [numx_rand.randint(5, size=ONELEN) for _ in range(NREP)]
+    ABCumulator = mdp.VariadicCumulator('a', 'b')
+    ab = ABCumulator()
+    # spill to disk after the first few chunks
+    ab.memmap_threshold = 3 * ONELEN * 3 * 8
+    ab.memmap_dir = py.test.mdp_tempdirname
+    for i in range(NREP):
+        ab.train(x[i], y[i])
+        if i == 4:
+            # the node can be copied after spilling to disk
+            assert ab.a._file is not None
+            copied = ab.copy()
+    assert ab.a._file is not None
+    assert ab.b._file is None
+    ab.stop_training()
+    assert isinstance(ab.a, numx.memmap)
+    assert_array_equal(ab.a, numx.concatenate(x))
+    assert_array_equal(ab.b, numx.concatenate(y))
+    copied.stop_training()
+    assert_array_equal(copied.a, numx.concatenate(x[:5]))
+
+def test_Cumulator_no_copy():
+    # the data is collected in a single growing buffer
+    cumulator = mdp.Cumulator()
+    for i in range(10):
+        cumulator.train(numx_rand.rand(50, 4))
+    assert cumulator.data.length == 500
+    buffer = cumulator.data._buffer
+    cumulator.stop_training()
+    assert cumulator.data.shape == (500, 4)
+    assert cumulator.data.base is buffer or cumulator.data is buffer
+
+def test_VariadicCumulator_promote_dtype():
+    # later chunks with a larger dtype are not truncated
+    ABCumulator = mdp.VariadicCumulator('a', 'b', 'c')
+    ab = ABCumulator()
+    ab.train(numx.array([[1., 2.]]), numx.array(['a']), numx.array([1]))
+    view = ab.c.array()
+    ab.train(numx.array([[0.5, 3.]]), numx.array(['bbb']),
+             numx.array([2.5]))
+    ab.stop_training()
+    assert_array_equal(ab.b, ['a', 'bbb'])
+    assert_array_equal(ab.c, [1., 2.5])
+    # views of the old buffer are not affected
+    assert_array_equal(view, [1])
+
+def test_Cumulator_peak_memory():
+    # the peak memory is at most twice the data, and only the data is kept
+    try:
+        import tracemalloc
+    except ImportError:
+        py.test.skip('tracemalloc requires Python 3')
+    NREP = 129
+    chunk_bytes = 1000 * 8 * 8
+    cumulator = mdp.Cumulator()
+    tracemalloc.start()
+    try:
+        for i in range(NREP):
+            cumulator.train(numx.ones((1000, 8)))
+        cumulator.stop_training()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert cumulator.data.shape == (NREP * 1000, 8)
+    assert peak <= 2 * NREP * chunk_bytes
+    assert current <= 1.1 * NREP * chunk_bytes
@@ -86,6 +86,49 @@ def testPerceptronClassifier():
         "Something must be wrong here. XOR is impossible in a single-layered perceptron."
 
 
+def testPerceptronClassifier_minibatch():
+    # two linearly separable clouds
+    x = numx.concatenate((numx_rand.normal(size=(500, 3)) + 3,
+                          numx_rand.normal(size=(500, 3)) - 3))
+    labels = numx.concatenate((numx.ones(500), -numx.ones(500)))
+    perm = numx_rand.permutation(1000)
+    x, labels = x[perm], labels[perm]
+    for averaged in [False, True]:
+        classifier = PerceptronClassifier(batch_size=50, averaged=averaged)
+        for i in range(0, 1000, 200):
+            classifier.train(x[i:i+200], labels[i:i+200])
+        classifier.stop_training()
+        assert (classifier.label(x) == labels).mean() > 0.95
+    # with batches of size one we get the same as the sample-wise update
+    classifier = PerceptronClassifier()
+    classifier.train(x[:100], labels[:100])
+    batch_classifier = PerceptronClassifier(batch_size=1)
+    batch_classifier.train(x[:100], labels[:100])
+    assert_array_almost_equal(classifier.weights, batch_classifier.weights)
+    assert_almost_equal(classifier.offset_weight,
+                        batch_classifier.offset_weight)
+
+def testPerceptronClassifier_averaged():
+    classifier = PerceptronClassifier(batch_size=2, averaged=True)
+    x = numx.array([[1., 0.], [0., 1.], [1., 1.], [0., 0.]])
+    labels = numx.array([1, -1, 1, -1])
+    classifier.train(x, labels)
+    weights = []
+    w = numx.ones(2)
+    offset = 0.
+    for start in (0, 2):
+        x_batch = x[start:start+2]
+        rates = 0.1 * (labels[start:start+2] -
+                       numx.sign(numx.dot(x_batch, w) + offset))
+        w = w + numx.dot(rates, x_batch)
+        offset += rates.sum()
+        weights.append((w, offset))
+    classifier.stop_training()
+    assert_array_almost_equal(classifier.weights,
+                              (weights[0][0] + weights[1][0]) / 2.)
+    assert_almost_equal(classifier.offset_weight,
+                        (weights[0][1] + weights[1][1]) / 2.)
+
 def testSimpleMarkovClassifier():
     mc = SimpleMarkovClassifier(dtype="c")
     text = "after the letter e follows either space or the letters r t or i"
@@ -129,6 +172,54 @@ def testSimpleMarkovClassifier():
 
     assert abs(prob_sum - 1.0) < 1e-5
 
+def testSimpleMarkovClassifier_counts():
+    mc = SimpleMarkovClassifier(dtype='i')
+    x = numx_rand.randint(3, size=(200, 2))
+    labels = numx_rand.randint(4, size=200)
+    mc.train(x[:120], labels[:120])
+    mc.train(x[120:], labels[120:])
+    mc.train(x[:10], 7)
+    assert mc.ntotal_connections == 210
+    assert sum(mc.labels.values()) == 210
+    assert mc.labels[7] == 10
+    connections = mc.connections
+    for feature in mc.features:
+        n_feature = sum(1 for xi in x if tuple(xi) == feature)
+        n_feature += sum(1 for xi in x[:10] if tuple(xi) == feature)
+        assert mc.features[feature] == n_feature
+        prob = mc.prob(numx.array([feature]))[0]
+        for label in mc.labels:
+            n_conn = connections.get((feature, label), 0)
+            assert abs(prob[label] - n_conn / float(n_feature)) < 1e-10
+    # unknown features have no probabilities
+    assert mc.prob(numx.array([[5, 5], [0, 0]]))[0] == {}
+
+def testSimpleMarkovClassifier_hashable_labels():
+    # labels of mixed types and tuples are kept as they are
+    mc = SimpleMarkovClassifier(dtype='i')
+    x = numx.array([[1], [2], [1]])
+    mc.train(x, [1, 'a', (2, 3)])
+    mc.train(x[:1], [(2, 3)])
+    assert mc.labels == {1: 1, 'a': 1, (2, 3): 2}
+    assert mc.connections == {((1,), 1): 1, ((2,), 'a'): 1,
+                              ((1,), (2, 3)): 2}
+    prob = mc.prob(numx.array([[1]]))[0]
+    assert abs(prob[(2, 3)] - 2/3.) < 1e-10
+    assert abs(prob[1] - 1/3.) < 1e-10
+    assert prob['a'] == 0
+
+def testSimpleMarkovClassifier_read_only():
+    # the dictionaries are computed from the counts and can not be changed
+    mc = SimpleMarkovClassifier(dtype='i')
+    mc.train(numx.array([[1], [2]]), [1, 2])
+    def set_item(mapping, key):
+        mapping[key] = 3
+    for mapping, key in ((mc.features, (1,)), (mc.labels, 1),
+                         (mc.connections, ((1,), 1))):
+        py.test.raises(TypeError, set_item, mapping, key)
+        assert mapping[key] == 1
+    py.test.raises(AttributeError, setattr, mc, 'labels', {})
+
 def testDiscreteHopfieldClassifier():
     h = DiscreteHopfieldClassifier()
 
@@ -159,6 +250,25 @@ def testDiscreteHopfieldClassifier():
         # Hopfield nets are blind for inversion, need to check either case
         assert numx.all(retrieved == p) or numx.all(retrieved != p)
 
+def testDiscreteHopfieldClassifier_batch():
+    memory_size = 200
+    patterns = numx_rand.random((5, memory_size)) > 0.5
+    for block_size in [1, 10]:
+        h = DiscreteHopfieldClassifier(block_size=block_size)
+        h.train(patterns[:2])
+        h.train(patterns[2:])
+        h.stop_training()
+        assert h._num_patterns == 5
+        assert h._weight_matrix.dtype == numx.dtype('int8')
+        assert numx.all(h._weight_matrix.diagonal() == 0)
+        # all the patterns are retrieved in a single call
+        noisy = patterns.copy()
+        flip = numx_rand.random(noisy.shape) > 0.95
+        noisy[flip] = ~noisy[flip]
+        retrieved = h.label(noisy)
+        for p, r in zip(patterns, retrieved):
+            assert numx.all(r == p) or numx.all(r != p)
+
 def testKMeansClassifier():
     num_centroids = 3
     k = KMeansClassifier(num_centroids)
@@ -182,3 +292,73 @@ def testKMeansClassifier():
             set(res1) != set(res2)
             ), ("Error in K-Means classifier. "
                 "This might be a bug or just a local minimum.")
+
+def testKMeansClassifier_hamerly():
+    # Hamerly's algorithm must converge to the same centroids as Lloyd's
+    # algorithm when started from the same initial centroids
+    a = numx.concatenate([numx_rand.normal(size=(200, 3)) + 4*i
+                          for i in range(5)])
+    init = a[numx_rand.permutation(len(a))[:20]].copy()
+    k_lloyd = KMeansClassifier(20)
+    k_lloyd.train(a)
+    k_lloyd._centroids = init.copy()
+    k_lloyd.stop_training()
+    k_hamerly = KMeansClassifier(20, algorithm='hamerly')
+    k_hamerly.train(a)
+    k_hamerly._centroids = init.copy()
+    k_hamerly.stop_training()
+    assert_array_almost_equal(k_lloyd._centroids, k_hamerly._centroids)
+    assert k_lloyd.label(a) == k_hamerly.label(a)
+
+def testKMeansClassifier_minibatch():
+    k = KMeansClassifier(2, algorithm='minibatch', init='k-means++')
+    a1 = numx.random.rand(500, 2) - 1
+    a2 = numx.random.rand(500, 2) + 1
+    a = numx.concatenate((a1, a2))
+    a = a[numx_rand.permutation(len(a))]
+    for chunk in range(10):
+        k.train(a[chunk*100:(chunk+1)*100])
+    k.stop_training()
+    assert k._counts.sum() == 1000
+    res1 = k.label(a1)
+    res2 = k.label(a2)
+    assert (len(set(res1)) == 1 and
+            len(set(res2)) == 1 and
+            set(res1) != set(res2))
+    assert_array_almost_equal(sorted(k._centroids[:, 0]), [-0.5, 1.5], 1)
+
+def testKMeansClassifier_blocks():
+    # the assignment is computed in blocks of points
+    a = numx.concatenate([numx_rand.normal(size=(100, 3)) + 4*i
+                          for i in range(5)])
+    init = a[numx_rand.permutation(len(a))[:10]].copy()
+    centroids = []
+    for kwargs in ({}, {'block_size': 70}):
+        k = KMeansClassifier(10, algorithm='hamerly', **kwargs)
+        k.train(a)
+        k._centroids = init.copy()
+        k.stop_training()
+        centroids.append(k._centroids)
+    assert_array_equal(centroids[0], centroids[1])
+
+def testKMeansClassifier_minibatch_centroids():
+    # the initial centroids can be given before training
+    k = KMeansClassifier(2, algorithm='minibatch')
+    k._centroids = numx.array([[-1., -1.], [2., 2.]])
+    k.train(numx.random.rand(100, 2) - 1)
+    k.train(numx.random.rand(100, 2) + 1)
+    k.stop_training()
+    assert_array_equal(k._counts, [100, 100])
+    assert_array_almost_equal(k._centroids, [[-0.5, -0.5], [1.5, 1.5]], 1)
+
+def testKMeansClassifier_minibatch_small_chunks():
+    # the initial centroids are chosen once enough data was seen
+    k = KMeansClassifier(3, algorithm='minibatch')
+    k.train(numx_rand.random((2, 2)))
+    assert k._centroids is None
+    k.train(numx_rand.random((2, 2)))
+    assert k._centroids.shape == (3, 2)
+    k.stop_training()
+    k = KMeansClassifier(3, algorithm='minibatch')
+    k.train(numx_rand.random((2, 2)))
+    py.test.raises(mdp.TrainingException, k.stop_training)
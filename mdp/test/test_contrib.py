@@ -199,6 +199,59 @@ def test_HLLENode():
         assert numx.all(res[idx,0]-res[idx[0],0]<1e-2),\
                'Projection should be aligned as original space'
 
+def test_LLENode_HLLENode_sparse():
+    # the sparse solver must find the same projection as the dense one
+    nt, ny = 40, 15
+    x, y, z, t = _s_shape_2D(nt, ny)
+    data = numx.asarray([x,y,z]).T
+    for klass in (mdp.nodes.LLENode, mdp.nodes.HLLENode):
+        dense = klass(8, r=0.001, output_dim=2, svd=False)(data)
+        sparse = klass(8, r=0.001, output_dim=2, sparse=True)(data)
+        # eigenvectors are defined up to the sign
+        sign = numx.sign((dense*sparse).sum(axis=0))
+        assert_array_almost_equal(sparse*sign, dense, 4)
+
+def test_LLENode_neighbors():
+    # both the KD-tree and the chunked search (for dim > 10) must give
+    # the nearest neighbors, sorted by distance
+    k = 5
+    for dim in (3, 12):
+        data = numx_rand.random((300, dim))
+        node = mdp.nodes.LLENode(k, output_dim=2)
+        node.train(data)
+        node.stop_training()
+        dist = ((data[:, numx.newaxis, :] - data)**2).sum(axis=2)
+        dist[numx.arange(300), numx.arange(300)] = numx.inf
+        assert_array_equal(node._get_training_neighbors(),
+                           dist.argsort(axis=1)[:, :k])
+        nbrs = node._find_neighbors(data[:10], k, chunk_size=3)
+        assert_array_equal(nbrs[:, 0], numx.arange(10))
+
+def test_LLENode_execute():
+    # compare the batched out-of-sample mapping with a point by point one
+    k = 8
+    data = numx_rand.random((400, 3))
+    x = numx_rand.random((50, 3))
+    for r in (0.001, None):
+        node = mdp.nodes.LLENode(k, r=r, output_dim=2)
+        node.train(data)
+        node.stop_training()
+        y = node.execute(x)
+        for i in range(x.shape[0]):
+            M_xi = data - x[i]
+            nbrs = ((M_xi**2).sum(1)).argsort()[:k]
+            M_xi = M_xi[nbrs]
+            Q = mult(M_xi, M_xi.T)
+            if r is None:
+                r_i = (mdp.utils.svd(M_xi, compute_uv=0)**2)[2:].sum()
+            else:
+                r_i = r
+            Q += r_i*numx.eye(k)
+            w = mdp.numx_linalg.solve(Q, numx.ones(k))
+            w /= w.sum()
+            assert_array_almost_equal(y[i],
+                                      mult(w, node.training_projection[nbrs]))
+
 def test_XSFANode():
     T = 5000
     N = 3
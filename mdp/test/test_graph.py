@@ -144,3 +144,82 @@ def testConnectedComponents():
     g.add_edge(nds0[0], nds1[0])
     assert g.is_weakly_connected()
 
+
+def testCompactGraphAdapter():
+    g = graph.CompactGraphAdapter()
+    nodes = g.add_tree( (1,(2,3),(2,3)) )
+    assert len(g.nodes)==5
+    assert len(g.edges)==4
+    assert [x.data for x in g.dfs(nodes[0])]==[1,2,3,2,3]
+    assert [x.data for x in g.bfs(nodes[0])]==[1,2,2,3,3]
+    assert [x.data for x in g.undirected_dfs(nodes[2][1])]==[3,2,1,2,3]
+    assert [x.data for x in g.undirected_bfs(nodes[2][1])]==[3,2,1,2,3]
+    # handles are unique, so they can be used as dictionary keys
+    assert nodes[1][0] in nodes[0].out_neighbors()
+    assert nodes[1][1].in_neighbors()==[nodes[1][0]]
+    ed = nodes[1][1].get_edges_in()[0]
+    assert ed.get_ends()==(nodes[1][0], nodes[1][1])
+    g.remove_edge(ed)
+    assert len(g.edges)==3
+    assert nodes[1][0].out_degree()==0
+    assert len(g.connected_components())==2
+    assert not g.is_weakly_connected()
+    g.remove_node(nodes[1][1])
+    assert len(g.nodes)==4
+    assert g.is_weakly_connected()
+    try:
+        g.remove_node(nodes[1][1])
+        raise Exception('Expected graph.GraphException.')
+    except graph.GraphException:
+        pass
+
+def testCompactGraphTopologicalSort():
+    g = graph.CompactGraphAdapter()
+    nds = g.add_tree( (0, 3, 1, 2) )
+    g.add_edge(nds[2], nds[1])
+    g.add_edge(nds[2], nds[3])
+    g.add_edge(nds[3], nds[1])
+    data = [x.data for x in g.topological_sort()]
+    assert data==[0,1,2,3]
+    g.add_edge(nds[1], nds[0])
+    try:
+        g.topological_sort()
+        raise Exception('Expected graph.GraphTopologicalException.')
+    except graph.GraphTopologicalException:
+        pass
+
+def testCompactGraphCSR():
+    g = graph.CompactGraph()
+    nds = [g.add_node(i) for i in range(4)]
+    eds = [g.add_edge(nds[i], nds[j]) for i, j in [(0,1), (0,2), (2,3), (1,3)]]
+    g.remove_edge(eds[0])
+    assert g.n_edges==3
+    assert g.edges_out(nds[0])==[eds[1]]
+    indptr, indices, edges = g.csr()
+    assert list(indptr)==[0,1,2,3,3]
+    assert list(indices)==[2,3,3]
+    assert list(edges)==[eds[1], eds[3], eds[2]]
+    assert list(g.connected_components())==[0,0,0,0]
+    g.remove_node(nds[2])
+    assert list(g.nodes())==[0,1,3]
+    assert list(g.connected_components())==[0,1,-1,1]
+
+def testCompactGraphVisit():
+    g = graph.CompactGraphAdapter()
+    nodes = g.add_tree( (1,(2,3),(2,3)) )
+    visited = []
+    assert g.bfs(nodes[0], visited.append) == visited
+    # visit_fct is called during the traversal
+    class _Stop(Exception):
+        pass
+    def visit_fct(node):
+        visited.append(node)
+        if len(visited) == 2:
+            raise _Stop()
+    visited = []
+    try:
+        g.dfs(nodes[0], visit_fct)
+        raise Exception('Expected _Stop.')
+    except _Stop:
+        pass
+    assert [x.data for x in visited] == [1, 2]
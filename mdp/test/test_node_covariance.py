@@ -15,6 +15,20 @@ def testCovarianceMatrix():
     assert_array_almost_equal(act_avg,des_avg, decimal)
     assert_array_almost_equal(act_cov,des_cov, decimal)
 
+def testCovarianceMatrix_update_moments():
+    mat,mix,inp = get_random_mix()
+    des_cov = utils.CovarianceMatrix()
+    des_cov.update(inp)
+    des_cov,des_avg,des_tlen = des_cov.fix()
+    act_cov = utils.CovarianceMatrix()
+    act_cov.update(inp[:100])
+    act_cov.update_moments(mult(inp[100:].T, inp[100:]),
+                           inp[100:].sum(axis=0), inp.shape[0]-100)
+    act_cov,act_avg,act_tlen = act_cov.fix()
+    assert_equal(act_tlen, des_tlen)
+    assert_array_almost_equal(act_avg,des_avg, decimal)
+    assert_array_almost_equal(act_cov,des_cov, decimal)
+
 def testDelayCovarianceMatrix():
     dt = 5
     mat,mix,inp = get_random_mix()
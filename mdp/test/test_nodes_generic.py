@@ -318,6 +318,9 @@ def CCIPCANode_inp_arg_gen():
     dict(klass='TimeDelaySlidingWindowNode',
          init_args=[3, 4],
          inp_arg_gen=_rand_array_single_rows),
+    dict(klass='TimeFramesLinearNode',
+         init_args=[lambda: nodes.TimeFramesNode(3, 4),
+                    lambda: nodes.SFANode()]),
     dict(klass='FDANode',
          sup_arg_gen=_rand_labels),
     dict(klass='GaussianClassifier',
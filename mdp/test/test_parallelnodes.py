@@ -2,6 +2,7 @@
 from builtins import range
 from builtins import object
 from past.utils import old_div
+import pickle
 import mdp.parallel as parallel
 from ._tools import *
 
@@ -124,6 +125,18 @@ def test_ParallelHistogramNode_fraction():
         node.join(forked_node)
     assert len(node.data_hist) < 1000
 
+def test_ParallelHistogramNode_size():
+    """Test HistogramNode with a bounded history."""
+    node = parallel.ParallelHistogramNode(hist_size=50)
+    x = numx.arange(200.).reshape((100, 2))
+    for chunk in [x[:10], x[10:70], x[70:]]:
+        forked_node = node.fork()
+        forked_node.train(chunk)
+        node.join(forked_node)
+    assert node.data_hist.shape == (50, 2)
+    assert len(set(node.data_hist[:,0])) == 50
+    assert numx.all(node.data_hist[:,1] == node.data_hist[:,0] + 1)
+
 
 class TestDerivedParallelMDPNodes(object):
     """Test derived nodes that use the parallel node classes."""
@@ -175,3 +188,152 @@ def test_SFA2Node(self):
         node.stop_training()
         node.execute(x_test)
 
+
+def test_LLENode_HLLENode_scheduler():
+    """Test the local fits of LLENode and HLLENode with a scheduler."""
+    x = numx_rand.random((300, 3))
+    for klass in (mdp.nodes.LLENode, mdp.nodes.HLLENode):
+        node = klass(8, output_dim=2)
+        node.train(x)
+        node.stop_training()
+        scheduler = parallel.ThreadScheduler(n_threads=2)
+        parallel_node = klass(8, output_dim=2)
+        parallel_node.train(x)
+        parallel_node.stop_training(scheduler=scheduler, chunk_size=70)
+        scheduler.shutdown()
+        assert_array_almost_equal(abs(node.training_projection),
+                                  abs(parallel_node.training_projection))
+
+
+def test_ParallelRBMNode():
+    """Test the synchronous averaging of the RBM deltas."""
+    x = (numx_rand.random((200, 6)) > 0.5).astype('d')
+    node = parallel.ParallelRBMNode(4, visible_dim=6)
+    forked_nodes = [node.fork() for _ in range(4)]
+    base = (node.w.copy(), node.bv.copy(), node.bh.copy())
+    for i, forked_node in enumerate(forked_nodes):
+        forked_node.train(x[i*50:(i+1)*50], batch_size=10)
+    # join two forks before joining them into the parent
+    forked_nodes[0].join(forked_nodes[1])
+    deltas = [[forked.w - base[0], forked.bv - base[1], forked.bh - base[2]]
+              for forked in forked_nodes]
+    for forked_node in [forked_nodes[0]] + forked_nodes[2:]:
+        node.join(forked_node)
+    assert_array_almost_equal(node.w, base[0] + sum(d[0] for d in deltas) / 4)
+    assert_array_almost_equal(node.bv, base[1] + sum(d[1] for d in deltas) / 4)
+    assert_array_almost_equal(node.bh, base[2] + sum(d[2] for d in deltas) / 4)
+    # a fork of the updated parameters starts a new step
+    step_w = node.w.copy()
+    forked_node = node.fork()
+    forked_node.train(x[:50])
+    node.join(forked_node)
+    assert_array_almost_equal(node.w, forked_node.w)
+    assert numx.any(node.w != step_w)
+    node.stop_training()
+    assert node.execute(x).shape == (200, 4)
+
+def test_ParallelRBMNode_async():
+    """Test the bounded staleness of the asynchronous RBM updates."""
+    x = (numx_rand.random((100, 6)) > 0.5).astype('d')
+    node = parallel.ParallelRBMNode(4, visible_dim=6, max_staleness=0)
+    forked_nodes = [node.fork() for _ in range(2)]
+    for i, forked_node in enumerate(forked_nodes):
+        forked_node.train(x[i*50:(i+1)*50])
+    node.join(forked_nodes[0])
+    assert_array_almost_equal(node.w, forked_nodes[0].w)
+    # the second delta is based on outdated parameters and is discarded
+    node.join(forked_nodes[1])
+    assert_array_almost_equal(node.w, forked_nodes[0].w)
+    node.max_staleness = 1
+    forked_node = node.fork()
+    forked_node.train(x[:50])
+    w = node.w.copy()
+    node.join(node.fork())
+    node.join(forked_node)
+    assert_array_almost_equal(node.w, forked_node.w)
+    assert numx.any(node.w != w)
+
+def test_ParallelRBMNode_momentum():
+    """Test that the averaged momentum of the forks is joined."""
+    x = (numx_rand.random((100, 6)) > 0.5).astype('d')
+    node = parallel.ParallelRBMNode(4, visible_dim=6)
+    forked_nodes = [node.fork() for _ in range(2)]
+    for i, forked_node in enumerate(forked_nodes):
+        forked_node.train(x[i*50:(i+1)*50], momentum=0.9)
+    for forked_node in forked_nodes:
+        node.join(forked_node)
+    for i in range(3):
+        assert_array_almost_equal(node._delta[i],
+                                  (forked_nodes[0]._delta[i] +
+                                   forked_nodes[1]._delta[i]) / 2)
+    # the next forks continue from the joined momentum
+    forked_node = node.fork()
+    assert_array_almost_equal(forked_node._delta[0], node._delta[0])
+
+def test_ParallelRBMNode_pickled_fork():
+    """Test that a pickled trained fork only keeps its deltas."""
+    x = (numx_rand.random((100, 6)) > 0.5).astype('d')
+    node = parallel.ParallelRBMNode(4, visible_dim=6)
+    forked_node = pickle.loads(pickle.dumps(node.fork(), -1))
+    w = node.w.copy()
+    assert_array_almost_equal(forked_node._fork_base[0], w)
+    forked_node.train(x)
+    delta = forked_node.w - w
+    unpickled_node = pickle.loads(pickle.dumps(forked_node, -1))
+    assert unpickled_node.w is None
+    assert unpickled_node._fork_base is None
+    py.test.raises(parallel.NotForkableParallelException,
+                   forked_node.fork)
+    node.join(unpickled_node)
+    assert_array_almost_equal(node.w, w + delta)
+
+def test_ParallelRBMNode_extension():
+    """Test the forking of an RBMNode with the parallel extension."""
+    x = (numx_rand.random((100, 6)) > 0.5).astype('d')
+    l = numx.zeros((100, 2))
+    l[numx.arange(100), numx_rand.randint(0, 2, 100)] = 1.
+    node = mdp.nodes.RBMNode(4, visible_dim=6)
+    labels_node = mdp.nodes.RBMWithLabelsNode(4, 2, visible_dim=6)
+    mdp.activate_extension("parallel")
+    try:
+        for rbm_node, args in [(node, (x,)), (labels_node, (x, l)),
+                               (mdp.nodes.RBMNode(4, visible_dim=6), (x,))]:
+            forked_node = rbm_node.fork()
+            forked_node.train(*args)
+            rbm_node.join(forked_node)
+            assert_array_almost_equal(rbm_node.w, forked_node.w)
+            rbm_node.stop_training()
+    finally:
+        mdp.deactivate_extension("parallel")
+
+def test_ParallelRBMNode_flow():
+    """Test the RBM training through a ParallelFlow."""
+    x = (numx_rand.random((200, 6)) > 0.5).astype('d')
+    flow = parallel.ParallelFlow([parallel.ParallelRBMNode(4, visible_dim=6)])
+    node = flow[0]
+    node._init_weights()
+    w = node.w.copy()
+    scheduler = parallel.ThreadScheduler(n_threads=2)
+    flow.train([[x[i*50:(i+1)*50] for i in range(4)]], scheduler=scheduler)
+    scheduler.shutdown()
+    assert not node.is_training()
+    assert numx.any(node.w != w)
+
+def test_ParallelRBMWithLabelsNode():
+    """Test the parallel RBMWithLabelsNode."""
+    x = (numx_rand.random((100, 6)) > 0.5).astype('d')
+    l = numx.zeros((100, 2))
+    l[numx.arange(100), numx_rand.randint(0, 2, 100)] = 1.
+    node = parallel.ParallelRBMWithLabelsNode(4, 2, visible_dim=6)
+    assert node.max_staleness is None
+    forked_nodes = [node.fork() for _ in range(2)]
+    base = node.w.copy()
+    for i, forked_node in enumerate(forked_nodes):
+        forked_node.train(x[i*50:(i+1)*50], l[i*50:(i+1)*50])
+    for forked_node in forked_nodes:
+        node.join(forked_node)
+    assert_array_almost_equal(node.w, (forked_nodes[0].w +
+                                       forked_nodes[1].w) / 2)
+    assert numx.any(node.w != base)
+    node.stop_training()
+    assert node.execute(x, l).shape == (100, 4)
@@ -85,6 +85,23 @@ def test_mult_diag():
     res2 = utils.mult_diag(d, mtx, left=False)
     assert_array_almost_equal(res1, res2, 10)
 
+def test_apply_stacked():
+    a = numx_rand.random((4, 3, 3)) + 3*numx.eye(3)
+    b = numx_rand.random((4, 3, 2))
+    x = utils.apply_stacked(numx_linalg.solve, a, b)
+    assert x.shape == (4, 3, 2)
+    for i in range(4):
+        assert_array_almost_equal(x[i], numx_linalg.solve(a[i], b[i]), 10)
+    s = utils.apply_stacked(numx_linalg.svd, a[:, :2], compute_uv=False)
+    assert s.shape == (4, 2)
+    # a stack with as many matrices as rows
+    x = utils.apply_stacked(numx_linalg.solve, a[:3], b[:3])
+    for i in range(3):
+        assert_array_almost_equal(x[i], numx_linalg.solve(a[i], b[i]), 10)
+    # errors for single matrices are not caught
+    py.test.raises((ValueError, numx_linalg.LinAlgError),
+                   utils.apply_stacked, numx_linalg.solve, a[0, :2], b[0, :2])
+
 def test_symeig_fake_integer():
     a = numx.array([[1,2],[2,7]])
     b = numx.array([[3,1],[1,5]])
@@ -4,12 +4,13 @@
 
 from .routines import (timediff, refcast, scast, rotate, random_rot,
                       permute, symrand, norm2, cov2,
-                      mult_diag, comb, sqrtm, get_dtypes, nongeneral_svd,
+                      mult_diag, comb, sqrtm, apply_stacked, get_dtypes,
+                      nongeneral_svd,
                       hermitian, cov_maxima,
                       lrep, rrep, irep, orthogonal_permutations,
                       izip_stretched,
                       weighted_choice, bool_to_sign, sign_to_bool, gabor,
-                      invert_exp_funcs2)
+                      invert_exp_funcs2, invert_exp_funcs_batch)
 try:
     from collections import OrderedDict
 except ImportError:
@@ -82,7 +83,7 @@ def svd(x, compute_uv = True):
 
 __all__ = ['CovarianceMatrix', 'DelayCovarianceMatrix','CrossCovarianceMatrix',
            'MultipleCovarianceMatrices', 'QuadraticForm',
-           'QuadraticFormException',
+           'QuadraticFormException', 'apply_stacked',
            'comb', 'cov2', 'dig_node', 'get_dtypes', 'get_node_size',
            'hermitian', 'inv', 'mult', 'mult_diag', 'nongeneral_svd',
            'norm2', 'permute', 'pinv', 'progressinfo',
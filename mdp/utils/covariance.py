@@ -90,6 +90,22 @@ def update(self, x):
         self._avg += x.sum(axis=0)
         self._tlen += x.shape[0]
 
+    def update_moments(self, cov_mtx, avg, tlen):
+        """Update internal structures with precomputed moments.
+
+        cov_mtx -- Sum of the outer products of the observations.
+        avg -- Sum of the observations.
+        tlen -- Number of observations.
+
+        This is equivalent to calling 'update' with the observations.
+        """
+        if self._cov_mtx is None:
+            self._init_internals(numx.zeros((0, cov_mtx.shape[0]),
+                                            dtype=cov_mtx.dtype))
+        self._cov_mtx += mdp.utils.refcast(cov_mtx, self._dtype)
+        self._avg += mdp.utils.refcast(avg, self._dtype)
+        self._tlen += tlen
+
     def fix(self, center=True):
         """Returns a triple containing the covariance matrix, the average and
         the number of observations. The covariance matrix is then reset to
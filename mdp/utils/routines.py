@@ -240,6 +240,19 @@ def sqrtm(A):
     return mdp.utils.mult(V, mult_diag(numx.sqrt(d), V.T))
 
 # replication functions
+def apply_stacked(func, *arrays, **kwargs):
+    """Apply the linear algebra function func to stacks of matrices.
+
+    The arrays have the matrices along their last two dimensions. The
+    numpy functions are called once with the whole stacks, other
+    functions (e.g., from scipy.linalg) once for each matrix of the stacks.
+    """
+    if (arrays[0].ndim < 3 or
+        getattr(func, '__module__', '').split('.')[0] == 'numpy'):
+        return func(*arrays, **kwargs)
+    return numx.array([apply_stacked(func, *mtxs, **kwargs)
+                       for mtxs in zip(*arrays)])
+
 def lrep(x, n):
     """Replicate x n-times on a new first dimension"""
     shp = [1]
@@ -476,3 +489,89 @@ def invert_exp_funcs2(exp_x_noisy, dim_x, exp_funcs, use_hint=False, k=0.0):
 
     app_exp_x = numx.concatenate([func(app_x) for func in exp_funcs],axis=1)
     return app_x, app_exp_x
+
+def invert_exp_funcs_batch(exp_x_noisy, dim_x, exp_funcs, use_hint=False,
+                           k=0.0, max_iter=100, ftol=1e-12):
+    """Approximates a preimage app_x of exp_x_noisy, for all samples at once.
+
+    This function solves the same problem as invert_exp_funcs2, but instead
+    of calling scipy.optimize.leastsq for each sample it performs
+    Levenberg-Marquardt (damped Gauss-Newton) iterations on all the samples
+    together: since each sample only depends on its own preimage the
+    Jacobian is block diagonal, and its blocks are computed by finite
+    differences with dim_x+1 evaluations of exp_funcs on the whole array.
+    The expansion functions must therefore operate on each row separately.
+
+    use_hint, k: see invert_exp_funcs2
+
+    max_iter: maximum number of iterations
+    ftol: samples for which the relative reduction of the objective
+          function is below ftol are considered converged
+
+    Returns the tuple (app_x, exp_funcs(app_x)).
+    """
+    def expand(x):
+        return numx.concatenate([func(x) for func in exp_funcs], axis=1)
+
+    exp_x_noisy = numx.asarray(exp_x_noisy, dtype='d')
+    num_samples, dim_y = exp_x_noisy.shape
+    if isinstance(use_hint, numx.ndarray):
+        app_x = numx.array(use_hint, dtype='d')
+    elif use_hint == True:
+        app_x = exp_x_noisy[:,0:dim_x].copy()
+    else:
+        app_x = numx.random.normal(size=(num_samples,dim_x))
+    x_orig = app_x.copy()
+
+    # weights of the two terms of the objective function
+    w_y, w_x = ((1.-k)/dim_y)**0.5, (k/dim_x)**0.5
+    def residuals(idx, x, exp_x):
+        return numx.concatenate((w_y*(exp_x_noisy[idx]-exp_x),
+                                 w_x*(x_orig[idx]-x)), axis=1)
+
+    app_exp_x = expand(app_x)
+    idx = numx.arange(num_samples)
+    res = residuals(idx, app_x, app_exp_x)
+    cost = (res**2).sum(axis=1)
+    damping = numx.zeros(num_samples) + 1e-3
+    eps = numx.finfo('d').eps
+    for _ in range(max_iter):
+        if len(idx) == 0:
+            break
+        x, exp_x = app_x[idx], app_exp_x[idx]
+        # Jacobians of the residuals, one column at a time
+        jac = numx.zeros((len(idx), dim_y+dim_x, dim_x))
+        jac[:, dim_y:, :] = -w_x*numx.eye(dim_x)
+        for j in range(dim_x):
+            step = eps**0.5 * numx.maximum(abs(x[:,j]), 1.)
+            x_step = x.copy()
+            x_step[:,j] += step
+            jac[:, :dim_y, j] = -w_y*(expand(x_step)-exp_x)/step[:,numx.newaxis]
+        # damped normal equations of all the samples
+        jtj = numx.matmul(jac.transpose(0, 2, 1), jac)
+        jtr = numx.matmul(jac.transpose(0, 2, 1), res[idx][:,:,numx.newaxis])
+        diag = jtj.diagonal(axis1=1, axis2=2)
+        jtj[:, numx.arange(dim_x), numx.arange(dim_x)] += (
+            damping[idx][:,numx.newaxis] * (diag + eps))
+        delta = apply_stacked(numx_linalg.solve, jtj, -jtr)[:,:,0]
+        # accept the steps which reduce the objective function
+        x_new = x + delta
+        exp_x_new = expand(x_new)
+        res_new = residuals(idx, x_new, exp_x_new)
+        cost_new = (res_new**2).sum(axis=1)
+        better = cost_new < cost[idx]
+        better_idx = idx[better]
+        converged = numx.zeros(len(idx), dtype=bool)
+        converged[better] = (cost[better_idx]-cost_new[better] <=
+                             ftol*cost[better_idx])
+        app_x[better_idx] = x_new[better]
+        app_exp_x[better_idx] = exp_x_new[better]
+        res[better_idx] = res_new[better]
+        cost[better_idx] = cost_new[better]
+        damping[better_idx] /= 10.
+        damping[idx[~better]] *= 10.
+        # stop when there is no progress at all
+        converged |= damping[idx] > 1e10
+        converged |= cost[idx] == 0.
+        idx = idx[~converged]
+    return app_x, app_exp_x